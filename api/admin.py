@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 # Importamos ModelForm, que es más flexible que UserCreationForm para AbstractBaseUser
 from django import forms
 from django.utils.translation import gettext_lazy as _
-from .models import User, Pet, Dispenser, Horario
+from .models import User, Pet, Dispenser, Horario, Grabacion, AudioClip, MediaBlob, Tarea
 
 # Paso 1: Crear un formulario de adición basado en Email usando ModelForm
 class UserAdminCreationForm(forms.ModelForm):
@@ -111,9 +111,11 @@ class DispenserAdmin(admin.ModelAdmin):
         'FP',
         'WP',
         'user',
-        'pet'
+        'pet',
+        'transporte',
+        'puerto',
     )
-    list_filter = ('status', 'FP', 'WP', 'user', 'pet')
+    list_filter = ('status', 'FP', 'WP', 'transporte', 'user', 'pet')
     # CRÍTICO: Búsqueda por user__email
     search_fields = ('ubication', 'user__email', 'pet__name') 
     ordering = ('id',)
@@ -126,4 +128,30 @@ class HorarioAdmin(admin.ModelAdmin):
     
     def horarios_display(self, obj):
         return ", ".join(obj.horarios) if obj.horarios else "Sin horarios"
-    horarios_display.short_description = 'Horarios'
\ No newline at end of file
+    horarios_display.short_description = 'Horarios'
+
+@admin.register(Grabacion)
+class GrabacionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'usuario', 'origen', 'estado', 'duracion', 'progreso', 'creado_en']
+    list_filter = ['estado', 'origen']
+    search_fields = ['usuario__email']
+    ordering = ('-creado_en',)
+
+@admin.register(AudioClip)
+class AudioClipAdmin(admin.ModelAdmin):
+    list_display = ['id', 'nombre', 'usuario', 'duracion', 'creado_en']
+    search_fields = ['nombre', 'usuario__email']
+    ordering = ('-creado_en',)
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'tamano', 'referencias', 'actualizado_en']
+    search_fields = ['hash']
+    readonly_fields = ['hash', 'nombre', 'tamano', 'referencias', 'creado_en', 'actualizado_en']
+
+@admin.register(Tarea)
+class TareaAdmin(admin.ModelAdmin):
+    list_display = ['id', 'tipo', 'estado', 'intentos', 'ejecutar_despues', 'actualizado_en']
+    list_filter = ['estado', 'tipo']
+    search_fields = ['error']
+    ordering = ('-id',)
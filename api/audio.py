@@ -0,0 +1,70 @@
+"""
+Audios subidos por los usuarios: archivos temporales para la cola de
+reproducción y la biblioteca de AudioClip (transcodificados una sola vez).
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+from django.conf import settings
+
+from core.raspi_controller import transcodificar_audio
+
+from .hardware import obtener_reproductor
+from .models import AudioClip, Horario
+from .scheduler import normalizar_horarios
+
+
+def guardar_temporal(archivo_subido):
+    """Copia la subida por bloques a un archivo con nombre único y devuelve su ruta."""
+    os.makedirs(settings.AUDIO_UPLOAD_DIR, exist_ok=True)
+    # El nombre original solo aporta la extensión
+    extension = os.path.splitext(archivo_subido.name)[1][:10]
+    with tempfile.NamedTemporaryFile(dir=settings.AUDIO_UPLOAD_DIR, suffix=extension, delete=False) as destino:
+        for chunk in archivo_subido.chunks():
+            destino.write(chunk)
+    return destino.name
+
+
+def crear_audio_clip(usuario, nombre, archivo_subido):
+    """Transcodifica la subida a WAV y crea el AudioClip. Devuelve (clip, error)."""
+    ruta_temporal = guardar_temporal(archivo_subido)
+    nombre_archivo = f"audios/clip_{uuid.uuid4().hex}.wav"
+    ruta_salida = os.path.join(settings.MEDIA_ROOT, nombre_archivo)
+    try:
+        output, success = transcodificar_audio(ruta_temporal, ruta_salida)
+    finally:
+        os.remove(ruta_temporal)
+
+    if not success:
+        if os.path.exists(ruta_salida):
+            os.remove(ruta_salida)
+        return None, output
+
+    clip = AudioClip.objects.create(
+        usuario=usuario, nombre=nombre, archivo=nombre_archivo, duracion=round(output['duracion'], 2)
+    )
+    return clip, None
+
+
+def reproducir_clip(clip):
+    """Encola un AudioClip (el archivo se conserva al terminar)."""
+    return obtener_reproductor().encolar(clip.archivo.path, borrar_al_terminar=False, usuario_id=clip.usuario_id)
+
+
+def reproducir_audios_comida(dispensador_id, hora):
+    """Encola los audios de los Horario del dispensador que incluyen esa hora."""
+    rutas = {}
+    horarios = Horario.objects.filter(
+        dispensador_id=dispensador_id, audio__isnull=False
+    ).select_related('audio').only('horarios', 'usuario', 'audio__archivo')
+    for horario in horarios:
+        if hora in normalizar_horarios(horario.horarios):
+            rutas[horario.audio.archivo.path] = horario.usuario_id
+
+    for ruta, usuario_id in rutas.items():
+        try:
+            obtener_reproductor().encolar(ruta, borrar_al_terminar=False, usuario_id=usuario_id)
+        except Exception as e:
+            print(f"❌ No se pudo encolar el audio {ruta}: {e}", file=sys.stderr)
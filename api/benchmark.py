@@ -0,0 +1,318 @@
+"""
+Benchmark de la API REST: siembra un conjunto de datos sintético, recorre las
+rutas de api/urls.py con el cliente de pruebas de DRF y mide por ruta el
+número de consultas SQL, la latencia (p50/p95/máx) y el tamaño de respuesta.
+
+Lo ejecuta `python manage.py benchmark_api` sobre una base de datos de
+pruebas; el reporte JSON sirve para comparar versiones. Con `hardware=True`
+también mide las rutas de la ESP32 (contra la ESP32 simulada de
+core/transports.py) y su comportamiento con peticiones concurrentes.
+"""
+import itertools
+import platform
+import statistics
+import threading
+import time
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User, Pet, Dispenser, Horario, Grabacion, AudioClip
+from .urls import router
+
+PREFIJO_API = '/api/v1'
+CONTRASENA = 'benchmark-123'
+
+# Rutas que necesitan la ESP32 o la cámara; no se miden
+VIEWSETS_HARDWARE = {'esp32', 'raspi'}
+# Rutas de la ESP32 que se miden con hardware=True: (acción, método, query string, datos)
+CASOS_ESP32 = [
+    ('read_sensor', 'get', '?sensor=PESO_A', None),
+    ('read_sensor', 'get', '?sensor=PESO_A&max_age=60', None),
+    ('read_sensors', 'get', '', None),
+    ('activate_motor', 'post', '', lambda: {}),
+    ('activate_pump', 'post', '', lambda: {}),
+    ('calibrate_tare', 'post', '', lambda: {'scale': 'A'}),
+    ('calibrate_set_weight', 'post', '', lambda: {'scale': 'A', 'known_weight': 500}),
+]
+# Acciones de creación que lanzan procesos (ffmpeg) en lugar de solo tocar la BD
+CREACION_OMITIDA = {
+    'grabaciones': "inicia una grabación con la cámara",
+    'audios': "transcodifica el archivo con ffmpeg",
+    'users': "solo staff; el alta normal se mide en auth/register",
+}
+# Descargas de archivos: los registros del benchmark no tienen archivo en disco
+ACCIONES_OMITIDAS = {
+    'grabaciones/archivo': "descarga un video que el benchmark no crea",
+    'audios/archivo': "descarga un audio que el benchmark no crea",
+}
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) por interpolación lineal."""
+    ordenados = sorted(valores)
+    if len(ordenados) == 1:
+        return ordenados[0]
+    posicion = (len(ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+def sembrar_datos(usuarios=1000, por_usuario=3, filas_principal=120):
+    """
+    Crea `usuarios` cuentas con `por_usuario` mascotas/dispensadores/horarios
+    cada una, más un usuario principal con `filas_principal` de cada cosa
+    (el que hace las peticiones, para que los listados tengan varias páginas).
+    Devuelve el usuario principal.
+    """
+    contrasena = make_password(CONTRASENA)  # Un solo hash para todas las cuentas
+    User.objects.bulk_create([
+        User(email=f'usuario{i}@benchmark.local', first_name='Usuario', last_name=str(i), password=contrasena)
+        for i in range(usuarios)
+    ], batch_size=500)
+    principal = User.objects.create(
+        email='principal@benchmark.local', first_name='Principal', password=contrasena
+    )
+
+    filas = [(usuario_id, por_usuario) for usuario_id in User.objects.exclude(id=principal.id).values_list('id', flat=True)]
+    filas.append((principal.id, filas_principal))
+
+    Pet.objects.bulk_create([
+        Pet(name=f'Mascota {i}', race='Mestizo', weight=5 + i % 20, age=1 + i % 12, user_id=usuario_id)
+        for usuario_id, cantidad in filas for i in range(cantidad)
+    ], batch_size=500)
+    mascotas = Pet.objects.values_list('id', 'user_id').order_by('id')
+    Dispenser.objects.bulk_create([
+        Dispenser(
+            ubication=f'Cocina {mascota_id}', FC=2, WC=150, status=mascota_id % 3 != 0,
+            horarios=['08:00', '18:00'], user_id=usuario_id, pet_id=mascota_id,
+        )
+        for mascota_id, usuario_id in mascotas
+    ], batch_size=500)
+    Horario.objects.bulk_create([
+        Horario(mascota_id=mascota_id, dispensador_id=dispensador_id, usuario_id=usuario_id, horarios=['08:00', '18:00'])
+        for dispensador_id, mascota_id, usuario_id in Dispenser.objects.values_list('id', 'pet_id', 'user_id')
+    ], batch_size=500)
+
+    Grabacion.objects.bulk_create([
+        Grabacion(usuario=principal, duracion=10, estado='completada', progreso=100,
+                  archivo=f'videos/grabacion_{i}.mp4')
+        for i in range(filas_principal)
+    ], batch_size=500)
+    AudioClip.objects.bulk_create([
+        AudioClip(usuario=principal, nombre=f'Audio {i}', archivo=f'audios/clip_{i}.wav', duracion=2)
+        for i in range(filas_principal)
+    ], batch_size=500)
+    return principal
+
+
+def construir_casos(usuario, hardware=False):
+    """
+    Lista de (nombre, método, url, datos) con todas las rutas del router más
+    las de autenticación, y un dict {ruta: motivo} con las que se omiten.
+    """
+    casos = []
+    omitidas = {}
+    contador = itertools.count()
+
+    casos.append(('auth/login', 'post', f'{PREFIJO_API}/auth/login/',
+                  lambda: {'email': usuario.email, 'password': CONTRASENA}))
+    casos.append(('auth/register', 'post', f'{PREFIJO_API}/auth/register/',
+                  lambda: {'email': f'nuevo{next(contador)}@benchmark.local', 'password': CONTRASENA,
+                           'first_name': 'Nuevo', 'last_name': 'Usuario'}))
+
+    # Un registro del usuario principal para las rutas de detalle
+    detalles = {
+        'users': usuario.id,
+        'pets': Pet.objects.filter(user=usuario).values_list('id', flat=True).first(),
+        'dispensers': Dispenser.objects.filter(user=usuario).values_list('id', flat=True).first(),
+        'horarios': Horario.objects.filter(usuario=usuario).values_list('id', flat=True).first(),
+        'grabaciones': Grabacion.objects.filter(usuario=usuario).values_list('id', flat=True).first(),
+        'audios': AudioClip.objects.filter(usuario=usuario).values_list('id', flat=True).first(),
+    }
+    creaciones = {
+        'pets': lambda: {'name': 'Nueva', 'race': 'Mestizo', 'weight': 4, 'age': 1},
+        'dispensers': lambda: {'ubication': 'Patio', 'FC': 2, 'WC': 100, 'status': True, 'FP': False, 'WP': False,
+                               'user': usuario.id},
+    }
+
+    for prefijo, viewset, _ in router.registry:
+        base = f'{PREFIJO_API}/{prefijo}/'
+        if prefijo == 'esp32' and hardware:
+            for accion, metodo, query, datos in CASOS_ESP32:
+                casos.append((f'{prefijo}/{accion}{query}', metodo, f'{base}{accion}/{query}', datos))
+            continue
+        if prefijo in VIEWSETS_HARDWARE:
+            omitidas[f'{prefijo}/*'] = "requiere hardware (ESP32 / cámara)"
+            continue
+
+        casos.append((f'{prefijo} (lista)', 'get', base, None))
+        casos.append((f'{prefijo} (lista, ?fields=id)', 'get', f'{base}?fields=id', None))
+        if detalles.get(prefijo):
+            casos.append((f'{prefijo} (detalle)', 'get', f'{base}{detalles[prefijo]}/', None))
+        if prefijo in creaciones:
+            casos.append((f'{prefijo} (crear)', 'post', base, creaciones[prefijo]))
+        elif prefijo in CREACION_OMITIDA:
+            omitidas[f'{prefijo} (crear)'] = CREACION_OMITIDA[prefijo]
+
+        for accion in viewset.get_extra_actions():
+            if 'get' not in accion.mapping:
+                continue
+            nombre = f'{prefijo}/{accion.url_path}'
+            if nombre in ACCIONES_OMITIDAS:
+                omitidas[nombre] = ACCIONES_OMITIDAS[nombre]
+                continue
+            if accion.detail:
+                url = f'{base}{detalles[prefijo]}/{accion.url_path}/'
+            else:
+                url = f'{base}{accion.url_path}/'
+            casos.append((nombre, 'get', url, None))
+
+    return casos, omitidas
+
+
+def medir(cliente, metodo, url, datos, repeticiones):
+    tiempos = []
+    consultas = []
+    for _ in range(repeticiones):
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            response = getattr(cliente, metodo)(url, datos() if datos else None, format='json')
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        consultas.append(len(capturadas))
+    return {
+        'metodo': metodo.upper(),
+        'url': url,
+        'status': response.status_code,
+        'consultas': max(consultas),
+        'p50_ms': round(statistics.median(tiempos), 2),
+        'p95_ms': round(percentil(tiempos, 95), 2),
+        'max_ms': round(max(tiempos), 2),
+        'bytes': len(response.content),
+    }
+
+
+def medir_concurrencia(token, url, hilos, por_hilo):
+    """
+    `hilos` clientes pidiendo `url` a la vez, `por_hilo` veces cada uno.
+    Mide la latencia vista por cada cliente, el rendimiento total y cuántas
+    peticiones fueron rechazadas (503, cola llena) o fallaron.
+    """
+    tiempos = []
+    estados = []
+    lock = threading.Lock()
+    barrera = threading.Barrier(hilos)
+
+    def cliente():
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        barrera.wait()
+        try:
+            for _ in range(por_hilo):
+                inicio = time.perf_counter()
+                try:
+                    estado = api.get(url).status_code
+                except Exception:
+                    estado = None
+                with lock:
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                    estados.append(estado)
+        finally:
+            connections.close_all()
+
+    trabajadores = [threading.Thread(target=cliente) for _ in range(hilos)]
+    inicio = time.perf_counter()
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    segundos = time.perf_counter() - inicio
+
+    return {
+        'url': url,
+        'hilos': hilos,
+        'peticiones': len(estados),
+        'por_segundo': round(len(estados) / segundos, 1),
+        'p50_ms': round(statistics.median(tiempos), 2),
+        'p95_ms': round(percentil(tiempos, 95), 2),
+        'max_ms': round(max(tiempos), 2),
+        'rechazadas_503': estados.count(503),
+        'errores': sum(1 for estado in estados if estado is None or (estado >= 400 and estado != 503)),
+    }
+
+
+def ejecutar_benchmark(usuarios=1000, repeticiones=20, filas_principal=120, hardware=False, hilos=8, al_medir=None):
+    """
+    Siembra los datos, mide todas las rutas y devuelve el reporte (dict).
+    Con `hardware=True` la ESP32 configurada (ESP32_TRANSPORT) debe ser la simulada.
+    """
+    inicio = time.perf_counter()
+    principal = sembrar_datos(usuarios=usuarios, filas_principal=filas_principal)
+    segundos_siembra = time.perf_counter() - inicio
+
+    token = str(RefreshToken.for_user(principal).access_token)
+    cliente = APIClient()
+    cliente.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    casos, omitidas = construir_casos(principal, hardware=hardware)
+    rutas = {}
+    for nombre, metodo, url, datos in casos:
+        rutas[nombre] = medir(cliente, metodo, url, datos, repeticiones)
+        if al_medir:
+            al_medir(nombre, rutas[nombre])
+
+    concurrencia = {}
+    if hardware:
+        # Todas las peticiones comparten la única conexión serial (y su cola)
+        for nombre, url in (
+            ('esp32/read_sensor', f'{PREFIJO_API}/esp32/read_sensor/?sensor=PESO_A'),
+            ('esp32/read_sensors', f'{PREFIJO_API}/esp32/read_sensors/'),
+        ):
+            concurrencia[nombre] = medir_concurrencia(token, url, hilos, repeticiones)
+
+    return {
+        'generado_en': timezone.now().isoformat(),
+        'entorno': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'base_de_datos': connection.vendor,
+        },
+        'datos': {
+            'usuarios': User.objects.count(),
+            'mascotas': Pet.objects.count(),
+            'dispensadores': Dispenser.objects.count(),
+            'horarios': Horario.objects.count(),
+            'segundos_siembra': round(segundos_siembra, 2),
+        },
+        'repeticiones': repeticiones,
+        'rutas': rutas,
+        'concurrencia': concurrencia,
+        'omitidas': omitidas,
+    }
+
+
+def comparar(anterior, actual, tolerancia=0.2):
+    """
+    Regresiones de `actual` frente a `anterior`: más consultas o un p95 más de
+    `tolerancia` (fracción) más lento. Devuelve una lista de textos.
+    """
+    regresiones = []
+    for nombre, medida in actual['rutas'].items():
+        previa = anterior.get('rutas', {}).get(nombre)
+        if previa is None:
+            continue
+        if medida['consultas'] > previa['consultas']:
+            regresiones.append(f"{nombre}: {previa['consultas']} → {medida['consultas']} consultas")
+        if medida['p95_ms'] > previa['p95_ms'] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p95 {previa['p95_ms']} → {medida['p95_ms']} ms")
+    for nombre, medida in actual.get('concurrencia', {}).items():
+        previa = anterior.get('concurrencia', {}).get(nombre)
+        if previa and medida['por_segundo'] < previa['por_segundo'] * (1 - tolerancia):
+            regresiones.append(f"{nombre} concurrente: {previa['por_segundo']} → {medida['por_segundo']} peticiones/s")
+    return regresiones
@@ -0,0 +1,218 @@
+"""
+Instancias compartidas del hardware (ESP32, cámara, bocina) para todo el proceso del servidor.
+
+Cada dispensador puede tener su propia ESP32 (Dispenser.transporte/puerto/baudrate):
+el registro mantiene abierta una conexión por dispositivo, cada una con su hilo de
+E/S, su cola de comandos y su poller, así que un solo servidor maneja varios
+comederos a la vez sin que uno bloquee a otro.
+"""
+import atexit
+import sys
+import threading
+
+from django.conf import settings
+from django.db import OperationalError, ProgrammingError
+
+from core.serial_manager import ESP32SerialManager
+from core.transports import crear_transporte
+from core.sensor_poller import CacheSensores, SensorPoller
+from core.camera_hub import CameraHub
+from core.audio_player import ReproductorAudio
+
+from .timeseries import almacen_lecturas
+
+_lock = threading.Lock()
+_camara = None
+_reproductor = None
+
+# Últimas lecturas conocidas de la ESP32 por defecto (las llena el poller y cualquier lectura directa)
+cache_sensores = CacheSensores()
+
+
+class Dispositivo:
+    """Una ESP32 conectada: su gestor serial (hilo de E/S propio), su cache y su poller."""
+
+    def __init__(self, transporte, cache, dispensadores_poller):
+        self.esp32 = ESP32SerialManager(
+            timeout_respuesta=settings.ESP32_TIMEOUT_COMANDO,
+            max_cola=settings.ESP32_MAX_COLA,
+            transporte=transporte,
+        )
+        self.cache = cache
+        self.poller = None
+        self.esp32.iniciar()
+
+        # El muestreo en segundo plano arranca junto con el gestor serial
+        if settings.ESP32_POLL_INTERVAL:
+            def al_leer(lecturas):
+                # Las muestras se guardan en la serie de tiempo de cada dispensador conectado
+                for dispensador_id in dispensadores_poller():
+                    almacen_lecturas.registrar(dispensador_id, lecturas)
+
+            self.poller = SensorPoller(
+                self.esp32, self.cache,
+                intervalo=settings.ESP32_POLL_INTERVAL,
+                al_leer=al_leer,
+            )
+            self.poller.iniciar()
+
+    def cerrar(self):
+        if self.poller:
+            self.poller.detener()
+        self.esp32.cerrar()
+
+
+# ESP32 por defecto (ESP32_TRANSPORT / ESP32_PUERTO), para los dispensadores sin transporte propio
+_por_defecto = None
+# Registro de dispositivos: un Dispositivo por conexión (transporte, puerto, baudrate),
+# compartido por los dispensadores que apunten a la misma
+_dispositivos = {}
+# dispensador_id -> clave de su conexión en _dispositivos
+_asignaciones = {}
+
+
+def crear_transporte_esp32():
+    """Transporte configurado en ESP32_TRANSPORT."""
+    if settings.ESP32_TRANSPORT == 'simulado':
+        return crear_transporte('simulado', baudrate=settings.ESP32_BAUDRATE, **settings.ESP32_SIMULADOR)
+    return crear_transporte(settings.ESP32_TRANSPORT, puerto=settings.ESP32_PUERTO, baudrate=settings.ESP32_BAUDRATE)
+
+
+def _transporte_dispensador(transporte, puerto, baudrate):
+    if transporte == 'tcp':
+        return crear_transporte('tcp', direccion=puerto)
+    if transporte == 'simulado':
+        return crear_transporte('simulado', baudrate=baudrate, **settings.ESP32_SIMULADOR)
+    return crear_transporte('serial', puerto=puerto, baudrate=baudrate)
+
+
+def _clave(dispensador):
+    if not dispensador.transporte:
+        return None
+    if dispensador.transporte == 'simulado':
+        # Cada dispensador simulado es una placa distinta
+        return ('simulado', dispensador.id)
+    return (dispensador.transporte, dispensador.puerto, dispensador.baudrate)
+
+
+def _dispensadores_de(clave):
+    with _lock:
+        return [dispensador_id for dispensador_id, asignada in _asignaciones.items() if asignada == clave]
+
+
+def _soltar_si_no_usado(clave):
+    """
+    Quita del registro la conexión si ya ningún dispensador la usa y la
+    devuelve para cerrarla fuera del lock (su poller puede estar esperándolo).
+    Requiere el lock.
+    """
+    if clave in _dispositivos and clave not in _asignaciones.values():
+        return _dispositivos.pop(clave)
+    return None
+
+
+def obtener_dispositivo(dispensador=None):
+    """
+    Devuelve el Dispositivo de un dispensador (o el por defecto si no tiene
+    transporte propio o no se indica), abriendo la conexión en el primer uso.
+    """
+    global _por_defecto
+    clave = _clave(dispensador) if dispensador is not None else None
+    sobrante = None
+    with _lock:
+        if clave is None:
+            if _por_defecto is None:
+                _por_defecto = Dispositivo(
+                    crear_transporte_esp32(), cache_sensores,
+                    lambda: [settings.ESP32_DISPENSER_ID] if settings.ESP32_DISPENSER_ID else [],
+                )
+                atexit.register(_por_defecto.cerrar)
+            return _por_defecto
+
+        anterior = _asignaciones.get(dispensador.id)
+        _asignaciones[dispensador.id] = clave
+        if anterior is not None and anterior != clave:
+            sobrante = _soltar_si_no_usado(anterior)
+        if clave not in _dispositivos:
+            _dispositivos[clave] = Dispositivo(
+                _transporte_dispensador(dispensador.transporte, dispensador.puerto, dispensador.baudrate),
+                CacheSensores(),
+                lambda: _dispensadores_de(clave),
+            )
+        dispositivo = _dispositivos[clave]
+    if sobrante:
+        sobrante.cerrar()
+    return dispositivo
+
+
+def obtener_esp32(dispensador=None):
+    """Devuelve el gestor serial del dispensador (o el compartido por defecto)."""
+    return obtener_dispositivo(dispensador).esp32
+
+
+def actualizar_dispensador(dispensador, eliminado=False):
+    """
+    El dispensador cambió o se eliminó: si tenía conexión abierta y ahora
+    apunta a otra (o ya no existe), se suelta la anterior. La nueva se abre
+    en el siguiente uso.
+    """
+    with _lock:
+        anterior = _asignaciones.get(dispensador.id)
+        if anterior is None or (not eliminado and anterior == _clave(dispensador)):
+            return
+        del _asignaciones[dispensador.id]
+        sobrante = _soltar_si_no_usado(anterior)
+    if sobrante:
+        sobrante.cerrar()
+
+
+def iniciar_dispositivos():
+    """
+    Conecta todos los dispensadores activos con transporte propio (para que sus
+    pollers empiecen a muestrear). Se llama desde wsgi.py / asgi.py.
+    """
+    from .models import Dispenser
+
+    try:
+        dispensadores = list(Dispenser.objects.filter(status=True).exclude(transporte=''))
+    except (OperationalError, ProgrammingError) as e:
+        # Migraciones sin aplicar: que el servidor arranque y muestre su aviso
+        print(f"❌ ESP32 de los dispensadores sin preparar (¿faltan migraciones?): {e}", file=sys.stderr)
+        return
+    for dispensador in dispensadores:
+        try:
+            obtener_dispositivo(dispensador)
+        except Exception as e:
+            print(f"❌ No se pudo preparar la ESP32 del dispensador {dispensador.id}: {e}", file=sys.stderr)
+
+
+@atexit.register
+def _cerrar_dispositivos():
+    with _lock:
+        dispositivos = list(_dispositivos.values())
+        _dispositivos.clear()
+        _asignaciones.clear()
+    for dispositivo in dispositivos:
+        dispositivo.cerrar()
+
+
+def obtener_camara():
+    """Devuelve el hub de la cámara compartido por todos los streams."""
+    global _camara
+    with _lock:
+        if _camara is None:
+            _camara = CameraHub(
+                dispositivo=settings.CAMARA_DISPOSITIVO,
+                ancho=settings.CAMARA_ANCHO,
+                alto=settings.CAMARA_ALTO,
+            )
+    return _camara
+
+
+def obtener_reproductor():
+    """Devuelve la cola de reproducción de audio compartida."""
+    global _reproductor
+    with _lock:
+        if _reproductor is None:
+            _reproductor = ReproductorAudio(max_cola=settings.AUDIO_MAX_COLA)
+    return _reproductor
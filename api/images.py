@@ -0,0 +1,356 @@
+"""
+Subida de fotos de usuarios y mascotas sin pasar por base64.
+
+Se aceptan dos formas, ambas leídas por bloques y cortadas en cuanto pasan
+de IMAGEN_MAX_BYTES (sin esperar a que termine la subida):
+
+- multipart/form-data con el archivo en el campo `image`.
+- El cuerpo crudo de la petición con Content-Type image/* (PUT binario).
+
+El campo `image_base64` de los serializers se conserva por compatibilidad.
+
+Las fotos se guardan por contenido (api/media.py). Al cambiar la foto, un hilo de fondo genera versiones reducidas
+(IMAGEN_VARIANTES) y las deja en `image_variants` para que las listas no
+descarguen el original.
+"""
+import base64
+import binascii
+import io
+import os
+import tempfile
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.core.files.storage import default_storage
+from django.db import transaction
+from rest_framework.exceptions import APIException, ValidationError
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .media import es_blob, guardar_blob
+from .tareas import tarea, encolar, ErrorDefinitivo
+
+# Formatos que reconoce Pillow -> extensión del archivo guardado
+FORMATOS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif', 'AVIF': 'avif'}
+TAMANO_BLOQUE = 64 * 1024
+
+
+class ImagenDemasiadoGrande(APIException):
+    status_code = 413
+    default_code = 'imagen_demasiado_grande'
+
+    def __init__(self):
+        super().__init__(f"La imagen supera el máximo de {settings.IMAGEN_MAX_BYTES} bytes.")
+
+
+class LimiteImagen(FileUploadHandler):
+    """Manejador de subida que corta el multipart en cuanto un archivo pasa del límite."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.recibidos = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.recibidos += len(raw_data)
+        if self.recibidos > settings.IMAGEN_MAX_BYTES:
+            raise ImagenDemasiadoGrande()
+        # Los bloques siguen hacia los manejadores por defecto (memoria / archivo temporal)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def _comprobar_longitud(request):
+    """Rechaza de entrada las subidas que ya anuncian un Content-Length excesivo."""
+    try:
+        longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        longitud = 0
+    if longitud > settings.IMAGEN_MAX_BYTES + TAMANO_BLOQUE:
+        # El margen cubre los encabezados del multipart
+        raise ImagenDemasiadoGrande()
+
+
+def _leer_cuerpo(request):
+    """Copia el cuerpo crudo a un archivo temporal por bloques, respetando el límite."""
+    destino = tempfile.TemporaryFile()
+    recibidos = 0
+    stream = request.stream
+    while stream is not None:
+        bloque = stream.read(TAMANO_BLOQUE)
+        if not bloque:
+            break
+        recibidos += len(bloque)
+        if recibidos > settings.IMAGEN_MAX_BYTES:
+            destino.close()
+            raise ImagenDemasiadoGrande()
+        destino.write(bloque)
+    if not recibidos:
+        destino.close()
+        raise ValidationError({'image': "El cuerpo de la petición está vacío."})
+    destino.seek(0)
+    return destino
+
+
+def recibir_imagen(request):
+    """
+    Devuelve un archivo (posicionado al inicio) con la imagen de la petición.
+    Lanza ValidationError o ImagenDemasiadoGrande.
+    """
+    _comprobar_longitud(request)
+    if request.content_type.startswith('multipart/form-data'):
+        # Tiene que instalarse antes de que DRF lea el multipart
+        request._request.upload_handlers.insert(0, LimiteImagen(request._request))
+        archivo = request.FILES.get('image')
+        if archivo is None:
+            raise ValidationError({'image': "Falta el archivo en el campo 'image'."})
+        return archivo
+    if request.content_type.startswith('image/'):
+        return _leer_cuerpo(request)
+    raise ValidationError({'image': "Envía multipart/form-data con el campo 'image' o el cuerpo con Content-Type image/*."})
+
+
+def _formato(archivo):
+    """Extensión según el contenido real del archivo (no según lo que diga el cliente)."""
+    try:
+        with Image.open(archivo) as imagen:
+            formato = imagen.format
+            imagen.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise ValidationError({'image': "El archivo no es una imagen válida."})
+    finally:
+        archivo.seek(0)
+    if formato not in FORMATOS:
+        raise ValidationError({'image': f"Formato no soportado. Usa {', '.join(FORMATOS)}."})
+    return FORMATOS[formato]
+
+
+def asignar_imagen(instancia, archivo):
+    """
+    Pone `archivo` como la imagen de `instancia` (User o Pet) sin guardarla:
+    el contenido va al almacenamiento por hash (api/media.py), así que una foto
+    repetida no ocupa espacio otra vez.
+    """
+    try:
+        extension = _formato(archivo)
+        nombre = guardar_blob(archivo, extension)
+    finally:
+        archivo.close()
+    quitar_imagen(instancia)
+    instancia.image.name = nombre
+
+
+def quitar_imagen(instancia):
+    """
+    Quita la imagen sin guardar. El archivo anterior se borra desde la cola;
+    los blobs se borran solos al quedar sin referencias.
+    """
+    if instancia.image and not es_blob(instancia.image.name):
+        encolar('borrar_archivo', nombre=instancia.image.name)
+    instancia.image = None
+
+
+def guardar_base64_temporal(contenido):
+    """
+    Guarda el texto base64 (sin el prefijo data:) tal cual en un archivo
+    temporal; decodificarlo y validarlo queda para la tarea 'procesar_imagen'.
+    IMAGEN_TEMP_DIR debe sobrevivir a un reinicio, igual que la tarea.
+    """
+    os.makedirs(settings.IMAGEN_TEMP_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=settings.IMAGEN_TEMP_DIR, suffix='.b64', delete=False) as destino:
+        destino.write(contenido.encode('ascii'))
+    return destino.name
+
+
+def nuevo_token(instancia):
+    """Marca un cambio de foto en `instancia` (sin guardar); las tareas con otro token ya no aplican."""
+    instancia.image_token = uuid.uuid4().hex
+    return instancia.image_token
+
+
+def encolar_imagen(instancia, ruta_temporal):
+    """Encola la foto en base64 de `ruta_temporal` para `instancia` (ya guardada)."""
+    token = nuevo_token(instancia)
+    type(instancia).objects.filter(pk=instancia.pk).update(image_token=token)
+    return encolar(
+        'procesar_imagen', modelo=instancia._meta.label, id=instancia.pk, ruta=ruta_temporal, token=token
+    )
+
+
+def _vigente(modelo, id, token, bloquear=False):
+    """False si después de encolar la tarea llegó otra foto (o se borró)."""
+    filas = apps.get_model(modelo).objects.filter(pk=id)
+    if bloquear:
+        filas = filas.select_for_update()
+    if token is not None:
+        # Tareas encoladas antes de existir el token: sin comprobación
+        filas = filas.filter(image_token=token)
+    return filas.exists()
+
+
+def _descartar_temporal(modelo, id, ruta, token=None):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+@tarea('procesar_imagen', reintentos=3, al_fallar=_descartar_temporal)
+def procesar_imagen(modelo, id, ruta, token=None):
+    """
+    Decodifica, valida y asigna una foto recibida en base64. El archivo
+    temporal se conserva hasta que la foto queda guardada (o la tarea falla
+    del todo), así que un error pasajero (BD bloqueada, almacenamiento) se
+    reintenta con los mismos datos. Si mientras tanto llegó otra foto
+    (`image_token` distinto) esta se descarta.
+    """
+    instancia = apps.get_model(modelo).objects.filter(pk=id).first()
+    if instancia is None or not _vigente(modelo, id, token):
+        _descartar_temporal(modelo, id, ruta)
+        return
+    try:
+        with open(ruta, 'rb') as archivo:
+            datos = base64.b64decode(archivo.read(), validate=True)
+    except FileNotFoundError:
+        raise ErrorDefinitivo(f"No existe el archivo temporal {ruta}.")
+    except binascii.Error as e:
+        raise ErrorDefinitivo(f"Base64 inválido: {e}")
+    try:
+        asignar_imagen(instancia, ContentFile(datos))
+    except ValidationError as e:
+        # Que el error de la Tarea sea legible
+        raise ErrorDefinitivo(e.detail.get('image', e.detail))
+    with transaction.atomic():
+        # Se vuelve a comprobar con la fila bloqueada: otra foto pudo llegar
+        # mientras se decodificaba. El blob que no se usa lo borra el recolector.
+        if _vigente(modelo, id, token, bloquear=True):
+            instancia.save(update_fields=['image'])
+    _descartar_temporal(modelo, id, ruta)
+
+
+@tarea('borrar_archivo')
+def borrar_archivo(nombre):
+    default_storage.delete(nombre)
+
+
+def guardar_imagen(instancia, archivo):
+    asignar_imagen(instancia, archivo)
+    nuevo_token(instancia)
+    instancia.save(update_fields=['image', 'image_token'])
+
+
+def borrar_imagen(instancia):
+    if instancia.image:
+        quitar_imagen(instancia)
+        nuevo_token(instancia)
+        instancia.save(update_fields=['image', 'image_token'])
+
+
+# --- Variantes reducidas ---
+
+EXTENSIONES_VARIANTE = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+def nombre_variante(nombre, tamano):
+    """petsImages/pet_1_ab.jpg -> petsImages/variantes/pet_1_ab_256.webp"""
+    carpeta, archivo = os.path.split(nombre)
+    base = os.path.splitext(archivo)[0]
+    extension = EXTENSIONES_VARIANTE[settings.IMAGEN_VARIANTES_FORMATO]
+    return f"{carpeta}/variantes/{base}_{tamano}.{extension}"
+
+
+def variantes_al_dia(instancia):
+    """True si `image_variants` corresponde a la imagen actual."""
+    variantes = instancia.image_variants or {}
+    if not instancia.image:
+        return not variantes
+    return bool(variantes) and all(
+        nombre == nombre_variante(instancia.image.name, tamano) for tamano, nombre in variantes.items()
+    )
+
+
+def borrar_variantes(variantes):
+    """Las variantes de un blob son compartidas: esas las borra el recolector con el blob."""
+    for nombre in (variantes or {}).values():
+        if not es_blob(nombre):
+            encolar('borrar_archivo', nombre=nombre)
+
+
+def sincronizar_variantes(instancia):
+    """
+    Se llama al guardar un User o Pet: si la foto cambió, encola el borrado
+    de las variantes viejas y la generación de las nuevas.
+    """
+    if variantes_al_dia(instancia):
+        return
+    if instancia.image_variants:
+        borrar_variantes(instancia.image_variants)
+        instancia.image_variants = {}
+        type(instancia).objects.filter(pk=instancia.pk).update(image_variants={})
+    if instancia.image:
+        encolar('variantes_imagen', unica=True, modelo=instancia._meta.label, id=instancia.pk)
+
+
+@tarea('variantes_imagen')
+def tarea_variantes(modelo, id):
+    generar_variantes(apps.get_model(modelo), id)
+
+
+def generar_variantes(modelo, instancia_id):
+    """
+    Genera las variantes de la foto actual y las guarda en `image_variants`.
+    """
+    instancia = modelo.objects.filter(pk=instancia_id).only('image', 'image_variants').first()
+    if instancia is None or not instancia.image or variantes_al_dia(instancia):
+        return
+    original = instancia.image.name
+    storage = instancia.image.storage
+    formato = settings.IMAGEN_VARIANTES_FORMATO
+
+    esperadas = {str(tamano): nombre_variante(original, tamano) for tamano in settings.IMAGEN_VARIANTES}
+    if es_blob(original) and all(storage.exists(nombre) for nombre in esperadas.values()):
+        # Otro User/Pet con la misma foto ya las generó
+        variantes = esperadas
+    else:
+        variantes = _reducir(storage, original, formato)
+
+    # Solo si la foto no cambió mientras tanto; si cambió, estas ya sobran
+    if not modelo.objects.filter(pk=instancia_id, image=original).update(image_variants=variantes):
+        borrar_variantes(variantes)
+        return
+    print(f"✅ Variantes de {original}: {', '.join(variantes)}")
+
+
+def _reducir(storage, original, formato):
+    with storage.open(original, 'rb') as archivo, Image.open(archivo) as imagen:
+        imagen = ImageOps.exif_transpose(imagen)
+        transparente = 'A' in imagen.getbands() or 'transparency' in imagen.info
+        if formato == 'JPEG' or not transparente:
+            imagen = imagen.convert('RGB')
+        elif imagen.mode != 'RGBA':
+            imagen = imagen.convert('RGBA')
+        variantes = {}
+        for tamano in sorted(settings.IMAGEN_VARIANTES):
+            # thumbnail() no agranda: si el original es más chico queda a su tamaño
+            reducida = imagen.copy()
+            reducida.thumbnail((tamano, tamano), Image.LANCZOS)
+            salida = io.BytesIO()
+            reducida.save(salida, formato, quality=settings.IMAGEN_VARIANTES_CALIDAD)
+            nombre = nombre_variante(original, tamano)
+            storage.delete(nombre)
+            variantes[str(tamano)] = storage.save(nombre, ContentFile(salida.getvalue()))
+    return variantes
+
+
+def elegir_variante(instancia, tamano):
+    """Nombre de la imagen más chica cuyo lado mayor alcanza `tamano` (o el original)."""
+    variantes = instancia.image_variants or {}
+    if variantes_al_dia(instancia):
+        for disponible in sorted(variantes, key=int):
+            if int(disponible) >= tamano:
+                return variantes[disponible]
+    return instancia.image.name
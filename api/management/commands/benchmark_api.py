@@ -0,0 +1,90 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api.benchmark import ejecutar_benchmark, comparar
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide consultas SQL, latencia p50/p95 y tamaño de respuesta de cada ruta de la API "
+        "sobre una base de datos de pruebas con datos sintéticos, y escribe un reporte JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=1000, help="Cuentas sintéticas a crear (default 1000)")
+        parser.add_argument('--filas', type=int, default=120, help="Mascotas/dispensadores/horarios del usuario que hace las peticiones")
+        parser.add_argument('--repeticiones', type=int, default=20, help="Peticiones por ruta (default 20)")
+        parser.add_argument('--salida', default='benchmark_api.json', help="Archivo del reporte JSON")
+        parser.add_argument('--comparar', metavar='REPORTE', help="Reporte anterior contra el cual buscar regresiones")
+        parser.add_argument('--hardware', action='store_true',
+                            help="Medir también las rutas de la ESP32 contra la ESP32 simulada")
+        parser.add_argument('--hilos', type=int, default=8, help="Clientes simultáneos en la prueba de concurrencia")
+        parser.add_argument('--latencia', type=float, default=0.01, help="Latencia (s) del firmware simulado")
+        parser.add_argument('--tasa-error', type=float, default=0.0, help="Probabilidad de que la ESP32 simulada no responda")
+        parser.add_argument('--duracion-actuadores', type=float, default=0.05,
+                            help="Segundos que el motor/bomba simulados ocupan al firmware. El comando no espera "
+                                 "respuesta, así que con valores altos las repeticiones se acumulan en la ESP32")
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['comparar']:
+            try:
+                with open(options['comparar']) as archivo:
+                    anterior = json.load(archivo)
+            except (OSError, json.JSONDecodeError) as e:
+                raise CommandError(f"No se pudo leer el reporte anterior: {e}")
+
+        # Nunca sobre la base de datos real: se crea una de pruebas y se destruye al final
+        nombre_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        # Nunca contra la placa real; sin muestreo de fondo que compita por el puerto
+        simulador = override_settings(
+            ESP32_TRANSPORT='simulado',
+            ESP32_POLL_INTERVAL=0,
+            ESP32_SIMULADOR={
+                'latencia': options['latencia'],
+                'tasa_error': options['tasa_error'],
+                'duracion_motor': options['duracion_actuadores'],
+                'duracion_bomba': options['duracion_actuadores'],
+                'semilla': 0,
+            },
+        )
+        try:
+            with simulador:
+                reporte = ejecutar_benchmark(
+                    usuarios=options['usuarios'],
+                    repeticiones=options['repeticiones'],
+                    filas_principal=options['filas'],
+                    hardware=options['hardware'],
+                    hilos=options['hilos'],
+                    al_medir=self._imprimir,
+                )
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+        with open(options['salida'], 'w') as archivo:
+            json.dump(reporte, archivo, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Reporte guardado en {options['salida']}"))
+        for nombre, medida in reporte['concurrencia'].items():
+            self.stdout.write(
+                f"{nombre} x{medida['hilos']} hilos: {medida['por_segundo']} peticiones/s  "
+                f"p95 {medida['p95_ms']} ms  503: {medida['rechazadas_503']}  errores: {medida['errores']}"
+            )
+        for ruta, motivo in reporte['omitidas'].items():
+            self.stdout.write(f"  omitida {ruta}: {motivo}")
+
+        if anterior is not None:
+            regresiones = comparar(anterior, reporte)
+            for regresion in regresiones:
+                self.stdout.write(self.style.WARNING(f"  regresión {regresion}"))
+            if regresiones:
+                raise CommandError(f"{len(regresiones)} regresiones frente a {options['comparar']}")
+
+    def _imprimir(self, nombre, medida):
+        self.stdout.write(
+            f"{medida['status']} {nombre:<40} {medida['consultas']:>3} consultas  "
+            f"p50 {medida['p50_ms']:>8.2f} ms  p95 {medida['p95_ms']:>8.2f} ms  {medida['bytes']:>7} B"
+        )
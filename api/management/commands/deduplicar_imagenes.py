@@ -0,0 +1,41 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.images import asignar_imagen
+from api.media import es_blob, recolectar_blobs
+from api.models import User, Pet
+
+
+class Command(BaseCommand):
+    help = (
+        "Pasa las fotos guardadas con el esquema anterior (usersImages/, petsImages/) al "
+        "almacenamiento por contenido, de modo que las repetidas queden en un solo archivo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recolectar', action='store_true',
+                            help="Borrar al final los blobs sin referencias (sin esperar MEDIA_GC_GRACIA)")
+
+    def handle(self, *args, **options):
+        for modelo in (User, Pet):
+            movidas = faltantes = 0
+            for instancia in modelo.objects.exclude(image='').exclude(image=None):
+                if es_blob(instancia.image.name):
+                    continue
+                if not os.path.exists(instancia.image.path):
+                    faltantes += 1
+                    self.stderr.write(f"⚠️ {modelo.__name__} {instancia.pk}: no existe {instancia.image.name}")
+                    continue
+                try:
+                    # El archivo anterior se borra desde la cola de tareas una vez copiado al blob
+                    asignar_imagen(instancia, instancia.image.storage.open(instancia.image.name, 'rb'))
+                except Exception as e:
+                    self.stderr.write(f"❌ {modelo.__name__} {instancia.pk}: {e}")
+                    continue
+                instancia.save(update_fields=['image'])
+                movidas += 1
+            self.stdout.write(f"{modelo.__name__}: {movidas} movidas, {faltantes} sin archivo")
+
+        if options['recolectar']:
+            self.stdout.write(f"{recolectar_blobs(gracia=0)} blobs sin referencias eliminados")
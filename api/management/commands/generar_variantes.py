@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.images import generar_variantes, variantes_al_dia
+from api.models import User, Pet
+
+
+class Command(BaseCommand):
+    help = "Genera las versiones reducidas (IMAGEN_VARIANTES) de las fotos de usuarios y mascotas que aún no las tienen."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true', help="Regenerar también las que ya están al día")
+
+    def handle(self, *args, **options):
+        for modelo in (User, Pet):
+            generadas = fallidas = 0
+            for instancia in modelo.objects.exclude(image='').exclude(image=None).only('image', 'image_variants'):
+                if variantes_al_dia(instancia) and not options['todas']:
+                    continue
+                if options['todas']:
+                    modelo.objects.filter(pk=instancia.pk).update(image_variants={})
+                try:
+                    generar_variantes(modelo, instancia.pk)
+                    generadas += 1
+                except Exception as e:
+                    fallidas += 1
+                    self.stderr.write(f"❌ {modelo.__name__} {instancia.pk}: {e}")
+            self.stdout.write(f"{modelo.__name__}: {generadas} generadas, {fallidas} fallidas")
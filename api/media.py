@@ -0,0 +1,109 @@
+"""
+Almacenamiento por contenido de las fotos (modelo MediaBlob).
+
+Cada archivo se guarda una sola vez en blobs/<ab>/<sha256>.<ext>. Como el
+nombre sale del contenido, la misma URL siempre entrega los mismos bytes y
+los clientes pueden guardarla en cache para siempre. Las referencias se
+ajustan desde las señales de User y Pet; la tarea periódica 'recolectar_blobs'
+(api/tareas.py) borra los blobs que llevan más de MEDIA_GC_GRACIA segundos sin referencias (el margen cubre
+una subida que ya guardó el blob pero aún no guarda su User/Pet).
+"""
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .models import MediaBlob
+from .tareas import tarea
+
+CARPETA_BLOBS = 'blobs'
+
+
+def es_blob(nombre):
+    return bool(nombre) and nombre.startswith(f"{CARPETA_BLOBS}/")
+
+
+def es_inmutable(nombre):
+    """
+    True si el nombre es el hash del contenido: los blobs, no sus variantes
+    (blobs/<ab>/variantes/), que se reescriben con el mismo nombre.
+    """
+    return es_blob(nombre) and '/variantes/' not in nombre
+
+
+def hash_archivo(archivo):
+    """SHA-256 del archivo leído por bloques; lo deja posicionado al inicio."""
+    archivo.seek(0)
+    digest = hashlib.sha256()
+    tamano = 0
+    for bloque in iter(lambda: archivo.read(64 * 1024), b''):
+        digest.update(bloque)
+        tamano += len(bloque)
+    archivo.seek(0)
+    return digest.hexdigest(), tamano
+
+
+def guardar_blob(archivo, extension):
+    """
+    Guarda el archivo si su contenido aún no existe y devuelve su nombre.
+    Las referencias se suman al guardar el User/Pet que lo usa.
+    """
+    digest, tamano = hash_archivo(archivo)
+    nombre = f"{CARPETA_BLOBS}/{digest[:2]}/{digest}.{extension}"
+    try:
+        blob, creado = MediaBlob.objects.get_or_create(hash=digest, defaults={'nombre': nombre, 'tamano': tamano})
+    except IntegrityError:
+        # Otra petición lo creó al mismo tiempo
+        blob, creado = MediaBlob.objects.get(hash=digest), False
+    if not creado:
+        # Aleja al blob del recolector mientras se asigna
+        MediaBlob.objects.filter(pk=blob.pk).update(actualizado_en=timezone.now())
+    if not default_storage.exists(blob.nombre):
+        default_storage.save(blob.nombre, File(archivo, name=blob.nombre))
+    return blob.nombre
+
+
+def ajustar_referencias(nombre, cambio):
+    if es_blob(nombre):
+        MediaBlob.objects.filter(nombre=nombre).update(
+            referencias=F('referencias') + cambio, actualizado_en=timezone.now()
+        )
+
+
+def _borrar_archivos(nombre):
+    """Borra el blob y sus variantes reducidas (carpeta/variantes/<hash>_*)."""
+    default_storage.delete(nombre)
+    carpeta, archivo = os.path.split(nombre)
+    base = os.path.splitext(archivo)[0]
+    try:
+        _, variantes = default_storage.listdir(f"{carpeta}/variantes")
+    except FileNotFoundError:
+        return
+    for variante in variantes:
+        if variante.startswith(f"{base}_"):
+            default_storage.delete(f"{carpeta}/variantes/{variante}")
+
+
+@tarea('recolectar_blobs', cada='MEDIA_GC_INTERVALO')
+def recolectar_blobs(gracia=None):
+    """Borra los blobs sin referencias desde hace más de `gracia` segundos. Devuelve cuántos."""
+    gracia = settings.MEDIA_GC_GRACIA if gracia is None else gracia
+    limite = timezone.now() - timedelta(seconds=gracia)
+    borrados = 0
+    for blob_id, nombre in MediaBlob.objects.filter(
+        referencias__lte=0, actualizado_en__lt=limite
+    ).values_list('id', 'nombre'):
+        # Se vuelve a comprobar al borrar por si alguien lo tomó entre tanto
+        eliminados, _ = MediaBlob.objects.filter(id=blob_id, referencias__lte=0, actualizado_en__lt=limite).delete()
+        if eliminados:
+            _borrar_archivos(nombre)
+            borrados += 1
+    if borrados:
+        print(f"🧹 {borrados} archivo(s) sin referencias eliminados")
+    return borrados
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_dispenser_fp_alter_dispenser_wp_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BloqueLecturas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor', models.CharField(choices=[('PESO_A', 'Peso A'), ('PESO_B', 'Peso B'), ('DISTANCIA_A', 'Distancia A'), ('DISTANCIA_B', 'Distancia B')], max_length=20)),
+                ('inicio', models.DateTimeField()),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('tiempos', models.BinaryField(default=bytes)),
+                ('valores', models.BinaryField(default=bytes)),
+                ('dispensador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bloques_lecturas', to='api.dispenser')),
+            ],
+            options={
+                'unique_together': {('dispensador', 'sensor', 'inicio')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenLecturas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor', models.CharField(choices=[('PESO_A', 'Peso A'), ('PESO_B', 'Peso B'), ('DISTANCIA_A', 'Distancia A'), ('DISTANCIA_B', 'Distancia B')], max_length=20)),
+                ('resolucion', models.CharField(choices=[('1m', '1 minuto'), ('1h', '1 hora'), ('1d', '1 día')], max_length=2)),
+                ('inicio', models.DateTimeField()),
+                ('minimo', models.FloatField()),
+                ('maximo', models.FloatField()),
+                ('suma', models.FloatField()),
+                ('cantidad', models.PositiveIntegerField()),
+                ('dispensador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_lecturas', to='api.dispenser')),
+            ],
+            options={
+                'unique_together': {('dispensador', 'sensor', 'resolucion', 'inicio')},
+            },
+        ),
+    ]
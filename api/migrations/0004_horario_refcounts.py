@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_conteos(apps, schema_editor):
+    """Calcula los conteos iniciales a partir de los Horario existentes."""
+    Horario = apps.get_model('api', 'Horario')
+    ConteoHorario = apps.get_model('api', 'ConteoHorario')
+
+    conteos = {}
+    for dispensador_id, horarios in Horario.objects.values_list('dispensador_id', 'horarios'):
+        for hora in set(horarios or []):
+            clave = (dispensador_id, hora)
+            conteos[clave] = conteos.get(clave, 0) + 1
+
+    ConteoHorario.objects.bulk_create([
+        ConteoHorario(dispensador_id=dispensador_id, hora=hora, conteo=conteo)
+        for (dispensador_id, hora), conteo in conteos.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_sensor_timeseries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteoHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora', models.CharField(max_length=5)),
+                ('conteo', models.IntegerField(default=0)),
+                ('dispensador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conteos_horario', to='api.dispenser')),
+            ],
+            options={
+                'unique_together': {('dispensador', 'hora')},
+            },
+        ),
+        migrations.RunPython(poblar_conteos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_horario_refcounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Grabacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duracion', models.FloatField(help_text='Duración solicitada en segundos')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('grabando', 'Grabando'), ('completada', 'Completada'), ('fallida', 'Fallida')], default='pendiente', max_length=20)),
+                ('progreso', models.FloatField(default=0, help_text='Porcentaje grabado (0-100)')),
+                ('archivo', models.FileField(blank=True, null=True, upload_to='videos/')),
+                ('error', models.TextField(blank=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grabaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Grabación',
+                'verbose_name_plural': 'Grabaciones',
+            },
+        ),
+    ]
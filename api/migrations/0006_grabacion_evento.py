@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_grabacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grabacion',
+            name='dispensador',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='grabaciones', to='api.dispenser'),
+        ),
+        migrations.AddField(
+            model_name='grabacion',
+            name='origen',
+            field=models.CharField(choices=[('manual', 'Manual'), ('evento', 'Evento de comida')], default='manual', max_length=10),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_grabacion_evento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AudioClip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('archivo', models.FileField(upload_to='audios/')),
+                ('duracion', models.FloatField(default=0, help_text='Duración en segundos')),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='audios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Audio',
+                'verbose_name_plural': 'Audios',
+            },
+        ),
+        migrations.AddField(
+            model_name='horario',
+            name='audio',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='horarios', to='api.audioclip'),
+        ),
+    ]
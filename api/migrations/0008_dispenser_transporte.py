@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_audioclip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispenser',
+            name='baudrate',
+            field=models.IntegerField(default=115200),
+        ),
+        migrations.AddField(
+            model_name='dispenser',
+            name='puerto',
+            field=models.CharField(blank=True, help_text='Ruta del puerto (/dev/ttyUSB0) o host:puerto del puente TCP', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='dispenser',
+            name='transporte',
+            field=models.CharField(blank=True, choices=[('serial', 'Puerto serial'), ('tcp', 'Puente TCP-serial'), ('simulado', 'ESP32 simulada')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_dispenser_transporte'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
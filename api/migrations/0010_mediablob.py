@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_imagen_variantes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('nombre', models.CharField(help_text='Ruta dentro de MEDIA_ROOT', max_length=255, unique=True)),
+                ('tamano', models.BigIntegerField(help_text='Bytes')),
+                ('referencias', models.IntegerField(default=0)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizado_en', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
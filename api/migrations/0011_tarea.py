@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('argumentos', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('ejecutando', 'Ejecutando'), ('completada', 'Completada'), ('fallida', 'Fallida')], default='pendiente', max_length=20)),
+                ('intentos', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('ejecutar_despues', models.DateTimeField(default=django.utils.timezone.now)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'ejecutar_despues'], name='api_tarea_estado_716662_idx')],
+            },
+        ),
+    ]
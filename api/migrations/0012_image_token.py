@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_tarea'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='image_token',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='image_token',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
@@ -1,17 +1,37 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
 import json 
+from django.utils import timezone
 from .managers import CustomUserManager
 
+
+class RecordarImagenMixin:
+    """
+    Recuerda la imagen guardada al leer de la BD para que las señales ajusten
+    las referencias de MediaBlob solo cuando cambia (ver api/signals.py).
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            instance._imagen_guardada = instance.image.name or ''
+        return instance
+
+
 # --- Modelo User (Usuario Personalizado) ---
-class User(AbstractBaseUser, PermissionsMixin):
+class User(RecordarImagenMixin, AbstractBaseUser, PermissionsMixin):
     # Campos que necesitamos explícitamente:
     email = models.EmailField(unique=True, verbose_name='Email Address')
     first_name = models.CharField(max_length=150, blank=True)
     last_name = models.CharField(max_length=150, blank=True)
     image = models.ImageField(upload_to='usersImages/', null=True, blank=True)
+    # Versiones reducidas de `image`: {"64": "usersImages/variantes/...webp", ...}
+    image_variants = models.JSONField(default=dict, blank=True)
+    # Id de la última subida o borrado de `image`: una tarea 'procesar_imagen'
+    # encolada antes no pisa una foto más nueva (ver api/images.py)
+    image_token = models.CharField(max_length=32, blank=True, editable=False)
     
     # Campos de AbstractUser que necesitamos redefinir para permisos
     is_staff = models.BooleanField(default=False)
@@ -33,12 +53,17 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.first_name
 
 # --- Modelo Pet ---
-class Pet(models.Model):
+class Pet(RecordarImagenMixin, models.Model):
     name = models.CharField(max_length=100)
     race = models.CharField(max_length=100)
     weight = models.FloatField()
     age = models.IntegerField()
     image = models.ImageField(upload_to='petsImages/', null=True, blank=True)
+    # Versiones reducidas de `image`: {"64": "petsImages/variantes/...webp", ...}
+    image_variants = models.JSONField(default=dict, blank=True)
+    # Id de la última subida o borrado de `image`: una tarea 'procesar_imagen'
+    # encolada antes no pisa una foto más nueva (ver api/images.py)
+    image_token = models.CharField(max_length=32, blank=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pets')
 
     def __str__(self):
@@ -65,9 +90,112 @@ class Dispenser(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='dispensers')
     pet = models.OneToOneField(Pet, on_delete=models.CASCADE, related_name='dispenser', null=True, blank=True)
 
+    # Conexión con la ESP32 de este dispensador (ver api/hardware.py).
+    # Sin transporte se usa la ESP32 por defecto (ESP32_PUERTO / ESP32_TRANSPORT).
+    TRANSPORTES = [
+        ('serial', 'Puerto serial'),
+        ('tcp', 'Puente TCP-serial'),
+        ('simulado', 'ESP32 simulada'),
+    ]
+    transporte = models.CharField(max_length=10, choices=TRANSPORTES, blank=True)
+    puerto = models.CharField(
+        max_length=255, blank=True,
+        help_text='Ruta del puerto (/dev/ttyUSB0) o host:puerto del puente TCP'
+    )
+    baudrate = models.IntegerField(default=115200)
+
+    def clean(self):
+        """
+        El puerto debe corresponder al transporte y no puede ser el de la ESP32
+        por defecto ni el de un dispensador de otro usuario (compartirían placa).
+        """
+        if self.transporte == 'serial':
+            if not self.puerto.startswith('/'):
+                raise ValidationError({'puerto': "Para 'serial' indica la ruta del dispositivo, p. ej. /dev/ttyUSB0."})
+            if settings.ESP32_TRANSPORT == 'serial' and self.puerto == settings.ESP32_PUERTO:
+                raise ValidationError({'puerto': "Ese puerto es el de la ESP32 por defecto del servidor."})
+        if self.transporte == 'tcp':
+            host, _, numero = self.puerto.rpartition(':')
+            if not host or not numero.isdigit() or not 0 < int(numero) < 65536:
+                raise ValidationError({'puerto': "Para 'tcp' indica host:puerto, p. ej. 192.168.1.50:8888."})
+        if self.transporte in ('serial', 'tcp') and Dispenser.objects.filter(
+            transporte=self.transporte, puerto=self.puerto
+        ).exclude(user_id=self.user_id).exclude(pk=self.pk).exists():
+            raise ValidationError({'puerto': "Ese puerto ya está asignado a un dispensador de otro usuario."})
+
     def __str__(self):
         return f"Dispensador en {self.ubication}"
 
+# --- Archivos por contenido ---
+class MediaBlob(models.Model):
+    """
+    Foto guardada por su contenido (SHA-256) en blobs/<ab>/<hash>.<ext>: las
+    subidas idénticas comparten un solo archivo y su URL nunca cambia de
+    contenido. `referencias` cuenta los User/Pet que lo usan (lo mantienen las
+    señales); los que quedan en 0 se borran en segundo plano (api/media.py).
+    """
+    hash = models.CharField(max_length=64, unique=True)
+    nombre = models.CharField(max_length=255, unique=True, help_text='Ruta dentro de MEDIA_ROOT')
+    tamano = models.BigIntegerField(help_text='Bytes')
+    referencias = models.IntegerField(default=0)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    # Último cambio de referencias; el recolector respeta un margen desde aquí
+    actualizado_en = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.nombre} x{self.referencias}"
+
+
+# --- Cola de tareas de fondo ---
+class Tarea(models.Model):
+    """
+    Trabajo pendiente para el pool de api/tareas.py (procesar fotos, generar
+    variantes, borrar archivos...). Al vivir en la BD, los trabajos sobreviven
+    a un reinicio y sus errores quedan registrados.
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('ejecutando', 'Ejecutando'),
+        ('completada', 'Completada'),
+        ('fallida', 'Fallida'),
+    ]
+
+    tipo = models.CharField(max_length=50)
+    argumentos = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    intentos = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    ejecutar_despues = models.DateTimeField(default=timezone.now)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Tarea {self.id} {self.tipo} ({self.estado})"
+
+    class Meta:
+        indexes = [models.Index(fields=['estado', 'ejecutar_despues'])]
+
+
+# --- Biblioteca de audios ---
+class AudioClip(models.Model):
+    """
+    Audio del usuario (p. ej. "¡a comer!") guardado ya transcodificado a WAV
+    PCM, para reproducirlo por id sin volver a subirlo ni decodificarlo.
+    """
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='audios')
+    nombre = models.CharField(max_length=100)
+    archivo = models.FileField(upload_to='audios/')
+    duracion = models.FloatField(default=0, help_text='Duración en segundos')
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.nombre} ({self.usuario})"
+
+    class Meta:
+        verbose_name = 'Audio'
+        verbose_name_plural = 'Audios'
+
+
 # --- 🔥 NUEVO MODELO: Horarios ---
 class Horario(models.Model):
     """
@@ -102,6 +230,15 @@ class Horario(models.Model):
         help_text='Lista de horarios en formato ["08:00", "12:00", "19:00"]'
     )
     
+    # Audio que suena en cada comida de este horario
+    audio = models.ForeignKey(
+        AudioClip,
+        on_delete=models.SET_NULL,
+        related_name='horarios',
+        null=True,
+        blank=True
+    )
+    
     creado_en = models.DateTimeField(auto_now_add=True)
     actualizado_en = models.DateTimeField(auto_now=True)
     
@@ -117,6 +254,17 @@ class Horario(models.Model):
             except Dispenser.DoesNotExist:
                 pass
         super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Recordar el dispensador y los horarios guardados para que las señales
+        solo apliquen la diferencia (ver api/signals.py).
+        """
+        instance = super().from_db(db, field_names, values)
+        if 'horarios' in field_names and 'dispensador_id' in field_names:
+            instance._estado_guardado = (instance.dispensador_id, list(instance.horarios))
+        return instance
     
     def __str__(self):
         usuario_email = self.usuario.email if self.usuario else "Sin usuario"
@@ -128,81 +276,119 @@ class Horario(models.Model):
         unique_together = ['mascota', 'dispensador']
 
 
-# --- 🔥 SEÑALES PARA SINCRONIZACIÓN AUTOMÁTICA ---
+class ConteoHorario(models.Model):
+    """
+    Cuántos registros de Horario usan cada hora en un dispensador.
+    Dispenser.horarios es la lista de horas con conteo > 0; se mantiene
+    incrementalmente desde las señales en lugar de recorrer todos los Horario.
+    """
+    dispensador = models.ForeignKey(Dispenser, on_delete=models.CASCADE, related_name='conteos_horario')
+    hora = models.CharField(max_length=5)
+    conteo = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.hora} x{self.conteo} en dispensador {self.dispensador_id}"
+
+    class Meta:
+        unique_together = ['dispensador', 'hora']
 
-@receiver(post_save, sender=Horario)
-def actualizar_horarios_dispensador(sender, instance, **kwargs):
+
+# --- Grabaciones de video ---
+class Grabacion(models.Model):
     """
-    Actualiza automáticamente el campo 'horarios' del dispensador
-    cuando se guarda un registro en Horario.
+    Trabajo de grabación de video. Se crea en estado 'pendiente' y un hilo de
+    fondo lo actualiza (progreso, estado, archivo) mientras guarda los cuadros
+    del CameraHub.
+    Las de origen 'evento' son clips armados con el historial de la cámara
+    alrededor de una comida (ver api/recordings.py).
     """
-    dispensador = instance.dispensador
-    
-    # Obtener todos los horarios únicos de este dispensador
-    todos_horarios = set()
-    
-    # Recorrer todos los registros de Horario para este dispensador
-    horarios_del_dispensador = Horario.objects.filter(dispensador=dispensador)
-    
-    for horario_reg in horarios_del_dispensador:
-        for hora in horario_reg.horarios:
-            todos_horarios.add(hora)
-    
-    # Convertir a lista ordenada
-    horarios_ordenados = sorted(list(todos_horarios))
-    
-    # Actualizar el dispensador
-    dispensador.horarios = horarios_ordenados
-    dispensador.save(update_fields=['horarios'])
-    
-    print(f"✅ Horarios actualizados para dispensador {dispensador.id}: {horarios_ordenados}")
+    ORIGENES = [
+        ('manual', 'Manual'),
+        ('evento', 'Evento de comida'),
+    ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('grabando', 'Grabando'),
+        ('completada', 'Completada'),
+        ('fallida', 'Fallida'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='grabaciones')
+    duracion = models.FloatField(help_text='Duración solicitada en segundos')
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    progreso = models.FloatField(default=0, help_text='Porcentaje grabado (0-100)')
+    archivo = models.FileField(upload_to='videos/', null=True, blank=True)
+    error = models.TextField(blank=True)
+    origen = models.CharField(max_length=10, choices=ORIGENES, default='manual')
+    dispensador = models.ForeignKey(
+        Dispenser, on_delete=models.SET_NULL, null=True, blank=True, related_name='grabaciones'
+    )
 
+    creado_en = models.DateTimeField(auto_now_add=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
 
-@receiver(post_delete, sender=Horario)
-def actualizar_horarios_dispensador_eliminado(sender, instance, **kwargs):
+    def __str__(self):
+        return f"Grabación {self.id} ({self.estado}) de {self.usuario}"
+
+    class Meta:
+        verbose_name = 'Grabación'
+        verbose_name_plural = 'Grabaciones'
+
+
+# --- Series de tiempo de los sensores ---
+SENSORES_CHOICES = [
+    ('PESO_A', 'Peso A'),
+    ('PESO_B', 'Peso B'),
+    ('DISTANCIA_A', 'Distancia A'),
+    ('DISTANCIA_B', 'Distancia B'),
+]
+
+
+class BloqueLecturas(models.Model):
     """
-    Actualiza automáticamente el campo 'horarios' del dispensador
-    cuando se elimina un registro en Horario.
+    Lecturas crudas de un sensor durante una hora, guardadas en columnas binarias:
+    `tiempos` es un array('d') de timestamps epoch y `valores` un array('f').
+    Solo se agregan datos al final (ver api/timeseries.py).
     """
-    dispensador = instance.dispensador
-    
-    # Obtener todos los horarios únicos restantes de este dispensador
-    todos_horarios = set()
-    
-    horarios_del_dispensador = Horario.objects.filter(dispensador=dispensador)
-    
-    for horario_reg in horarios_del_dispensador:
-        for hora in horario_reg.horarios:
-            todos_horarios.add(hora)
-    
-    # Convertir a lista ordenada
-    horarios_ordenados = sorted(list(todos_horarios))
-    
-    # Actualizar el dispensador
-    dispensador.horarios = horarios_ordenados
-    dispensador.save(update_fields=['horarios'])
-    
-    print(f"✅ Horarios actualizados (post-delete) para dispensador {dispensador.id}: {horarios_ordenados}")
+    dispensador = models.ForeignKey(Dispenser, on_delete=models.CASCADE, related_name='bloques_lecturas')
+    sensor = models.CharField(max_length=20, choices=SENSORES_CHOICES)
+    inicio = models.DateTimeField()
+    cantidad = models.PositiveIntegerField(default=0)
+    tiempos = models.BinaryField(default=bytes)
+    valores = models.BinaryField(default=bytes)
 
+    def __str__(self):
+        return f"{self.sensor} de dispensador {self.dispensador_id} desde {self.inicio}"
+
+    class Meta:
+        unique_together = ['dispensador', 'sensor', 'inicio']
 
-# --- 🔥 SEÑAL PARA CUANDO SE ACTUALIZA UNA MASCOTA ---
-@receiver(post_save, sender=Pet)
-def asignar_dispensador_automatico(sender, instance, **kwargs):
+
+class ResumenLecturas(models.Model):
     """
-    Si una mascota tiene un dispensador asignado, crear automáticamente
-    un registro de Horario para ella.
+    Agregado incremental (min/max/suma/cantidad) de un sensor por minuto, hora o día.
     """
-    try:
-        dispensador = instance.dispenser
-        # Verificar si ya existe un horario para esta mascota y dispensador
-        if not Horario.objects.filter(mascota=instance, dispensador=dispensador).exists():
-            Horario.objects.create(
-                mascota=instance,
-                dispensador=dispensador,
-                usuario=instance.user,
-                horarios=["08:00", "18:00"]  # Horarios por defecto
-            )
-            print(f"✅ Horario creado automáticamente para {instance.name}")
-    except Dispenser.DoesNotExist:
-        # La mascota no tiene dispensador asignado
-        pass
\ No newline at end of file
+    RESOLUCIONES = [
+        ('1m', '1 minuto'),
+        ('1h', '1 hora'),
+        ('1d', '1 día'),
+    ]
+
+    dispensador = models.ForeignKey(Dispenser, on_delete=models.CASCADE, related_name='resumenes_lecturas')
+    sensor = models.CharField(max_length=20, choices=SENSORES_CHOICES)
+    resolucion = models.CharField(max_length=2, choices=RESOLUCIONES)
+    inicio = models.DateTimeField()
+    minimo = models.FloatField()
+    maximo = models.FloatField()
+    suma = models.FloatField()
+    cantidad = models.PositiveIntegerField()
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else None
+
+    def __str__(self):
+        return f"{self.sensor} ({self.resolucion}) de dispensador {self.dispensador_id} en {self.inicio}"
+
+    class Meta:
+        unique_together = ['dispensador', 'sensor', 'resolucion', 'inicio']
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PaginacionCursor(CursorPagination):
+    """
+    Paginación por cursor para todos los listados (DEFAULT_PAGINATION_CLASS).
+
+    El cursor codifica la posición en el orden por id, así que cada página es
+    una consulta con LIMIT sobre el índice, sin OFFSET ni COUNT(*), y no se
+    repiten ni se saltan registros si se crean otros mientras se pagina.
+    """
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
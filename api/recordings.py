@@ -0,0 +1,266 @@
+"""
+Ejecución en segundo plano de las grabaciones de video (modelo Grabacion).
+
+- Manuales: se suscriben al CameraHub y guardan `duracion` segundos desde ese
+  momento, así que no le disputan la cámara a los streams ni al historial.
+- De evento: al activarse el motor se arma un clip con los segundos previos
+  (historial en memoria del CameraHub) y los posteriores, sin abrir otra
+  captura de la cámara.
+
+Ambas se escriben como AVI MJPG con los JPEG que ya codificó el hub.
+"""
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+import cv2
+import numpy as np
+
+from .models import Grabacion
+from .tareas import tarea
+
+
+def iniciar_grabacion(grabacion):
+    """Lanza la grabación en un hilo y regresa de inmediato."""
+    hilo = threading.Thread(
+        target=_ejecutar, args=(grabacion.id,), name=f"grabacion-{grabacion.id}", daemon=True
+    )
+    hilo.start()
+
+
+def _actualizar(grabacion_id, **campos):
+    Grabacion.objects.filter(id=grabacion_id).update(actualizado_en=timezone.now(), **campos)
+
+
+def _ejecutar(grabacion_id):
+    from .hardware import obtener_camara
+
+    ruta = escritor = None
+    try:
+        grabacion = Grabacion.objects.get(id=grabacion_id)
+        nombre = f"videos/grabacion_{grabacion.id}_{uuid.uuid4().hex[:8]}.avi"
+        ruta = os.path.join(settings.MEDIA_ROOT, nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        _actualizar(grabacion_id, estado='grabando')
+
+        camara = obtener_camara()
+        intervalo = 1.0 / settings.GRABACION_FPS
+        primero = ultimo = None
+        ultima_escritura = time.monotonic()
+        with camara.suscribir() as suscripcion:
+            inicio = time.monotonic()
+            while time.monotonic() - inicio < grabacion.duracion:
+                cuadro = suscripcion.siguiente()
+                if cuadro is None:
+                    raise RuntimeError(camara.error or "La cámara dejó de enviar cuadros.")
+                # El hub captura a su ritmo; aquí solo se guardan GRABACION_FPS cuadros por segundo
+                if ultimo is not None and cuadro.timestamp - ultimo < intervalo:
+                    continue
+                if escritor is None:
+                    alto, ancho = cuadro.imagen.shape[:2]
+                    escritor = EscritorAviMjpg(ruta, settings.GRABACION_FPS, ancho, alto)
+                    primero = cuadro.timestamp
+                escritor.agregar(cuadro.jpeg)
+                ultimo = cuadro.timestamp
+
+                # Progreso como máximo una vez por segundo; también sirve de
+                # latido para marcar_grabaciones_huerfanas
+                if time.monotonic() - ultima_escritura >= 1:
+                    ultima_escritura = time.monotonic()
+                    progreso = min(100.0, (time.monotonic() - inicio) * 100 / grabacion.duracion)
+                    _actualizar(grabacion_id, progreso=round(progreso, 1))
+
+        # fps medido, para que el video dure lo mismo que la grabación
+        segundos = ultimo - primero
+        escritor.cerrar(fps=(escritor.total - 1) / segundos if segundos > 0 else None)
+        _actualizar(grabacion_id, estado='completada', progreso=100, archivo=nombre)
+        print(f"✅ Grabación {grabacion_id} guardada en {nombre} ({escritor.total} cuadros)")
+    except Exception as e:
+        if escritor is not None:
+            escritor.cerrar()
+        if ruta and os.path.exists(ruta):
+            os.remove(ruta)
+        _actualizar(grabacion_id, estado='fallida', error=f"Ocurrió un error inesperado: {e}")
+        print(f"❌ Grabación {grabacion_id}: {e}", file=sys.stderr)
+    finally:
+        connection.close()
+
+
+@tarea('grabaciones_huerfanas', cada='GRABACIONES_REVISION_INTERVALO')
+def marcar_grabaciones_huerfanas():
+    """
+    Marca 'fallida' las grabaciones que quedaron a medias porque el proceso que
+    las ejecutaba se reinició. Las vivas actualizan `actualizado_en` cada
+    segundo (las de evento al terminar su ventana posterior), así que solo se
+    tocan las que llevan más que eso sin cambios.
+    """
+    limite = timezone.now() - timedelta(seconds=settings.CAMARA_POSTEVENTO_SEGUNDOS + 30)
+    marcadas = Grabacion.objects.filter(
+        estado__in=['pendiente', 'grabando'], actualizado_en__lt=limite
+    ).update(estado='fallida', error="La grabación se interrumpió por un reinicio del servidor.", actualizado_en=timezone.now())
+    if marcadas:
+        print(f"🧹 {marcadas} grabaciones interrumpidas marcadas como fallidas")
+
+
+# --- Clips de eventos de comida ---
+
+def iniciar_historial_camara():
+    """Enciende el historial de la cámara si está configurado. Se llama desde wsgi.py / asgi.py."""
+    if settings.CAMARA_PREEVENTO_SEGUNDOS:
+        from .hardware import obtener_camara
+
+        obtener_camara().iniciar_historial(
+            settings.CAMARA_PREEVENTO_SEGUNDOS + settings.CAMARA_POSTEVENTO_SEGUNDOS,
+            fps=settings.CAMARA_HISTORIAL_FPS,
+        )
+
+
+def grabar_evento(usuario_id, dispensador_id=None):
+    """
+    Registra un clip alrededor de este instante y regresa de inmediato. El clip
+    se escribe cuando termina la ventana posterior. Devuelve la Grabacion o
+    None si el historial está desactivado.
+    """
+    from .hardware import obtener_camara
+
+    camara = obtener_camara()
+    if not settings.CAMARA_PREEVENTO_SEGUNDOS or not camara.fps_historial:
+        return None
+
+    momento = time.time()
+    grabacion = Grabacion.objects.create(
+        usuario_id=usuario_id,
+        dispensador_id=dispensador_id,
+        origen='evento',
+        estado='grabando',
+        duracion=settings.CAMARA_PREEVENTO_SEGUNDOS + settings.CAMARA_POSTEVENTO_SEGUNDOS,
+    )
+    hilo = threading.Thread(
+        target=_ejecutar_evento, args=(grabacion.id, camara, momento),
+        name=f"grabacion-{grabacion.id}", daemon=True
+    )
+    hilo.start()
+    return grabacion
+
+
+def _fragmento(fourcc, datos):
+    # Los fragmentos RIFF van alineados a 2 bytes
+    return fourcc + struct.pack('<I', len(datos)) + datos + b'\0' * (len(datos) % 2)
+
+
+def _lista(tipo, *fragmentos):
+    return _fragmento(b'LIST', tipo + b''.join(fragmentos))
+
+
+class EscritorAviMjpg:
+    """
+    Escribe JPEG como cuadros de un AVI MJPG, sin decodificarlos ni
+    recodificarlos. Los cuadros van directo al archivo; las cabeceras (que
+    llevan el total de cuadros) se reescriben al cerrar.
+    """
+
+    def __init__(self, ruta, fps, ancho, alto):
+        self.fps = fps
+        self.ancho = ancho
+        self.alto = alto
+        self.total = 0
+        self._indice = []
+        self._mayor = 0
+        self._posicion = 4  # los desplazamientos del índice cuentan desde 'movi'
+        self._archivo = open(ruta, 'wb')
+        # Mismo tamaño que las definitivas: cerrar() las escribe encima
+        self._archivo.write(self._cabeceras())
+
+    def _cabeceras(self):
+        # fps fraccionario como escala/tasa
+        tasa, escala = round(self.fps * 1000), 1000
+        avih = struct.pack(
+            '<14I', round(1_000_000 / self.fps), 0, 0, 0x10, self.total, 0, 1, self._mayor,
+            self.ancho, self.alto, 0, 0, 0, 0
+        )
+        strh = b'vids' + b'MJPG' + struct.pack(
+            '<IHHIIIIIIiI4h', 0, 0, 0, 0, escala, tasa, 0, self.total, self._mayor, -1, 0,
+            0, 0, self.ancho, self.alto
+        )
+        strf = struct.pack(
+            '<IiiHH4sIiiII', 40, self.ancho, self.alto, 1, 24, b'MJPG', self.ancho * self.alto * 3, 0, 0, 0, 0
+        )
+        cabecera = _lista(b'hdrl', _fragmento(b'avih', avih), _lista(b'strl', _fragmento(b'strh', strh), _fragmento(b'strf', strf)))
+
+        tamano_movi = self._posicion
+        tamano_riff = 4 + len(cabecera) + 8 + tamano_movi + 8 + 16 * self.total
+        return (
+            b'RIFF' + struct.pack('<I', tamano_riff) + b'AVI ' + cabecera
+            + b'LIST' + struct.pack('<I', tamano_movi) + b'movi'
+        )
+
+    def agregar(self, jpeg):
+        self._indice.append(b'00dc' + struct.pack('<III', 0x10, self._posicion, len(jpeg)))
+        self._posicion += 8 + len(jpeg) + len(jpeg) % 2
+        self._mayor = max(self._mayor, len(jpeg))
+        self.total += 1
+        self._archivo.write(_fragmento(b'00dc', jpeg))
+
+    def cerrar(self, fps=None):
+        """Escribe el índice y las cabeceras definitivas. `fps` corrige la tasa del video."""
+        if self._archivo.closed:
+            return
+        if fps:
+            self.fps = fps
+        try:
+            self._archivo.write(_fragmento(b'idx1', b''.join(self._indice)))
+            self._archivo.seek(0)
+            self._archivo.write(self._cabeceras())
+        finally:
+            self._archivo.close()
+
+
+def escribir_avi_mjpg(ruta, jpegs, fps, ancho, alto):
+    """Escribe los JPEG como cuadros de un AVI MJPG, sin decodificarlos ni recodificarlos."""
+    escritor = EscritorAviMjpg(ruta, fps, ancho, alto)
+    for jpeg in jpegs:
+        escritor.agregar(jpeg)
+    escritor.cerrar()
+
+
+def _ejecutar_evento(grabacion_id, camara, momento):
+    try:
+        time.sleep(settings.CAMARA_POSTEVENTO_SEGUNDOS)
+        cuadros = camara.historial(
+            momento - settings.CAMARA_PREEVENTO_SEGUNDOS,
+            momento + settings.CAMARA_POSTEVENTO_SEGUNDOS,
+        )
+        if not cuadros:
+            _actualizar(grabacion_id, estado='fallida', error=camara.error or "No hay cuadros en el historial de la cámara.")
+            return
+
+        nombre = f"videos/evento_{grabacion_id}_{uuid.uuid4().hex[:8]}.avi"
+        ruta = os.path.join(settings.MEDIA_ROOT, nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+        # Los JPEG del historial se copian tal cual en un AVI MJPG; solo el
+        # primero se decodifica, para saber el tamaño del video
+        imagen = cv2.imdecode(np.frombuffer(cuadros[0][1], np.uint8), cv2.IMREAD_COLOR)
+        if imagen is None:
+            raise ValueError("El historial de la cámara tiene cuadros dañados.")
+        alto, ancho = imagen.shape[:2]
+        escribir_avi_mjpg(ruta, [jpeg for _, jpeg in cuadros], camara.fps_historial, ancho, alto)
+
+        _actualizar(
+            grabacion_id, estado='completada', progreso=100, archivo=nombre,
+            duracion=round(cuadros[-1][0] - cuadros[0][0], 1),
+        )
+        print(f"✅ Clip de evento {grabacion_id} guardado en {nombre} ({len(cuadros)} cuadros)")
+    except Exception as e:
+        _actualizar(grabacion_id, estado='fallida', error=f"Ocurrió un error inesperado: {e}")
+        print(f"❌ Clip de evento {grabacion_id}: {e}", file=sys.stderr)
+    finally:
+        connection.close()
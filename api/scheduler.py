@@ -0,0 +1,235 @@
+"""
+Programador de comidas: activa el motor de cada dispensador a las horas de su
+campo `horarios` ("HH:MM" en la zona PROGRAMADOR_ZONA_HORARIA, la de la casa;
+TIME_ZONE se queda en UTC).
+
+Mantiene un min-heap con el próximo disparo de cada (dispensador, hora) y el
+hilo duerme hasta que vence el primero, sin recorrer la tabla cada minuto.
+Cuando cambia un dispensador solo se reprograman sus entradas: las viejas se
+invalidan subiendo su "generación" y se descartan al salir del heap.
+
+Las señales de Dispenser solo llegan al programador si el cambio se hizo en
+el mismo proceso; los cambios que atienden otros workers se recogen cada
+PROGRAMADOR_RECONCILIAR segundos comparando con la tabla (`reconciliar`).
+"""
+import heapq
+import itertools
+import json
+import sys
+import threading
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import OperationalError, ProgrammingError, connection
+from django.utils import timezone
+
+# Si el servidor estuvo ocupado o dormido, un disparo atrasado más que esto se omite
+TOLERANCIA_ATRASO = timedelta(minutes=5)
+
+
+def normalizar_horarios(horarios):
+    """Dispenser.horarios puede venir como lista o como JSON en texto (ver DispenserSerializer)."""
+    if isinstance(horarios, str):
+        try:
+            horarios = json.loads(horarios)
+        except json.JSONDecodeError:
+            return []
+    if not isinstance(horarios, list):
+        return []
+    return [h for h in horarios if isinstance(h, str)]
+
+
+def ahora_local():
+    """Hora actual en la zona de los horarios (PROGRAMADOR_ZONA_HORARIA)."""
+    return timezone.localtime(timezone=ZoneInfo(settings.PROGRAMADOR_ZONA_HORARIA))
+
+
+def proximo_disparo(hora, ahora):
+    """Siguiente datetime (aware) para una hora "HH:MM" a partir de `ahora`."""
+    try:
+        horas, minutos = (int(parte) for parte in hora.split(':'))
+        objetivo = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    except ValueError:
+        return None
+    if objetivo <= ahora:
+        # Suma en hora local (zoneinfo): se mantiene HH:MM aunque cambie el horario de verano
+        objetivo += timedelta(days=1)
+    return objetivo
+
+
+class ProgramadorComidas:
+    """Min-heap de disparos pendientes más el hilo que los ejecuta."""
+
+    def __init__(self, disparar):
+        # disparar(dispensador_id, hora) se ejecuta en el hilo del programador
+        self.disparar = disparar
+        self._heap = []
+        self._generaciones = {}
+        # dispensador_id -> (horas, activo) ya programados, para `reconciliar`
+        self._programados = {}
+        self._secuencia = itertools.count()
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._hilo_reconciliar = None
+        self._detener = False
+        self._detenido = threading.Event()
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self):
+        """Carga los dispensadores y arranca el hilo de disparos y el de reconciliación."""
+        if self.activo:
+            return
+        self.reconciliar()
+        self._detener = False
+        self._detenido.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="programador-comidas", daemon=True)
+        self._hilo.start()
+        if settings.PROGRAMADOR_RECONCILIAR:
+            self._hilo_reconciliar = threading.Thread(
+                target=self._bucle_reconciliar, name="programador-reconciliar", daemon=True
+            )
+            self._hilo_reconciliar.start()
+        print(f"✅ Programador de comidas iniciado con {len(self._heap)} horarios")
+
+    def detener(self):
+        with self._condicion:
+            self._detener = True
+            self._condicion.notify()
+        self._detenido.set()
+        for hilo in (self._hilo, self._hilo_reconciliar):
+            if hilo:
+                hilo.join(timeout=2)
+
+    def actualizar_dispensador(self, dispensador_id, horarios, activo):
+        """Reemplaza los disparos pendientes de un dispensador (O(horas del dispensador))."""
+        ahora = ahora_local()
+        horas = frozenset(normalizar_horarios(horarios))
+        with self._condicion:
+            generacion = self._generaciones.get(dispensador_id, 0) + 1
+            self._generaciones[dispensador_id] = generacion
+            self._programados[dispensador_id] = (horas, bool(activo))
+            if activo:
+                for hora in horas:
+                    disparo = proximo_disparo(hora, ahora)
+                    if disparo:
+                        self._agregar(disparo, dispensador_id, hora, generacion)
+            self._condicion.notify()
+
+    def eliminar_dispensador(self, dispensador_id):
+        with self._condicion:
+            self._generaciones.pop(dispensador_id, None)
+            self._programados.pop(dispensador_id, None)
+            self._condicion.notify()
+
+    def reconciliar(self):
+        """
+        Compara lo programado con la tabla y reprograma solo los dispensadores
+        que cambiaron, se crearon o se borraron sin pasar por las señales de
+        este proceso.
+        """
+        from .models import Dispenser
+
+        en_bd = {
+            dispensador_id: (frozenset(normalizar_horarios(horarios)), status)
+            for dispensador_id, horarios, status in Dispenser.objects.values_list('id', 'horarios', 'status')
+        }
+        with self._condicion:
+            programados = dict(self._programados)
+        for dispensador_id in programados.keys() - en_bd.keys():
+            self.eliminar_dispensador(dispensador_id)
+        for dispensador_id, (horas, activo) in en_bd.items():
+            if programados.get(dispensador_id) != (horas, activo):
+                self.actualizar_dispensador(dispensador_id, list(horas), activo)
+
+    def _bucle_reconciliar(self):
+        # Espera en su propio Event: los notify() de la condición son para el hilo de disparos
+        while not self._detenido.wait(settings.PROGRAMADOR_RECONCILIAR):
+            try:
+                self.reconciliar()
+            except Exception as e:
+                print(f"❌ Programador de comidas: no se pudo reconciliar con la BD: {e}", file=sys.stderr)
+            finally:
+                connection.close()
+
+    def _agregar(self, disparo, dispensador_id, hora, generacion):
+        heapq.heappush(self._heap, (disparo.timestamp(), next(self._secuencia), dispensador_id, hora, generacion))
+
+    def _siguiente_vencido(self):
+        """Espera hasta que venza el primer disparo vigente y lo devuelve (o None al detener)."""
+        with self._condicion:
+            while not self._detener:
+                if not self._heap:
+                    self._condicion.wait()
+                    continue
+                momento, _, dispensador_id, hora, generacion = self._heap[0]
+                if self._generaciones.get(dispensador_id) != generacion:
+                    # Entrada reemplazada por una actualización posterior
+                    heapq.heappop(self._heap)
+                    continue
+                espera = momento - timezone.now().timestamp()
+                if espera > 0:
+                    self._condicion.wait(espera)
+                    continue
+                heapq.heappop(self._heap)
+                # Reprogramar la misma hora para el día siguiente
+                siguiente = proximo_disparo(hora, ahora_local())
+                if siguiente:
+                    self._agregar(siguiente, dispensador_id, hora, generacion)
+                return momento, dispensador_id, hora
+        return None
+
+    def _bucle(self):
+        while True:
+            vencido = self._siguiente_vencido()
+            if vencido is None:
+                return
+            momento, dispensador_id, hora = vencido
+            atraso = timezone.now().timestamp() - momento
+            if atraso > TOLERANCIA_ATRASO.total_seconds():
+                print(f"⚠️ Comida de las {hora} omitida en dispensador {dispensador_id} ({int(atraso)} s de atraso)", file=sys.stderr)
+                continue
+            try:
+                self.disparar(dispensador_id, hora)
+            except Exception as e:
+                print(f"❌ Error al dispensar en dispensador {dispensador_id} ({hora}): {e}", file=sys.stderr)
+
+
+def dispensar(dispensador_id, hora):
+    """
+    Acción por defecto del programador: activar el motor de la ESP32, grabar
+    el clip de la comida y reproducir los audios asignados a esa hora.
+    """
+    from .audio import reproducir_audios_comida
+    from .hardware import obtener_esp32
+    from .models import Dispenser
+    from .recordings import grabar_evento
+
+    dispensador = Dispenser.objects.filter(id=dispensador_id).only('user', 'transporte', 'puerto', 'baudrate').first()
+    if dispensador is None:
+        return
+
+    # Cada dispensador usa su propia ESP32 (o la por defecto si no tiene transporte)
+    output, error = obtener_esp32(dispensador).activar_motor()
+    if error:
+        print(f"❌ Comida de las {hora} en dispensador {dispensador_id}: {error}", file=sys.stderr)
+    else:
+        print(f"✅ Comida de las {hora} servida en dispensador {dispensador_id}")
+        grabar_evento(dispensador.user_id, dispensador_id)
+        reproducir_audios_comida(dispensador_id, hora)
+
+
+programador = ProgramadorComidas(dispensar)
+
+
+def iniciar_programador():
+    """Arranca el programador si está habilitado. Se llama desde wsgi.py / asgi.py."""
+    if settings.PROGRAMADOR_COMIDAS_ACTIVO:
+        try:
+            programador.iniciar()
+        except (OperationalError, ProgrammingError) as e:
+            # Migraciones sin aplicar: que el servidor arranque y muestre su aviso
+            print(f"❌ Programador de comidas sin iniciar (¿faltan migraciones?): {e}", file=sys.stderr)
@@ -1,14 +1,62 @@
-import base64
-import uuid
-from django.core.files.base import ContentFile
+from django.urls import reverse
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
-from .models import User, Pet, Dispenser, Horario
+from .models import User, Pet, Dispenser, Horario, Grabacion, AudioClip
+from .images import (
+    guardar_base64_temporal, encolar_imagen, quitar_imagen, nuevo_token, elegir_variante, variantes_al_dia
+)
 import json
 import re
+import sys
+
+
+def _url_absoluta(request, url):
+    return request.build_absolute_uri(url) if request else url
+
+
+def url_imagen(obj, request):
+    """
+    URL de la foto. Con ?image_size=N (px) se entrega la variante más chica
+    que alcance N; sin parámetro, el original.
+    """
+    if not obj.image:
+        return None
+    tamano = getattr(request, 'query_params', {}).get('image_size')
+    if tamano and tamano.isdigit():
+        return _url_absoluta(request, obj.image.storage.url(elegir_variante(obj, int(tamano))))
+    return _url_absoluta(request, obj.image.url)
+
+
+def urls_variantes(obj, request):
+    """{"64": url, "256": url, ...}; vacío mientras se generan."""
+    if not obj.image or not variantes_al_dia(obj):
+        return {}
+    return {
+        tamano: _url_absoluta(request, obj.image.storage.url(nombre))
+        for tamano, nombre in obj.image_variants.items()
+    }
+
+
+class CamposDinamicosMixin:
+    """
+    Permite pedir solo algunos campos en las lecturas con ?fields=id,name.
+    Los campos que no se piden se quitan del serializer, así que ni siquiera
+    se calculan. Los nombres desconocidos se ignoran.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        campos = request.query_params.get('fields')
+        if not campos:
+            return
+        pedidos = {campo.strip() for campo in campos.split(',') if campo.strip()}
+        for nombre in set(self.fields) - pedidos:
+            self.fields.pop(nombre)
 
 # --- User Serializer (ACTUALIZADO PARA MANEJAR IMÁGENES) ---
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False)
     
     # 🔥 NUEVO: Campo para recibir imagen en base64 (igual que en PetSerializer)
@@ -21,6 +69,7 @@ class UserSerializer(serializers.ModelSerializer):
     
     # 🔥 NUEVO: Campo para mostrar URL completa de la imagen
     image_url = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = User
@@ -31,6 +80,7 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name', 
             'image',        # Campo del modelo (solo lectura)
             'image_url',    # 🔥 NUEVO: URL completa
+            'image_variants',  # URLs de las versiones reducidas
             'image_base64', # 🔥 NUEVO: Para recibir base64
             'password',
             'date_joined',
@@ -58,12 +108,10 @@ class UserSerializer(serializers.ModelSerializer):
     
     def get_image_url(self, obj):
         """Obtener URL completa de la imagen (igual que en PetSerializer)"""
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
+        return url_imagen(obj, self.context.get('request'))
+
+    def get_image_variants(self, obj):
+        return urls_variantes(obj, self.context.get('request'))
     
     def create(self, validated_data):
         """Crear usuario con imagen en base64"""
@@ -75,6 +123,7 @@ class UserSerializer(serializers.ModelSerializer):
         
         # Procesar imagen si viene
         self._process_image(user, image_base64)
+        self._encolar_imagen(user)
         
         return user
     
@@ -96,62 +145,44 @@ class UserSerializer(serializers.ModelSerializer):
         self._process_image(instance, image_base64)
         
         instance.save()
+        self._encolar_imagen(instance)
         return instance
     
+    def _encolar_imagen(self, instancia):
+        """Encola la imagen base64 recibida, si hubo, ahora que el registro ya existe."""
+        ruta = getattr(self, '_imagen_pendiente', None)
+        if ruta:
+            self._imagen_pendiente = None
+            encolar_imagen(instancia, ruta)
+    
     def _process_image(self, user, image_base64):
         """Procesar imagen en base64 (igual que en PetSerializer)"""
-        print(f"🔍 [DEBUG User] Recibiendo image_base64: {image_base64[:100] if image_base64 else 'None'}")
-        
         if image_base64 is None:
-            print("🔍 [DEBUG User] image_base64 es None, no se procesa")
             return  # No hacer nada si no viene imagen
         
         if image_base64 == '':
-            print("🔍 [DEBUG User] image_base64 es string vacío, eliminando imagen")
             # String vacío = eliminar imagen existente
-            if user.image:
-                user.image.delete(save=False)
-            user.image = None
+            quitar_imagen(user)
+            nuevo_token(user)
         elif image_base64.startswith('data:image'):
             try:
-                print("🔍 [DEBUG User] Procesando imagen base64...")
-                # Decodificar base64
                 format, imgstr = image_base64.split(';base64,')
-                ext = format.split('/')[-1]  # jpeg, png, etc.
-                
-                print(f"🔍 [DEBUG User] Formato: {format}, Extensión: {ext}")
-                
-                # Generar nombre único para el archivo
-                filename = f"user_{user.id}_{uuid.uuid4().hex[:8]}.{ext}"
-                print(f"🔍 [DEBUG User] Nombre archivo: {filename}")
-                
-                # Decodificar base64 a bytes
-                image_bytes = base64.b64decode(imgstr)
-                print(f"🔍 [DEBUG User] Tamaño imagen: {len(image_bytes)} bytes")
-                
-                # Crear archivo de contenido
-                data = ContentFile(image_bytes, name=filename)
-                
-                # Eliminar imagen anterior si existe
-                if user.image:
-                    print(f"🔍 [DEBUG User] Eliminando imagen anterior: {user.image.name}")
-                    user.image.delete(save=False)
                 
-                # Guardar nueva imagen
-                print(f"🔍 [DEBUG User] Guardando nueva imagen...")
-                user.image.save(filename, data, save=False)
-                print(f"✅ [DEBUG User] Imagen guardada exitosamente: {user.image.name}")
+                # Decodificar, validar y guardar la imagen se hace en la cola de
+                # tareas (procesar_imagen), después de guardar el registro
+                self._imagen_pendiente = guardar_base64_temporal(imgstr)
                 
             except Exception as e:
-                print(f"❌ [DEBUG User] Error procesando imagen base64: {e}")
-                import traceback
-                traceback.print_exc()
+                print(f"❌ Error procesando imagen base64: {e}", file=sys.stderr)
         else:
-            print(f"⚠️ [DEBUG User] Formato de imagen no válido: {image_base64[:100]}...")
+            print(f"⚠️ Formato de imagen no válido: {image_base64[:100]}...", file=sys.stderr)
     
     def to_representation(self, instance):
         """Personalizar representación para el frontend"""
         representation = super().to_representation(instance)
+        if 'image' not in self.fields:
+            # Excluido con ?fields=
+            return representation
         
         # Mantener compatibilidad: también incluir 'image' como URL
         if 'image_url' in representation and representation['image_url']:
@@ -162,7 +193,7 @@ class UserSerializer(serializers.ModelSerializer):
         return representation
 
 # --- Pet Serializer (ACTUALIZADO PARA MANEJAR BASE64) ---
-class PetSerializer(serializers.ModelSerializer):
+class PetSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     # 🔥 NUEVO: Campo para recibir imagen en base64 desde el frontend
     image_base64 = serializers.CharField(
         write_only=True, 
@@ -173,6 +204,7 @@ class PetSerializer(serializers.ModelSerializer):
     
     # 🔥 NUEVO: Campo para mostrar URL completa de la imagen
     image_url = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = Pet
@@ -184,6 +216,7 @@ class PetSerializer(serializers.ModelSerializer):
             'race', 
             'image',        # Campo del modelo (solo lectura)
             'image_url',    # 🔥 NUEVO: URL completa
+            'image_variants',  # URLs de las versiones reducidas
             'image_base64', # 🔥 NUEVO: Para recibir base64
             'user'
         ]
@@ -191,12 +224,10 @@ class PetSerializer(serializers.ModelSerializer):
     
     def get_image_url(self, obj):
         """Obtener URL completa de la imagen"""
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
+        return url_imagen(obj, self.context.get('request'))
+
+    def get_image_variants(self, obj):
+        return urls_variantes(obj, self.context.get('request'))
     
     def validate(self, data):
         """Validaciones adicionales"""
@@ -224,6 +255,7 @@ class PetSerializer(serializers.ModelSerializer):
         
         # Procesar imagen si viene
         self._process_image(pet, image_base64)
+        self._encolar_imagen(pet)
         
         return pet
     
@@ -240,62 +272,44 @@ class PetSerializer(serializers.ModelSerializer):
         self._process_image(instance, image_base64)
         
         instance.save()
+        self._encolar_imagen(instance)
         return instance
     
+    def _encolar_imagen(self, instancia):
+        """Encola la imagen base64 recibida, si hubo, ahora que el registro ya existe."""
+        ruta = getattr(self, '_imagen_pendiente', None)
+        if ruta:
+            self._imagen_pendiente = None
+            encolar_imagen(instancia, ruta)
+    
     def _process_image(self, pet, image_base64):
         """Procesar imagen en base64"""
-        print(f"🔍 [DEBUG] Recibiendo image_base64: {image_base64[:100] if image_base64 else 'None'}")
-        
         if image_base64 is None:
-            print("🔍 [DEBUG] image_base64 es None, no se procesa")
             return  # No hacer nada si no viene imagen
         
         if image_base64 == '':
-            print("🔍 [DEBUG] image_base64 es string vacío, eliminando imagen")
             # String vacío = eliminar imagen existente
-            if pet.image:
-                pet.image.delete(save=False)
-            pet.image = None
+            quitar_imagen(pet)
+            nuevo_token(pet)
         elif image_base64.startswith('data:image'):
             try:
-                print("🔍 [DEBUG] Procesando imagen base64...")
-                # Decodificar base64
                 format, imgstr = image_base64.split(';base64,')
-                ext = format.split('/')[-1]  # jpeg, png, etc.
-                
-                print(f"🔍 [DEBUG] Formato: {format}, Extensión: {ext}")
-                
-                # Generar nombre único para el archivo
-                filename = f"pet_{pet.id}_{uuid.uuid4().hex[:8]}.{ext}"
-                print(f"🔍 [DEBUG] Nombre archivo: {filename}")
                 
-                # Decodificar base64 a bytes
-                image_bytes = base64.b64decode(imgstr)
-                print(f"🔍 [DEBUG] Tamaño imagen: {len(image_bytes)} bytes")
-                
-                # Crear archivo de contenido
-                data = ContentFile(image_bytes, name=filename)
-                
-                # Eliminar imagen anterior si existe
-                if pet.image:
-                    print(f"🔍 [DEBUG] Eliminando imagen anterior: {pet.image.name}")
-                    pet.image.delete(save=False)
-                
-                # Guardar nueva imagen
-                print(f"🔍 [DEBUG] Guardando nueva imagen...")
-                pet.image.save(filename, data, save=False)
-                print(f"✅ [DEBUG] Imagen guardada exitosamente: {pet.image.name}")
+                # Decodificar, validar y guardar la imagen se hace en la cola de
+                # tareas (procesar_imagen), después de guardar el registro
+                self._imagen_pendiente = guardar_base64_temporal(imgstr)
                 
             except Exception as e:
-                print(f"❌ [DEBUG] Error procesando imagen base64: {e}")
-                import traceback
-                traceback.print_exc()
+                print(f"❌ Error procesando imagen base64: {e}", file=sys.stderr)
         else:
-            print(f"⚠️ [DEBUG] Formato de imagen no válido: {image_base64[:100]}...")
-        
+            print(f"⚠️ Formato de imagen no válido: {image_base64[:100]}...", file=sys.stderr)
+    
     def to_representation(self, instance):
         """Personalizar representación para el frontend"""
         representation = super().to_representation(instance)
+        if 'image' not in self.fields:
+            # Excluido con ?fields=
+            return representation
         
         # Mantener compatibilidad: también incluir 'image' como URL
         if 'image_url' in representation and representation['image_url']:
@@ -308,7 +322,7 @@ class PetSerializer(serializers.ModelSerializer):
 # --- Dispenser Serializer (ACTUALIZADO CON CAMPOS BOOLEAN) ---
 
 # --- Dispenser Serializer (ACTUALIZADO CON CAMPOS BOOLEAN) ---
-class DispenserSerializer(serializers.ModelSerializer):
+class DispenserSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     # Campos booleanos explícitos para mejor manejo en el frontend
     status_display = serializers.SerializerMethodField(read_only=True)
     fp_display = serializers.SerializerMethodField(read_only=True)
@@ -329,8 +343,14 @@ class DispenserSerializer(serializers.ModelSerializer):
             'wp_display',      # Campo adicional para display
             'horarios',
             'user',
-            'pet'
+            'pet',
+            'transporte',      # '' = ESP32 por defecto del servidor
+            'puerto',
+            'baudrate',
         ]
+        # La conexión hace que el servidor abra ese puerto o dirección: solo se
+        # configura desde el admin (Dispenser.clean valida los valores)
+        read_only_fields = ['transporte', 'puerto', 'baudrate']
 
     def get_status_display(self, obj):
         """Devuelve 'Activo' o 'Inactivo' para el frontend"""
@@ -365,6 +385,9 @@ class DispenserSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
+        if 'horarios' not in self.fields:
+            # Excluido con ?fields=
+            return representation
         
         # Manejo robusto de horarios
         db_horarios = instance.horarios
@@ -409,7 +432,7 @@ class DispenserSerializer(serializers.ModelSerializer):
         return super().to_internal_value(data)
 
 # --- HorarioSerializer (ACTUALIZADO) ---
-class HorarioSerializer(serializers.ModelSerializer):
+class HorarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     
     # Campos de solo lectura para mostrar información relacionada
     mascota_nombre = serializers.CharField(source='mascota.name', read_only=True)
@@ -428,10 +451,18 @@ class HorarioSerializer(serializers.ModelSerializer):
             'dispensador', 'dispensador_ubicacion', 'dispensador_status', 'dispensador_status_display',
             'usuario', 'usuario_email',
             'horarios', 
+            'audio',
             'creado_en', 'actualizado_en'
         ]
         read_only_fields = ['creado_en', 'actualizado_en', 'usuario']
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Solo se pueden elegir audios propios: uno ajeno es un id inválido (400)
+        request = self.context.get('request')
+        if 'audio' in self.fields and request is not None and request.user.is_authenticated:
+            self.fields['audio'].queryset = AudioClip.objects.filter(usuario=request.user)
+    
     def get_dispensador_status_display(self, obj):
         """Devuelve el status del dispensador como string para display"""
         return "Activo" if obj.dispensador.status else "Inactivo"
@@ -480,4 +511,53 @@ class HorarioSerializer(serializers.ModelSerializer):
         """
         if 'usuario' not in validated_data and 'mascota' in validated_data:
             validated_data['usuario'] = validated_data['mascota'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+
+# --- Grabacion Serializer ---
+class GrabacionSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    # URL completa del video cuando la grabación terminó
+    archivo_url = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = Grabacion
+        fields = [
+            'id',
+            'duracion',
+            'estado',
+            'progreso',
+            'archivo_url',
+            'error',
+            'origen', 'dispensador',
+            'creado_en', 'actualizado_en'
+        ]
+        read_only_fields = ['estado', 'progreso', 'error', 'origen', 'dispensador', 'creado_en', 'actualizado_en']
+
+    def get_archivo_url(self, obj):
+        """URL de descarga del video (requiere al dueño autenticado)"""
+        if obj.archivo:
+            return _url_absoluta(self.context.get('request'), reverse('grabacion-archivo', args=[obj.id]))
+        return None
+
+    def validate_duracion(self, value):
+        """La duración debe estar entre 1 segundo y 10 minutos"""
+        if value < 1 or value > 600:
+            raise serializers.ValidationError("La duración debe estar entre 1 y 600 segundos")
+        return value
+
+
+# --- AudioClip Serializer ---
+class AudioClipSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    # URL completa del WAV transcodificado
+    archivo_url = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = AudioClip
+        fields = ['id', 'nombre', 'duracion', 'archivo_url', 'creado_en']
+        read_only_fields = ['duracion', 'creado_en']
+
+    def get_archivo_url(self, obj):
+        """URL de descarga del audio (requiere al dueño autenticado)"""
+        if obj.archivo:
+            return _url_absoluta(self.context.get('request'), reverse('audio-archivo', args=[obj.id]))
+        return None
@@ -0,0 +1,79 @@
+"""
+Arranque de los servicios de fondo: programador de comidas, historial de la
+cámara, ESP32 de los dispensadores y pool de tareas.
+
+Con varios workers (gunicorn -w N) wsgi.py se importa una vez por proceso, y
+cada copia del programador activaría el motor: la mascota comería N veces.
+Por eso solo los arranca el proceso que tiene el candado SERVICIOS_LOCK
+(flock sobre un archivo). Los demás se quedan esperándolo en un hilo y toman
+el relevo si ese proceso termina. Con SERVICIOS_LOCK = None se arrancan sin
+candado.
+
+Las rutas de /esp32/, la cámara y la bocina siguen abriendo el hardware en el
+worker que atiende la petición, así que con hardware real hay que correr un
+solo worker (o fijar la petición a uno); el candado solo evita los servicios
+duplicados.
+"""
+import sys
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock, cada proceso arranca sus servicios
+    fcntl = None
+
+_candado = None
+_iniciados = False
+_lock = threading.Lock()
+
+
+def _arrancar():
+    global _iniciados
+    from .scheduler import iniciar_programador
+    from .recordings import iniciar_historial_camara
+    from .hardware import iniciar_dispositivos
+    from .tareas import iniciar_tareas
+
+    with _lock:
+        if _iniciados:
+            return
+        _iniciados = True
+    iniciar_programador()
+    iniciar_historial_camara()
+    iniciar_dispositivos()
+    iniciar_tareas()
+
+
+def _esperar_candado():
+    # Bloquea hasta que el proceso que tiene los servicios termine
+    fcntl.flock(_candado, fcntl.LOCK_EX)
+    print("🔒 Servicios de fondo tomados por este proceso")
+    try:
+        _arrancar()
+    except Exception as e:
+        print(f"❌ No se pudieron arrancar los servicios de fondo: {e}", file=sys.stderr)
+    finally:
+        connection.close()
+
+
+def iniciar_servicios():
+    """Se llama desde wsgi.py / asgi.py."""
+    global _candado
+    if not settings.SERVICIOS_LOCK or fcntl is None:
+        _arrancar()
+        return
+    with _lock:
+        if _candado is not None:
+            return
+        # Se mantiene abierto toda la vida del proceso: cerrarlo suelta el candado
+        _candado = open(settings.SERVICIOS_LOCK, 'a')
+    try:
+        fcntl.flock(_candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("ℹ️ Otro proceso corre los servicios de fondo; este queda en espera", file=sys.stderr)
+        threading.Thread(target=_esperar_candado, name="servicios-candado", daemon=True).start()
+        return
+    _arrancar()
@@ -1,67 +1,146 @@
 # api/signals.py
-from django.db.models.signals import post_save, post_delete
+import threading
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
-from .models import Horario, Pet, Dispenser
+from .models import User, Horario, Pet, Dispenser, ConteoHorario, AudioClip
+from .scheduler import programador
+from . import hardware
+from .images import sincronizar_variantes, borrar_variantes
+from .media import ajustar_referencias
 
 # --- 🔥 SEÑALES PARA SINCRONIZACIÓN AUTOMÁTICA ---
+# Dispenser.horarios es la unión de las horas de todos sus Horario. En lugar de
+# recalcularla recorriendo todos los registros, cada guardado aplica solo la
+# diferencia sobre ConteoHorario (dentro de la misma transacción) y la lista del
+# dispensador se reescribe una sola vez al confirmar la transacción.
+
+_pendientes = threading.local()
+
+
+def _dispensadores_pendientes():
+    if not hasattr(_pendientes, 'ids'):
+        _pendientes.ids = set()
+    return _pendientes.ids
+
+
+def _aplicar_diferencia(dispensador_id, horas_antes, horas_despues):
+    """Ajusta los conteos solo de las horas que cambiaron. O(horas cambiadas)."""
+    delta = Counter()
+    for hora in set(horas_despues) - set(horas_antes):
+        delta[hora] += 1
+    for hora in set(horas_antes) - set(horas_despues):
+        delta[hora] -= 1
+    if not delta:
+        return
+
+    for hora, cambio in delta.items():
+        actualizados = ConteoHorario.objects.filter(
+            dispensador_id=dispensador_id, hora=hora
+        ).update(conteo=F('conteo') + cambio)
+        if not actualizados and cambio > 0:
+            # Otra petición puede estar insertando la misma hora: get_or_create
+            # resuelve la carrera y el incremento se aplica igual con F()
+            ConteoHorario.objects.get_or_create(dispensador_id=dispensador_id, hora=hora)
+            ConteoHorario.objects.filter(
+                dispensador_id=dispensador_id, hora=hora
+            ).update(conteo=F('conteo') + cambio)
+
+    _dispensadores_pendientes().add(dispensador_id)
+    # Se registra en cada cambio, pero solo la primera ejecución encuentra trabajo:
+    # todos los cambios de una transacción terminan en una sola escritura por dispensador.
+    transaction.on_commit(_sincronizar_dispensadores)
+
+
+def _sincronizar_dispensadores():
+    """Reescribe Dispenser.horarios de los dispensadores tocados, si cambió."""
+    pendientes = _dispensadores_pendientes()
+    while pendientes:
+        dispensador_id = pendientes.pop()
+        try:
+            dispensador = Dispenser.objects.get(id=dispensador_id)
+        except Dispenser.DoesNotExist:
+            continue
+
+        horarios_ordenados = sorted(ConteoHorario.objects.filter(
+            dispensador_id=dispensador_id, conteo__gt=0
+        ).values_list('hora', flat=True))
+        if dispensador.horarios == horarios_ordenados:
+            continue
+
+        dispensador.horarios = horarios_ordenados
+        dispensador.save(update_fields=['horarios'])
+        print(f"✅ Horarios actualizados para dispensador {dispensador_id}: {horarios_ordenados}")
+
+
+def _leer_estado_guardado(instance):
+    """
+    Sin estado previo conocido (instancia con .only(), armada a mano o cuyo
+    último guardado aún no se confirma): se consulta la fila guardada.
+    """
+    if instance.pk is not None and not hasattr(instance, '_estado_guardado'):
+        fila = Horario.objects.filter(pk=instance.pk).values_list('dispensador_id', 'horarios').first()
+        if fila is not None:
+            instance._estado_guardado = (fila[0], list(fila[1]))
+
+
+def _recordar_al_confirmar(instance, atributo, valor):
+    """
+    El valor recién escrito solo cuenta como "guardado" si la transacción se
+    confirma: hasta entonces se olvida, y si se revierte el siguiente guardado
+    lee la fila de la BD en lugar de descontar algo que nunca se sumó.
+    """
+    instance.__dict__.pop(atributo, None)
+    transaction.on_commit(lambda: setattr(instance, atributo, valor))
+
 
-@receiver(post_save, sender=Horario)
-def actualizar_horarios_dispensador(sender, instance, **kwargs):
+@receiver(pre_save, sender=Horario, dispatch_uid='api.estado_guardado_horario')
+def recordar_estado_guardado(sender, instance, **kwargs):
+    _leer_estado_guardado(instance)
+
+
+@receiver(post_save, sender=Horario, dispatch_uid='api.actualizar_horarios_dispensador')
+def actualizar_horarios_dispensador(sender, instance, created, **kwargs):
     """
-    Actualiza automáticamente el campo 'horarios' del dispensador
-    cuando se guarda un registro en Horario.
+    Aplica al dispensador la diferencia entre los horarios guardados antes
+    y los nuevos. Si el registro cambió de dispensador, se descuentan del
+    anterior y se suman al nuevo.
     """
-    dispensador = instance.dispensador
-    
-    # Obtener todos los horarios únicos de este dispensador
-    todos_horarios = set()
-    
-    # Recorrer todos los registros de Horario para este dispensador
-    horarios_del_dispensador = Horario.objects.filter(dispensador=dispensador)
-    
-    for horario_reg in horarios_del_dispensador:
-        for hora in horario_reg.horarios:
-            todos_horarios.add(hora)
-    
-    # Convertir a lista ordenada
-    horarios_ordenados = sorted(list(todos_horarios))
-    
-    # Actualizar el dispensador
-    dispensador.horarios = horarios_ordenados
-    dispensador.save(update_fields=['horarios'])
-    
-    print(f"✅ Horarios actualizados para dispensador {dispensador.id}: {horarios_ordenados}")
-
-
-@receiver(post_delete, sender=Horario)
+    if created:
+        anterior = (instance.dispensador_id, [])
+    else:
+        anterior = instance._estado_guardado
+
+    dispensador_antes, horas_antes = anterior
+    if dispensador_antes != instance.dispensador_id:
+        _aplicar_diferencia(dispensador_antes, horas_antes, [])
+        horas_antes = []
+    _aplicar_diferencia(instance.dispensador_id, horas_antes, instance.horarios)
+
+    _recordar_al_confirmar(instance, '_estado_guardado', (instance.dispensador_id, list(instance.horarios)))
+
+
+@receiver(pre_delete, sender=Horario, dispatch_uid='api.estado_borrado_horario')
+def recordar_estado_borrado(sender, instance, **kwargs):
+    _leer_estado_guardado(instance)
+
+
+@receiver(post_delete, sender=Horario, dispatch_uid='api.actualizar_horarios_dispensador_eliminado')
 def actualizar_horarios_dispensador_eliminado(sender, instance, **kwargs):
     """
-    Actualiza automáticamente el campo 'horarios' del dispensador
-    cuando se elimina un registro en Horario.
+    Descuenta del dispensador las horas del registro eliminado.
     """
-    dispensador = instance.dispensador
-    
-    # Obtener todos los horarios únicos restantes de este dispensador
-    todos_horarios = set()
-    
-    horarios_del_dispensador = Horario.objects.filter(dispensador=dispensador)
-    
-    for horario_reg in horarios_del_dispensador:
-        for hora in horario_reg.horarios:
-            todos_horarios.add(hora)
-    
-    # Convertir a lista ordenada
-    horarios_ordenados = sorted(list(todos_horarios))
-    
-    # Actualizar el dispensador
-    dispensador.horarios = horarios_ordenados
-    dispensador.save(update_fields=['horarios'])
-    
-    print(f"✅ Horarios actualizados (post-delete) para dispensador {dispensador.id}: {horarios_ordenados}")
+    dispensador_id, horas = getattr(
+        instance, '_estado_guardado', (instance.dispensador_id, instance.horarios)
+    )
+    _aplicar_diferencia(dispensador_id, horas, [])
 
 
 # --- 🔥 SEÑAL PARA CUANDO SE ACTUALIZA UNA MASCOTA ---
-@receiver(post_save, sender=Pet)
+@receiver(post_save, sender=Pet, dispatch_uid='api.asignar_dispensador_automatico')
 def asignar_dispensador_automatico(sender, instance, **kwargs):
     """
     Si una mascota tiene un dispensador asignado, crear automáticamente
@@ -74,9 +153,105 @@ def asignar_dispensador_automatico(sender, instance, **kwargs):
             Horario.objects.create(
                 mascota=instance,
                 dispensador=dispensador,
+                usuario=instance.user,
                 horarios=["08:00", "18:00"]  # Horarios por defecto
             )
             print(f"✅ Horario creado automáticamente para {instance.name}")
     except Dispenser.DoesNotExist:
         # La mascota no tiene dispensador asignado
-        pass
\ No newline at end of file
+        pass
+
+
+# --- 🔥 SEÑALES PARA EL PROGRAMADOR DE COMIDAS Y EL REGISTRO DE DISPOSITIVOS ---
+@receiver(post_save, sender=Dispenser, dispatch_uid='api.reprogramar_dispensador')
+def reprogramar_dispensador(sender, instance, **kwargs):
+    """
+    Reprograma solo las comidas de este dispensador cuando cambian sus
+    horarios o su status (incluye el guardado que hacen las señales de Horario).
+    """
+    if programador.activo:
+        programador.actualizar_dispensador(instance.id, instance.horarios, instance.status)
+    # Si cambió su conexión con la ESP32, soltar la anterior
+    hardware.actualizar_dispensador(instance)
+
+
+@receiver(post_delete, sender=Dispenser, dispatch_uid='api.desprogramar_dispensador')
+def desprogramar_dispensador(sender, instance, **kwargs):
+    if programador.activo:
+        programador.eliminar_dispensador(instance.id)
+    hardware.actualizar_dispensador(instance, eliminado=True)
+
+
+# --- 🔥 SEÑAL PARA LA BIBLIOTECA DE AUDIOS ---
+@receiver(post_delete, sender=AudioClip, dispatch_uid='api.borrar_archivo_audio')
+def borrar_archivo_audio(sender, instance, **kwargs):
+    """Elimina el WAV del disco junto con el registro."""
+    if instance.archivo:
+        instance.archivo.delete(save=False)
+
+
+# --- 🔥 SEÑALES PARA LAS VARIANTES DE LAS FOTOS ---
+@receiver(post_save, sender=User, dispatch_uid='api.variantes_usuario')
+@receiver(post_save, sender=Pet, dispatch_uid='api.variantes_mascota')
+def actualizar_variantes_imagen(sender, instance, **kwargs):
+    """Si cambió la foto, regenera sus versiones reducidas en segundo plano."""
+    sincronizar_variantes(instance)
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='api.leer_variantes_usuario')
+@receiver(pre_delete, sender=Pet, dispatch_uid='api.leer_variantes_mascota')
+def leer_variantes_borradas(sender, instance, **kwargs):
+    # Cargada con .only()/.defer(): se leen antes de que desaparezca la fila
+    if 'image_variants' in instance.get_deferred_fields():
+        instance.refresh_from_db(fields=['image_variants'])
+
+
+@receiver(post_delete, sender=User, dispatch_uid='api.borrar_variantes_usuario')
+@receiver(post_delete, sender=Pet, dispatch_uid='api.borrar_variantes_mascota')
+def borrar_variantes_imagen(sender, instance, **kwargs):
+    if instance.image_variants:
+        borrar_variantes(instance.image_variants)
+
+
+# --- 🔥 SEÑALES PARA LAS REFERENCIAS DE LOS ARCHIVOS (MediaBlob) ---
+def _leer_imagen_guardada(sender, instance):
+    """
+    Instancias sin la foto leída de la BD (.only(), .defer('image') o armadas a
+    mano): se consulta la guardada antes de que se pise o se borre la fila.
+    """
+    if instance.pk is not None and not hasattr(instance, '_imagen_guardada'):
+        instance._imagen_guardada = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() or ''
+
+
+@receiver(pre_save, sender=User, dispatch_uid='api.imagen_guardada_usuario')
+@receiver(pre_save, sender=Pet, dispatch_uid='api.imagen_guardada_mascota')
+def recordar_imagen_guardada(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'image' in update_fields:
+        _leer_imagen_guardada(sender, instance)
+
+
+@receiver(post_save, sender=User, dispatch_uid='api.referencias_imagen_usuario')
+@receiver(post_save, sender=Pet, dispatch_uid='api.referencias_imagen_mascota')
+def actualizar_referencias_imagen(sender, instance, created, update_fields=None, **kwargs):
+    """Si la foto cambió, descuenta la referencia del blob anterior y suma la del nuevo."""
+    if update_fields is not None and 'image' not in update_fields:
+        # La foto no se escribió
+        return
+    actual = instance.image.name or ''
+    anterior = '' if created else instance._imagen_guardada
+    if anterior != actual:
+        ajustar_referencias(anterior, -1)
+        ajustar_referencias(actual, 1)
+    _recordar_al_confirmar(instance, '_imagen_guardada', actual)
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='api.imagen_borrada_usuario')
+@receiver(pre_delete, sender=Pet, dispatch_uid='api.imagen_borrada_mascota')
+def recordar_imagen_borrada(sender, instance, **kwargs):
+    _leer_imagen_guardada(sender, instance)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='api.soltar_imagen_usuario')
+@receiver(post_delete, sender=Pet, dispatch_uid='api.soltar_imagen_mascota')
+def soltar_imagen(sender, instance, **kwargs):
+    ajustar_referencias(instance._imagen_guardada, -1)
@@ -0,0 +1,213 @@
+"""
+Cola de tareas de fondo con la tabla Tarea como respaldo.
+
+Las vistas solo guardan los datos y encolan (`encolar`) el trabajo pesado o
+lento: procesar una foto, generar sus variantes, borrar archivos. Un pool de
+TAREAS_HILOS hilos toma las tareas de la tabla; cada una se reclama con un
+UPDATE condicional, así que varios procesos del servidor pueden compartir la
+misma tabla sin ejecutar dos veces un trabajo. Pillow suelta el GIL al
+decodificar, redimensionar y codificar, de modo que los hilos sí aprovechan
+varios núcleos.
+
+Las funciones se registran con el decorador `@tarea('tipo')`. Con `cada`
+(nombre de un setting en segundos) la tarea es periódica: al terminar se
+vuelve a programar. Si la función lanza ErrorDefinitivo no se reintenta; con
+`al_fallar` se limpia lo que la tarea deja pendiente cuando ya no habrá otro
+intento.
+"""
+import sys
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, ProgrammingError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Tarea
+
+# tipo -> (función, reintentos, setting con el intervalo o None, función al fallar o None)
+_registro = {}
+_pool = None
+_lock = threading.Lock()
+
+
+class ErrorDefinitivo(Exception):
+    """Error que no se arregla reintentando (datos inválidos): la tarea queda 'fallida'."""
+
+
+def tarea(tipo, reintentos=2, cada=None, al_fallar=None):
+    """
+    Registra la función que ejecuta las tareas de `tipo`. `al_fallar` se
+    llama con los mismos argumentos cuando la tarea queda 'fallida'.
+    """
+    def registrar(funcion):
+        _registro[tipo] = (funcion, reintentos, cada, al_fallar)
+        return funcion
+    return registrar
+
+
+def encolar(tipo, unica=False, ejecutar_despues=None, **argumentos):
+    """
+    Crea la tarea (dentro de la transacción actual) y avisa al pool al
+    confirmarla. Con `unica` no se duplica una igual que siga pendiente.
+    """
+    if tipo not in _registro:
+        raise ValueError(f"Tipo de tarea '{tipo}' no registrado.")
+    if unica and Tarea.objects.filter(tipo=tipo, argumentos=argumentos, estado='pendiente').exists():
+        return None
+    nueva = Tarea.objects.create(
+        tipo=tipo, argumentos=argumentos, ejecutar_despues=ejecutar_despues or timezone.now()
+    )
+    transaction.on_commit(avisar)
+    return nueva
+
+
+def avisar():
+    if _pool is not None:
+        _pool.avisar()
+
+
+def _vencidas():
+    """
+    Tareas 'ejecutando' sin cambios en más de TAREAS_TIMEOUT: el proceso que
+    las tomó se cayó o se reinició, así que cualquiera puede reclamarlas.
+    """
+    limite = timezone.now() - timedelta(seconds=settings.TAREAS_TIMEOUT)
+    return Q(estado='ejecutando', actualizado_en__lt=limite)
+
+
+def _tomar():
+    """Reclama la siguiente tarea lista (o vencida). Devuelve la Tarea o None."""
+    ahora = timezone.now()
+    reclamables = Q(estado='pendiente', ejecutar_despues__lte=ahora) | _vencidas()
+    candidatas = Tarea.objects.filter(reclamables).order_by(
+        'ejecutar_despues', 'id'
+    ).values_list('id', flat=True)[:10]
+    for tarea_id in candidatas:
+        # Solo uno de los hilos/procesos que compiten logra el UPDATE
+        if Tarea.objects.filter(reclamables, id=tarea_id).update(
+            estado='ejecutando', intentos=F('intentos') + 1, actualizado_en=ahora
+        ):
+            return Tarea.objects.get(id=tarea_id)
+    return None
+
+
+def ejecutar(tarea_obj):
+    """Ejecuta una tarea ya reclamada y guarda el resultado."""
+    funcion, reintentos, cada, al_fallar = _registro.get(tarea_obj.tipo, (None, 0, None, None))
+    try:
+        if funcion is None:
+            raise ErrorDefinitivo(f"Tipo de tarea '{tarea_obj.tipo}' no registrado.")
+        if tarea_obj.intentos > reintentos + 1:
+            # Reclamada tras caerse el proceso en cada intento: no insistir
+            raise ErrorDefinitivo("La tarea se interrumpió en todos sus intentos.")
+        funcion(**tarea_obj.argumentos)
+    except Exception as e:
+        print(f"❌ Tarea {tarea_obj.id} {tarea_obj.tipo} (intento {tarea_obj.intentos}): {e}", file=sys.stderr)
+        campos = {'error': f"{type(e).__name__}: {e}", 'actualizado_en': timezone.now()}
+        if tarea_obj.intentos <= reintentos and not isinstance(e, ErrorDefinitivo):
+            # Reintento con espera creciente
+            espera = settings.TAREAS_ESPERA * 2 ** tarea_obj.intentos
+            campos.update(estado='pendiente', ejecutar_despues=timezone.now() + timedelta(seconds=espera))
+        else:
+            campos['estado'] = 'fallida'
+            if al_fallar is not None:
+                try:
+                    al_fallar(**tarea_obj.argumentos)
+                except Exception as e:
+                    print(f"❌ Limpieza de la tarea {tarea_obj.id}: {e}", file=sys.stderr)
+        Tarea.objects.filter(id=tarea_obj.id).update(**campos)
+    else:
+        Tarea.objects.filter(id=tarea_obj.id).update(estado='completada', error='', actualizado_en=timezone.now())
+
+    if cada and Tarea.objects.filter(id=tarea_obj.id).exclude(estado='pendiente').exists():
+        _programar_periodica(tarea_obj.tipo, cada)
+
+
+def _programar_periodica(tipo, cada):
+    intervalo = getattr(settings, cada)
+    if intervalo:
+        encolar(tipo, unica=True, ejecutar_despues=timezone.now() + timedelta(seconds=intervalo))
+
+
+class PoolTareas:
+    """Hilos que toman tareas de la tabla; `avisar` despierta a uno sin esperar al sondeo."""
+
+    def __init__(self, hilos=2, espera=5):
+        self.espera = espera
+        self._condicion = threading.Condition()
+        self._avisos = 0
+        self._hilos = [
+            threading.Thread(target=self._bucle, name=f"tareas-{i}", daemon=True) for i in range(hilos)
+        ]
+
+    def iniciar(self):
+        for hilo in self._hilos:
+            hilo.start()
+
+    def avisar(self):
+        with self._condicion:
+            self._avisos += 1
+            self._condicion.notify()
+
+    def _esperar(self):
+        with self._condicion:
+            if not self._avisos:
+                # El sondeo cubre tareas de otros procesos y reintentos programados
+                self._condicion.wait(self.espera)
+            self._avisos = max(0, self._avisos - 1)
+
+    def _bucle(self):
+        while True:
+            try:
+                tarea_obj = _tomar()
+                if tarea_obj is None:
+                    self._esperar()
+                    continue
+                ejecutar(tarea_obj)
+            except Exception as e:
+                print(f"❌ Pool de tareas: {e}", file=sys.stderr)
+                self._esperar()
+            finally:
+                connection.close()
+
+
+def _programar_periodicas():
+    """Programa las periódicas que no tengan una pendiente o en curso (las vencidas no cuentan)."""
+    for tipo, (_, _, cada, _) in _registro.items():
+        activas = Tarea.objects.filter(tipo=tipo, estado__in=['pendiente', 'ejecutando']).exclude(_vencidas())
+        if cada and not activas.exists():
+            _programar_periodica(tipo, cada)
+
+
+def iniciar_tareas():
+    """
+    Arranca el pool y programa las tareas periódicas. Se llama desde wsgi.py /
+    asgi.py. Las tareas que quedaron 'ejecutando' por un reinicio las vuelve a
+    tomar el pool al vencer TAREAS_TIMEOUT (ver _tomar).
+    """
+    global _pool
+    # Registran sus tareas al importarse
+    from . import images, media, recordings  # noqa: F401
+
+    with _lock:
+        if _pool is not None or not settings.TAREAS_HILOS:
+            return
+        try:
+            _programar_periodicas()
+        except (OperationalError, ProgrammingError) as e:
+            # Migraciones sin aplicar: que el servidor arranque y muestre su aviso
+            print(f"❌ Cola de tareas sin iniciar (¿faltan migraciones?): {e}", file=sys.stderr)
+            return
+        finally:
+            connection.close()
+        _pool = PoolTareas(hilos=settings.TAREAS_HILOS, espera=settings.TAREAS_ESPERA)
+        _pool.iniciar()
+
+
+@tarea('limpiar_tareas', cada='TAREAS_LIMPIEZA_INTERVALO')
+def limpiar_tareas():
+    """Borra las tareas completadas más viejas que TAREAS_RETENCION segundos."""
+    limite = timezone.now() - timedelta(seconds=settings.TAREAS_RETENCION)
+    Tarea.objects.filter(estado='completada', actualizado_en__lt=limite).delete()
@@ -1,3 +1,1265 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+from PIL import Image
+import cv2
+import numpy as np
+
+from core.camera_hub import Cuadro
+
+from . import recordings
+from .models import User, Pet, Dispenser, Horario, ConteoHorario, Grabacion, AudioClip
+
+
+class PresupuestoConsultasTests(TestCase):
+    """
+    Número máximo de consultas SQL por listado. Debe ser el mismo con 1 o con
+    muchas filas: si un serializer empieza a leer relaciones que el queryset
+    no trae (N+1), estas pruebas fallan.
+    """
+    FILAS = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='dueno@example.com', password='x')
+        for i in range(cls.FILAS):
+            pet = Pet.objects.create(name=f'Mascota {i}', race='Mestizo', weight=10, age=3, user=cls.user)
+            dispenser = Dispenser.objects.create(ubication=f'Cocina {i}', FC=2, WC=100, user=cls.user, pet=pet)
+            Horario.objects.create(mascota=pet, dispensador=dispenser, usuario=cls.user, horarios=['08:00', '18:00'])
+            Grabacion.objects.create(usuario=cls.user, duracion=5, dispensador=dispenser)
+            AudioClip.objects.create(usuario=cls.user, nombre=f'Audio {i}', archivo=f'audios/clip_{i}.wav')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertListado(self, url, consultas):
+        with self.assertNumQueries(consultas):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), self.FILAS)
+
+    def test_horarios(self):
+        self.assertListado('/api/v1/horarios/', 1)
+
+    def test_horarios_filtrados(self):
+        dispenser = Dispenser.objects.first()
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/v1/horarios/?dispensador={dispenser.id}')
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_dispensers(self):
+        self.assertListado('/api/v1/dispensers/', 1)
+
+    def test_pets(self):
+        self.assertListado('/api/v1/pets/', 1)
+
+    def test_grabaciones(self):
+        self.assertListado('/api/v1/grabaciones/', 1)
+
+    def test_audios(self):
+        self.assertListado('/api/v1/audios/', 1)
+
+    def test_perfil(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/users/me/')
+        self.assertEqual(response.data['email'], self.user.email)
+
+
+class BenchmarkTests(TestCase):
+    """El benchmark (manage.py benchmark_api) debe recorrer todas las rutas sin errores."""
+
+    def test_todas_las_rutas_responden(self):
+        from .benchmark import ejecutar_benchmark
+
+        reporte = ejecutar_benchmark(usuarios=5, repeticiones=2, filas_principal=3)
+        self.assertEqual(reporte['datos']['usuarios'], 6 + 2)  # + los dos registros medidos
+        for nombre, medida in reporte['rutas'].items():
+            self.assertLess(medida['status'], 400, nombre)
+            self.assertLessEqual(medida['p50_ms'], medida['p95_ms'], nombre)
+
+
+class BenchmarkHardwareTests(TransactionTestCase):
+    """
+    Rutas de la ESP32 contra la ESP32 simulada. TransactionTestCase porque la
+    prueba de concurrencia hace peticiones desde otros hilos, que no ven los
+    datos de una transacción sin confirmar.
+    """
+
+    @override_settings(ESP32_TRANSPORT='simulado', ESP32_POLL_INTERVAL=0,
+                       ESP32_SIMULADOR={'latencia': 0, 'duracion_motor': 0, 'duracion_bomba': 0, 'semilla': 0})
+    def test_rutas_esp32_simulada(self):
+        from .benchmark import ejecutar_benchmark
+
+        reporte = ejecutar_benchmark(usuarios=2, repeticiones=2, filas_principal=1, hardware=True, hilos=2)
+        self.assertIn('esp32/read_sensors', reporte['rutas'])
+        for nombre, medida in reporte['rutas'].items():
+            self.assertLess(medida['status'], 400, nombre)
+        for nombre, medida in reporte['concurrencia'].items():
+            self.assertEqual(medida['peticiones'], 4, nombre)
+            self.assertEqual(medida['errores'], 0, nombre)
+
+
+@override_settings(ESP32_POLL_INTERVAL=0,
+                   ESP32_SIMULADOR={'latencia': 0, 'duracion_motor': 0, 'duracion_bomba': 0, 'semilla': 0})
+class DispositivosTests(TransactionTestCase):
+    """Cada dispensador con transporte propio habla con su propia ESP32."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='dueno@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.dispensadores = [
+            Dispenser.objects.create(ubication=f'Comedero {i}', FC=2, WC=100, user=self.user, transporte='simulado')
+            for i in range(2)
+        ]
+
+    def tearDown(self):
+        from . import hardware
+
+        hardware._cerrar_dispositivos()
+
+    def test_un_dispositivo_por_dispensador(self):
+        from . import hardware
+
+        primero, segundo = (hardware.obtener_dispositivo(d) for d in self.dispensadores)
+        self.assertIsNot(primero, segundo)
+        self.assertIs(hardware.obtener_dispositivo(self.dispensadores[0]), primero)
+
+        for dispensador in self.dispensadores:
+            response = self.client.get(f'/api/v1/esp32/read_sensor/?sensor=PESO_A&dispenser={dispensador.id}')
+            self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(primero.cache.obtener('PESO_A', 60))
+        self.assertIsNotNone(segundo.cache.obtener('PESO_A', 60))
+
+        # Sin transporte propio vuelve a la ESP32 por defecto y se suelta su conexión
+        self.dispensadores[0].transporte = ''
+        self.dispensadores[0].save()
+        self.assertFalse(primero.esp32._hilo.is_alive())
+
+    def test_dispensador_ajeno(self):
+        otro = User.objects.create_user(email='otro@example.com', password='x')
+        ajeno = Dispenser.objects.create(ubication='Ajeno', FC=2, WC=100, user=otro, transporte='simulado')
+        response = self.client.post('/api/v1/esp32/activate_pump/', {'dispenser': ajeno.id})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cuerpo_no_objeto(self):
+        for ruta in ('activate_pump', 'calibrate_tare', 'calibrate_set_weight'):
+            response = self.client.post(f'/api/v1/esp32/{ruta}/', [1, 2], format='json')
+            self.assertEqual(response.status_code, 400, ruta)
+
+    def test_conexion_solo_desde_admin(self):
+        from django.core.exceptions import ValidationError as ErrorModelo
+
+        dispensador = self.dispensadores[0]
+        response = self.client.patch(f'/api/v1/dispensers/{dispensador.id}/', {
+            'transporte': 'tcp', 'puerto': '127.0.0.1:22',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        dispensador.refresh_from_db()
+        self.assertEqual((dispensador.transporte, dispensador.puerto), ('simulado', ''))
+
+        # Un puerto ya asignado a otro usuario se rechaza al validar (admin)
+        otro = User.objects.create_user(email='otro@example.com', password='x')
+        Dispenser.objects.create(ubication='Ajeno', FC=2, WC=100, user=otro, transporte='serial', puerto='/dev/ttyUSB1')
+        dispensador.transporte, dispensador.puerto = 'serial', '/dev/ttyUSB1'
+        with self.assertRaises(ErrorModelo):
+            dispensador.clean()
+
+
+class LecturasTests(TestCase):
+    """Series de sensores: lo que sigue en el buffer también se consulta."""
+
+    def setUp(self):
+        from .timeseries import AlmacenLecturas
+
+        self.user = User.objects.create_user(email='dueno@example.com', password='x')
+        self.dispenser = Dispenser.objects.create(ubication='Cocina', FC=2, WC=100, user=self.user)
+        self.almacen = AlmacenLecturas(max_buffer=1000, intervalo_flush=3600)
+        self.ahora = timezone.now()
+
+    def tearDown(self):
+        self.almacen._buffer.clear()
+
+    def test_fecha_inexistente(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/v1/dispensers/{self.dispenser.id}/lecturas/?desde=2024-13-45T00:00')
+        self.assertEqual(response.status_code, 400)
+
+    def test_consulta_sin_escribir(self):
+        from .models import BloqueLecturas
+
+        self.almacen.registrar(self.dispenser.id, {'PESO_A': '100 g'}, self.ahora.timestamp() - 30)
+        self.almacen.registrar(self.dispenser.id, {'PESO_A': '200 g'}, self.ahora.timestamp() - 20)
+        desde = self.ahora - timedelta(hours=1)
+
+        _, crudo = self.almacen.consultar(self.dispenser.id, ['PESO_A'], desde, self.ahora, 'raw')
+        self.assertEqual([p['valor'] for p in crudo['PESO_A']], [100, 200])
+        self.assertFalse(BloqueLecturas.objects.exists())
+
+        # Lo guardado y lo pendiente se combinan en el mismo resumen
+        self.almacen.flush()
+        self.almacen.registrar(self.dispenser.id, {'PESO_A': '300 g'}, self.ahora.timestamp() - 10)
+        _, resumen = self.almacen.consultar(self.dispenser.id, ['PESO_A'], self.ahora - timedelta(days=2), self.ahora, '1m')
+        total = sum(p['count'] for p in resumen['PESO_A'])
+        self.assertEqual(total, 3)
+
+    def test_flush_fallido_conserva_lote(self):
+        from .models import BloqueLecturas
+
+        self.almacen.registrar(self.dispenser.id, {'PESO_A': '100 g'}, self.ahora.timestamp())
+        with mock.patch.object(self.almacen, '_guardar', side_effect=OperationalError('database is locked')):
+            self.almacen.flush()
+        self.assertEqual(len(self.almacen._buffer), 1)
+        self.almacen.flush()
+        self.assertEqual(BloqueLecturas.objects.get().cantidad, 1)
+
+
+class HorarioAudioTests(TestCase):
+    """Un horario solo puede usar audios del mismo usuario."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='dueno@example.com', password='x')
+        otro = User.objects.create_user(email='otro@example.com', password='x')
+        self.pet = Pet.objects.create(name='Firulais', race='Mestizo', weight=10, age=3, user=self.user)
+        self.dispenser = Dispenser.objects.create(ubication='Cocina', FC=2, WC=100, user=self.user, pet=self.pet)
+        self.propio = AudioClip.objects.create(usuario=self.user, nombre='Propio', archivo='audios/propio.wav')
+        self.ajeno = AudioClip.objects.create(usuario=otro, nombre='Ajeno', archivo='audios/ajeno.wav')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def crear(self, audio):
+        return self.client.post('/api/v1/horarios/', {
+            'mascota': self.pet.id, 'dispensador': self.dispenser.id, 'horarios': ['08:00'], 'audio': audio.id,
+        }, format='json')
+
+    def test_audio_ajeno(self):
+        response = self.crear(self.ajeno)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('audio', response.data)
+
+        horario = self.crear(self.propio).data
+        response = self.client.patch(f"/api/v1/horarios/{horario['id']}/", {'audio': self.ajeno.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Horario.objects.get(id=horario['id']).audio_id, self.propio.id)
+
+    def test_dispensador_ajeno(self):
+        otro = User.objects.get(email='otro@example.com')
+        ajeno = Dispenser.objects.create(ubication='Ajeno', FC=2, WC=100, user=otro)
+        response = self.client.post('/api/v1/horarios/', {
+            'mascota': self.pet.id, 'dispensador': ajeno.id, 'horarios': ['08:00'],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+def imagen_png(color=(255, 0, 0), tamano=(32, 32)):
+    salida = io.BytesIO()
+    Image.new('RGB', tamano, color).save(salida, 'PNG')
+    return salida.getvalue()
+
+
+class MediaTemporalMixin:
+    """MEDIA_ROOT en una carpeta temporal que se borra al terminar cada prueba."""
+
+    def setUp(self):
+        super().setUp()
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=carpeta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.user = User.objects.create_user(email='dueno@example.com', password='x')
+        self.pet = Pet.objects.create(name='Firulais', race='Mestizo', weight=10, age=3, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subir(self, pet, datos, tipo='image/png'):
+        return self.client.put(f'/api/v1/pets/{pet.id}/image/', datos, content_type=tipo)
+
+
+class SubidaImagenTests(MediaTemporalMixin, TestCase):
+    """/pets/<id>/image/: cuerpo binario o multipart, con límite de tamaño."""
+
+    def test_put_binario(self):
+        response = self.subir(self.pet, imagen_png())
+        self.assertEqual(response.status_code, 200)
+        self.pet.refresh_from_db()
+        self.assertTrue(self.pet.image.name.endswith('.png'))
+        self.assertTrue(self.pet.image.storage.exists(self.pet.image.name))
+
+    def test_multipart(self):
+        archivo = SimpleUploadedFile('foto.bin', imagen_png(), content_type='application/octet-stream')
+        response = self.client.post(f'/api/v1/pets/{self.pet.id}/image/', {'image': archivo}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.pet.refresh_from_db()
+        # La extensión sale del contenido, no del nombre que manda el cliente
+        self.assertTrue(self.pet.image.name.endswith('.png'))
+
+    @override_settings(IMAGEN_MAX_BYTES=1000)
+    def test_demasiado_grande(self):
+        grande = imagen_png(tamano=(300, 300)) + b'\0' * 5000
+        self.assertEqual(self.subir(self.pet, grande).status_code, 413)
+        archivo = SimpleUploadedFile('foto.png', grande, content_type='image/png')
+        response = self.client.post(f'/api/v1/pets/{self.pet.id}/image/', {'image': archivo}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.pet.refresh_from_db()
+        self.assertFalse(self.pet.image)
+
+    def test_no_es_imagen(self):
+        response = self.subir(self.pet, b'esto no es una imagen')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.subir(self.pet, imagen_png(), tipo='text/plain').status_code, 400)
+
+    def test_borrar(self):
+        self.subir(self.pet, imagen_png())
+        response = self.client.delete(f'/api/v1/pets/{self.pet.id}/image/')
+        self.assertEqual(response.status_code, 200)
+        self.pet.refresh_from_db()
+        self.assertFalse(self.pet.image)
+
+
+class VariantesImagenTests(MediaTemporalMixin, TestCase):
+    """Versiones reducidas de la foto y elección con ?image_size."""
+
+    def setUp(self):
+        super().setUp()
+        from .images import generar_variantes
+
+        self.subir(self.pet, imagen_png(tamano=(600, 400)))
+        generar_variantes(Pet, self.pet.id)
+        self.pet.refresh_from_db()
+
+    def url_con_tamano(self, tamano):
+        return self.client.get(f'/api/v1/pets/{self.pet.id}/?image_size={tamano}').data['image_url']
+
+    def test_variantes_generadas(self):
+        from .models import Tarea
+
+        self.assertTrue(Tarea.objects.filter(tipo='variantes_imagen').exists())
+        self.assertEqual(sorted(self.pet.image_variants, key=int), ['64', '256', '1024'])
+        with self.pet.image.storage.open(self.pet.image_variants['256']) as archivo, Image.open(archivo) as imagen:
+            self.assertEqual(imagen.format, 'WEBP')
+            self.assertEqual(max(imagen.size), 256)
+
+    def test_elegir_tamano(self):
+        self.assertTrue(self.url_con_tamano(10).endswith('_64.webp'))
+        self.assertTrue(self.url_con_tamano(100).endswith('_256.webp'))
+        self.assertTrue(self.url_con_tamano(1024).endswith('_1024.webp'))
+        # Más grande que todas las variantes: el original
+        self.assertTrue(self.url_con_tamano(5000).endswith('.png'))
+
+    def test_foto_nueva_descarta_variantes(self):
+        self.subir(self.pet, imagen_png(color=(0, 0, 255)))
+        self.pet.refresh_from_db()
+        self.assertEqual(self.pet.image_variants, {})
+        # Mientras se generan las nuevas se entrega el original
+        self.assertTrue(self.url_con_tamano(100).endswith('.png'))
+
+    def test_borrar_instancia_parcial(self):
+        from .models import Tarea
+
+        Pet.objects.only('id', 'image').get(id=self.pet.id).delete()
+        self.assertFalse(Pet.objects.filter(id=self.pet.id).exists())
+        # Las variantes de un blob las borra el recolector junto con el blob
+        self.assertFalse(Tarea.objects.filter(tipo='borrar_archivo').exists())
+
+
+class ReferenciasBlobTests(MediaTemporalMixin, TestCase):
+    """Conteo de referencias de MediaBlob y recolección de los blobs sin usar."""
+
+    def setUp(self):
+        super().setUp()
+        self.otra = Pet.objects.create(name='Michi', race='Siamés', weight=4, age=2, user=self.user)
+
+    def referencias(self, pet):
+        from .models import MediaBlob
+
+        pet.refresh_from_db()
+        return MediaBlob.objects.get(nombre=pet.image.name).referencias
+
+    def test_fotos_iguales_un_solo_blob(self):
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.subir(self.otra, imagen_png())
+        self.pet.refresh_from_db()
+        self.otra.refresh_from_db()
+        self.assertEqual(self.pet.image.name, self.otra.image.name)
+        self.assertEqual(MediaBlob.objects.count(), 1)
+        self.assertEqual(self.referencias(self.pet), 2)
+
+    def test_reemplazar_y_borrar(self):
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.subir(self.otra, imagen_png())
+        self.pet.refresh_from_db()
+        primera = self.pet.image.name
+
+        self.subir(self.pet, imagen_png(color=(0, 255, 0)))
+        self.assertEqual(MediaBlob.objects.get(nombre=primera).referencias, 1)
+        self.assertEqual(self.referencias(self.pet), 1)
+
+        self.client.delete(f'/api/v1/pets/{self.otra.id}/image/')
+        self.assertEqual(MediaBlob.objects.get(nombre=primera).referencias, 0)
+
+    def test_instancia_sin_foto_cargada(self):
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.subir(self.otra, imagen_png(color=(0, 0, 255)))
+        primera = Pet.objects.get(id=self.pet.id).image.name
+        segunda = Pet.objects.get(id=self.otra.id).image.name
+
+        # .only() sin 'image': las señales leen la foto guardada antes de pisarla
+        parcial = Pet.objects.only('id', 'name').get(id=self.pet.id)
+        parcial.image = segunda
+        parcial.save()
+        self.assertEqual(MediaBlob.objects.get(nombre=primera).referencias, 0)
+        self.assertEqual(MediaBlob.objects.get(nombre=segunda).referencias, 2)
+
+        Pet.objects.only('id').get(id=self.pet.id).delete()
+        self.assertEqual(MediaBlob.objects.get(nombre=segunda).referencias, 1)
+
+    def test_transaccion_revertida(self):
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.subir(self.otra, imagen_png(color=(0, 0, 255)))
+        self.pet.refresh_from_db()
+        primera = self.pet.image.name
+        segunda = Pet.objects.get(id=self.otra.id).image.name
+
+        self.pet.image = segunda
+        try:
+            with transaction.atomic():
+                self.pet.save()
+                raise OperationalError("falla simulada")
+        except OperationalError:
+            pass
+        self.assertEqual(MediaBlob.objects.get(nombre=primera).referencias, 1)
+
+        # El reintento descuenta la foto que quedó en la BD, no la del guardado revertido
+        self.pet.save()
+        self.assertEqual(MediaBlob.objects.get(nombre=primera).referencias, 0)
+        self.assertEqual(MediaBlob.objects.get(nombre=segunda).referencias, 2)
+
+    def test_borrado_en_cascada(self):
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.subir(self.otra, imagen_png())
+        nombre = Pet.objects.get(id=self.pet.id).image.name
+        self.user.delete()
+        self.assertEqual(MediaBlob.objects.get(nombre=nombre).referencias, 0)
+
+    def test_recolector_respeta_gracia(self):
+        from .media import recolectar_blobs
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.client.delete(f'/api/v1/pets/{self.pet.id}/image/')
+        blob = MediaBlob.objects.get()
+        storage = self.pet.image.storage
+
+        with override_settings(MEDIA_GC_GRACIA=3600):
+            self.assertEqual(recolectar_blobs(), 0)
+        self.assertTrue(storage.exists(blob.nombre))
+
+        MediaBlob.objects.filter(id=blob.id).update(actualizado_en=timezone.now() - timedelta(hours=2))
+        with override_settings(MEDIA_GC_GRACIA=3600):
+            self.assertEqual(recolectar_blobs(), 1)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(storage.exists(blob.nombre))
+
+    def test_recolector_no_toca_blobs_en_uso(self):
+        from .media import recolectar_blobs
+        from .models import MediaBlob
+
+        self.subir(self.pet, imagen_png())
+        self.assertEqual(recolectar_blobs(gracia=0), 0)
+        self.assertEqual(MediaBlob.objects.count(), 1)
+
+    def test_deduplicar_imagenes(self):
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from .models import MediaBlob, Tarea
+
+        # Dos fotos iguales guardadas con el esquema anterior
+        for pet in (self.pet, self.otra):
+            pet.image.save(f'pet_{pet.id}.png', ContentFile(imagen_png()))
+        self.assertFalse(MediaBlob.objects.exists())
+
+        call_command('deduplicar_imagenes', stdout=io.StringIO(), stderr=io.StringIO())
+        self.pet.refresh_from_db()
+        self.otra.refresh_from_db()
+        self.assertTrue(self.pet.image.name.startswith('blobs/'))
+        self.assertEqual(self.pet.image.name, self.otra.image.name)
+        self.assertEqual(self.referencias(self.pet), 2)
+        # Los archivos anteriores se borran desde la cola
+        self.assertEqual(Tarea.objects.filter(tipo='borrar_archivo').count(), 2)
+
+
+class ServirMediaTests(MediaTemporalMixin, TestCase):
+    """/media/: ETag, 304, cache de los blobs y rangos."""
+
+    def setUp(self):
+        super().setUp()
+        self.subir(self.pet, imagen_png(tamano=(200, 200)))
+        self.pet.refresh_from_db()
+        self.url = f'/media/{self.pet.image.name}'
+        self.tamano = self.pet.image.size
+
+    def test_etag_y_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_variantes_se_revalidan(self):
+        from .images import generar_variantes
+
+        generar_variantes(Pet, self.pet.id)
+        self.pet.refresh_from_db()
+        response = self.client.get(f"/media/{self.pet.image_variants['64']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_rangos(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{self.tamano}')
+        self.assertEqual(len(b''.join(response.streaming_content)), 10)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {self.tamano - 5}-{self.tamano - 1}/{self.tamano}')
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={self.tamano}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{self.tamano}')
+
+    def test_rango_mal_formado(self):
+        # Se ignora y se entrega el archivo completo
+        for rango in ('bytes=5-3', 'bytes=a-b', 'bytes=--3', 'bytes=-'):
+            response = self.client.get(self.url, HTTP_RANGE=rango)
+            self.assertEqual(response.status_code, 200, rango)
+            self.assertEqual(len(b''.join(response.streaming_content)), self.tamano)
+
+    def test_fuera_de_media_root(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/blobs/no/existe.png').status_code, 404)
+
+    def test_videos_solo_para_el_dueno(self):
+        from django.conf import settings
+
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'videos'))
+        with open(os.path.join(settings.MEDIA_ROOT, 'videos', 'clip.avi'), 'wb') as archivo:
+            archivo.write(b'RIFF' + b'\0' * 60)
+        grabacion = Grabacion.objects.create(
+            usuario=self.user, duracion=5, estado='completada', archivo='videos/clip.avi'
+        )
+        self.assertEqual(APIClient().get('/media/videos/clip.avi').status_code, 404)
+
+        detalle = self.client.get(f'/api/v1/grabaciones/{grabacion.id}/')
+        url = detalle.data['archivo_url']
+        self.assertTrue(url.endswith(f'/api/v1/grabaciones/{grabacion.id}/archivo/'))
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'RIFF')
+
+        otro = APIClient()
+        otro.force_authenticate(User.objects.create_user(email='otro@example.com', password='x'))
+        self.assertEqual(otro.get(url).status_code, 404)
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+
+class ColaTareasTests(MediaTemporalMixin, TestCase):
+    """Reclamo de tareas, reintentos con espera y la tarea 'procesar_imagen'."""
+
+    def setUp(self):
+        super().setUp()
+        from . import tareas
+
+        self.tareas = tareas
+        self.llamadas = []
+        self.fallos = []
+        tareas.tarea('prueba', reintentos=1, al_fallar=lambda **a: self.fallos.append(a))(self.ejecutar_prueba)
+        self.addCleanup(tareas._registro.pop, 'prueba')
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+        ajuste = override_settings(IMAGEN_TEMP_DIR=carpeta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def ejecutar_prueba(self, error=None):
+        self.llamadas.append(error)
+        if error == 'definitivo':
+            raise self.tareas.ErrorDefinitivo("datos inválidos")
+        if error:
+            raise OperationalError(error)
+
+    def test_reclamo_unico(self):
+        from .models import Tarea
+
+        encolada = self.tareas.encolar('prueba')
+        futura = self.tareas.encolar('prueba', ejecutar_despues=timezone.now() + timedelta(hours=1))
+        tomada = self.tareas._tomar()
+        self.assertEqual(tomada.id, encolada.id)
+        self.assertEqual((tomada.estado, tomada.intentos), ('ejecutando', 1))
+        # Ya reclamada, y la otra aún no toca
+        self.assertIsNone(self.tareas._tomar())
+
+        self.tareas.ejecutar(tomada)
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'completada')
+        self.assertEqual(Tarea.objects.get(id=futura.id).estado, 'pendiente')
+
+    def test_reintentos(self):
+        from .models import Tarea
+
+        encolada = self.tareas.encolar('prueba', error='database is locked')
+        self.tareas.ejecutar(self.tareas._tomar())
+        tarea = Tarea.objects.get(id=encolada.id)
+        self.assertEqual(tarea.estado, 'pendiente')
+        self.assertGreater(tarea.ejecutar_despues, timezone.now())
+        self.assertIn('database is locked', tarea.error)
+        self.assertEqual(self.fallos, [])
+
+        # Vencida la espera se toma de nuevo; sin más reintentos queda fallida
+        Tarea.objects.filter(id=tarea.id).update(ejecutar_despues=timezone.now())
+        self.tareas.ejecutar(self.tareas._tomar())
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), ('fallida', 2))
+        self.assertEqual(self.fallos, [{'error': 'database is locked'}])
+
+    def test_error_definitivo_no_se_reintenta(self):
+        from .models import Tarea
+
+        encolada = self.tareas.encolar('prueba', error='definitivo')
+        self.tareas.ejecutar(self.tareas._tomar())
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'fallida')
+        self.assertEqual(len(self.llamadas), 1)
+
+    def test_tarea_de_un_proceso_caido(self):
+        from .models import Tarea
+
+        encolada = self.tareas.encolar('prueba')
+        # El proceso que la tomó muere sin terminarla
+        self.assertEqual(self.tareas._tomar().id, encolada.id)
+        self.assertIsNone(self.tareas._tomar())
+
+        vencida = timezone.now() - timedelta(seconds=settings.TAREAS_TIMEOUT + 1)
+        Tarea.objects.filter(id=encolada.id).update(actualizado_en=vencida)
+        tomada = self.tareas._tomar()
+        self.assertEqual((tomada.id, tomada.intentos), (encolada.id, 2))
+        self.tareas.ejecutar(tomada)
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'completada')
+        self.assertEqual(len(self.llamadas), 1)
+
+    def test_tarea_que_tumba_el_proceso_siempre(self):
+        from .models import Tarea
+
+        encolada = self.tareas.encolar('prueba')
+        vencida = timezone.now() - timedelta(seconds=settings.TAREAS_TIMEOUT + 1)
+        for _ in range(3):
+            tomada = self.tareas._tomar()
+            Tarea.objects.filter(id=encolada.id).update(actualizado_en=vencida)
+        self.tareas.ejecutar(tomada)
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'fallida')
+        self.assertEqual(self.llamadas, [])
+        self.assertEqual(self.fallos, [{}])
+
+    def test_periodica_vencida_se_reprograma(self):
+        from .models import Tarea
+
+        self.tareas.tarea('periodica', cada='TAREAS_ESPERA')(lambda: None)
+        self.addCleanup(self.tareas._registro.pop, 'periodica')
+        caida = Tarea.objects.create(tipo='periodica', estado='ejecutando')
+        self.tareas._programar_periodicas()
+        self.assertEqual(Tarea.objects.filter(tipo='periodica').count(), 1)
+
+        vencida = timezone.now() - timedelta(seconds=settings.TAREAS_TIMEOUT + 1)
+        Tarea.objects.filter(id=caida.id).update(actualizado_en=vencida)
+        self.tareas._programar_periodicas()
+        self.assertEqual(Tarea.objects.filter(tipo='periodica', estado='pendiente').count(), 1)
+
+    def encolar_foto(self, contenido):
+        from .images import guardar_base64_temporal, encolar_imagen
+
+        ruta = guardar_base64_temporal(contenido)
+        return encolar_imagen(self.pet, ruta), ruta
+
+    def test_procesar_imagen(self):
+        import base64
+        import os
+
+        _, ruta = self.encolar_foto(base64.b64encode(imagen_png()).decode())
+        self.tareas.ejecutar(self.tareas._tomar())
+        self.pet.refresh_from_db()
+        self.assertTrue(self.pet.image.name.startswith('blobs/'))
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_procesar_imagen_error_pasajero_conserva_archivo(self):
+        import base64
+        import os
+        from .models import Tarea
+
+        encolada, ruta = self.encolar_foto(base64.b64encode(imagen_png()).decode())
+        with mock.patch('api.images.asignar_imagen', side_effect=OperationalError('database is locked')):
+            self.tareas.ejecutar(self.tareas._tomar())
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'pendiente')
+        self.assertTrue(os.path.exists(ruta))
+
+        Tarea.objects.filter(id=encolada.id).update(ejecutar_despues=timezone.now())
+        self.tareas.ejecutar(self.tareas._tomar())
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'completada')
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_base64_viejo_no_pisa_una_subida_nueva(self):
+        import base64
+        import os
+        from .models import Tarea
+
+        encolada, ruta = self.encolar_foto(base64.b64encode(imagen_png()).decode())
+        # Antes de que corra la tarea llega otra foto por multipart
+        self.subir(self.pet, imagen_png(color=(0, 255, 0)))
+        self.pet.refresh_from_db()
+        nueva = self.pet.image.name
+
+        self.tareas.ejecutar(self.tareas._tomar())
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'completada')
+        self.pet.refresh_from_db()
+        self.assertEqual(self.pet.image.name, nueva)
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_base64_en_orden(self):
+        import base64
+
+        self.encolar_foto(base64.b64encode(imagen_png()).decode())
+        self.encolar_foto(base64.b64encode(imagen_png(color=(0, 0, 255))).decode())
+        # Un reintento puede dejar la primera (roja) para después: la más nueva gana igual
+        roja = self.tareas._tomar()
+        azul = self.tareas._tomar()
+        self.tareas.ejecutar(azul)
+        self.tareas.ejecutar(roja)
+        self.pet.refresh_from_db()
+        with self.pet.image.open() as archivo, Image.open(archivo) as imagen:
+            self.assertEqual(imagen.getpixel((0, 0))[:3], (0, 0, 255))
+
+    def test_procesar_imagen_invalida(self):
+        import os
+        from .models import Tarea
+
+        encolada, ruta = self.encolar_foto('no-es-base64!')
+        self.tareas.ejecutar(self.tareas._tomar())
+        self.assertEqual(Tarea.objects.get(id=encolada.id).estado, 'fallida')
+        self.assertFalse(os.path.exists(ruta))
+
+
+class EtagCoincideTests(TestCase):
+    """If-None-Match del snapshot: listas, '*' y etiquetas débiles."""
+
+    def coincide(self, encabezado, etag='"7-1000-0-0"'):
+        from django.test import RequestFactory
+        from .views import etag_coincide
+
+        return etag_coincide(RequestFactory().get('/', HTTP_IF_NONE_MATCH=encabezado), etag)
+
+    def test_listas_y_comodines(self):
+        self.assertTrue(self.coincide('"7-1000-0-0"'))
+        self.assertTrue(self.coincide('"otro", W/"7-1000-0-0"'))
+        self.assertTrue(self.coincide('*'))
+        self.assertFalse(self.coincide(''))
+        # Antes bastaba con que el ETag apareciera como subcadena
+        self.assertFalse(self.coincide('"x"7-1000-0-0"'))
+        self.assertFalse(self.coincide('"17-1000-0-0"'))
+
+
+class ReproduccionAudioTests(TestCase):
+    """Las reproducciones encoladas solo las ve y cancela quien las pidió."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='dueno@example.com', password='x')
+        self.otro = User.objects.create_user(email='otro@example.com', password='x')
+        self.clip = AudioClip.objects.create(usuario=self.user, nombre='Hola', archivo='audios/hola.wav')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Sin ffplay real: la reproducción termina 'fallida' al instante
+        parche = mock.patch('core.audio_player.subprocess.Popen', side_effect=FileNotFoundError)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_solo_el_dueno(self):
+        response = self.client.post('/api/v1/raspi/reproducir_audio/', {'clip': self.clip.id}, format='json')
+        self.assertEqual(response.status_code, 202)
+        url = f"/api/v1/raspi/audio/{response.data['id']}/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        otro = APIClient()
+        otro.force_authenticate(self.otro)
+        self.assertEqual(otro.get(url).status_code, 404)
+        self.assertEqual(otro.delete(url).status_code, 404)
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+    def test_clip_no_entero(self):
+        for valor in ('abc', [1], {'id': 1}, True):
+            response = self.client.post('/api/v1/raspi/reproducir_audio/', {'clip': valor}, format='json')
+            self.assertEqual(response.status_code, 400, valor)
+
+
+class CamaraFalsa:
+    """CameraHub de prueba: entrega cuadros nuevos cada 50 ms."""
+    error = None
+
+    def __init__(self):
+        imagen = np.zeros((48, 64, 3), np.uint8)
+        self.jpeg = cv2.imencode('.jpg', imagen)[1].tobytes()
+        self.imagen = imagen
+        self.ultimo_id = 0
+
+    def suscribir(self):
+        return self
+
+    def siguiente(self, timeout=5):
+        time.sleep(0.05)
+        self.ultimo_id += 1
+        return Cuadro(self.ultimo_id, time.time(), self.jpeg, self.imagen)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class GrabacionesTests(MediaTemporalMixin, TestCase):
+    """Grabaciones manuales desde el CameraHub y limpieza de las interrumpidas."""
+
+    def setUp(self):
+        super().setUp()
+        # _ejecutar cierra la conexión al terminar; en la prueba cortaría la transacción
+        parche = mock.patch('api.recordings.connection')
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    @override_settings(GRABACION_FPS=10)
+    def test_grabacion_desde_el_hub(self):
+        grabacion = Grabacion.objects.create(usuario=self.user, duracion=1)
+        with mock.patch('api.hardware.obtener_camara', return_value=CamaraFalsa()):
+            recordings._ejecutar(grabacion.id)
+
+        grabacion.refresh_from_db()
+        self.assertEqual(grabacion.estado, 'completada', grabacion.error)
+        self.assertTrue(grabacion.archivo.name.endswith('.avi'))
+        video = cv2.VideoCapture(grabacion.archivo.path)
+        self.addCleanup(video.release)
+        self.assertTrue(video.isOpened())
+        cuadros = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.assertGreaterEqual(cuadros, 5)
+        # El fps se corrige con el medido, así que el video dura lo que la grabación
+        self.assertAlmostEqual(cuadros / video.get(cv2.CAP_PROP_FPS), 1, delta=0.3)
+        success, imagen = video.read()
+        self.assertTrue(success)
+        self.assertEqual(imagen.shape[:2], (48, 64))
+
+    def test_camara_sin_cuadros(self):
+        grabacion = Grabacion.objects.create(usuario=self.user, duracion=1)
+        camara = CamaraFalsa()
+        camara.siguiente = lambda timeout=5: None
+        camara.error = "No se pudo abrir la cámara."
+        with mock.patch('api.hardware.obtener_camara', return_value=camara):
+            recordings._ejecutar(grabacion.id)
+
+        grabacion.refresh_from_db()
+        self.assertEqual(grabacion.estado, 'fallida')
+        self.assertIn("No se pudo abrir la cámara.", grabacion.error)
+        self.assertFalse(grabacion.archivo)
+
+    def test_marcar_huerfanas(self):
+        viejo = timezone.now() - timedelta(hours=1)
+        huerfana = Grabacion.objects.create(usuario=self.user, duracion=5, estado='grabando')
+        viva = Grabacion.objects.create(usuario=self.user, duracion=5, estado='grabando')
+        terminada = Grabacion.objects.create(usuario=self.user, duracion=5, estado='completada')
+        Grabacion.objects.filter(id__in=[huerfana.id, terminada.id]).update(actualizado_en=viejo)
+
+        recordings.marcar_grabaciones_huerfanas()
+
+        estados = dict(Grabacion.objects.values_list('id', 'estado'))
+        self.assertEqual(estados[huerfana.id], 'fallida')
+        self.assertEqual(estados[viva.id], 'grabando')
+        self.assertEqual(estados[terminada.id], 'completada')
+
+
+class ConteoHorariosTests(TestCase):
+    """ConteoHorario y Dispenser.horarios siguen a los Horario en cada cambio."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='dueno@example.com', password='x')
+        self.firulais = Pet.objects.create(name='Firulais', race='Mestizo', weight=10, age=3, user=self.user)
+        self.michi = Pet.objects.create(name='Michi', race='Siamés', weight=4, age=2, user=self.user)
+        self.cocina = Dispenser.objects.create(ubication='Cocina', FC=2, WC=100, user=self.user)
+        self.patio = Dispenser.objects.create(ubication='Patio', FC=2, WC=100, user=self.user)
+
+    def conteos(self, dispenser):
+        return dict(ConteoHorario.objects.filter(dispensador=dispenser, conteo__gt=0).values_list('hora', 'conteo'))
+
+    def crear(self, mascota, horarios, dispenser=None):
+        return Horario.objects.create(
+            mascota=mascota, dispensador=dispenser or self.cocina, usuario=self.user, horarios=horarios
+        )
+
+    def test_crear(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crear(self.firulais, ['08:00', '18:00'])
+            self.crear(self.michi, ['08:00', '12:00'])
+        self.assertEqual(self.conteos(self.cocina), {'08:00': 2, '12:00': 1, '18:00': 1})
+        self.cocina.refresh_from_db()
+        self.assertEqual(self.cocina.horarios, ['08:00', '12:00', '18:00'])
+
+    def test_actualizar(self):
+        horario = self.crear(self.firulais, ['08:00', '18:00'])
+        self.crear(self.michi, ['08:00'])
+        horario.horarios = ['09:00', '18:00']
+        horario.save()
+        # Otra instancia de la misma fila, leída sin los horarios
+        parcial = Horario.objects.only('id').get(id=horario.id)
+        parcial.horarios = ['09:00']
+        parcial.save()
+        self.assertEqual(self.conteos(self.cocina), {'08:00': 1, '09:00': 1})
+
+    def test_cambiar_de_dispensador(self):
+        horario = self.crear(self.firulais, ['08:00', '18:00'])
+        self.crear(self.michi, ['08:00'])
+        horario.dispensador = self.patio
+        horario.save()
+        self.assertEqual(self.conteos(self.cocina), {'08:00': 1})
+        self.assertEqual(self.conteos(self.patio), {'08:00': 1, '18:00': 1})
+
+    def test_eliminar(self):
+        horario = self.crear(self.firulais, ['08:00', '18:00'])
+        self.crear(self.michi, ['08:00'])
+        with self.captureOnCommitCallbacks(execute=True):
+            horario.delete()
+        self.assertEqual(self.conteos(self.cocina), {'08:00': 1})
+        self.cocina.refresh_from_db()
+        self.assertEqual(self.cocina.horarios, ['08:00'])
+
+    def test_transaccion_revertida(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            horario = self.crear(self.firulais, ['08:00', '18:00'])
+
+        horario.horarios = ['09:00']
+        try:
+            with transaction.atomic():
+                horario.save()
+                raise OperationalError("falla simulada")
+        except OperationalError:
+            pass
+        self.assertEqual(self.conteos(self.cocina), {'08:00': 1, '18:00': 1})
+
+        # El reintento parte de lo que quedó en la BD, no del guardado revertido
+        horario.save()
+        self.assertEqual(self.conteos(self.cocina), {'09:00': 1})
+        horario.delete()
+        self.assertEqual(self.conteos(self.cocina), {})
+
+    def test_conteo_creado_por_otra_peticion(self):
+        get_or_create = ConteoHorario.objects.get_or_create
+
+        def con_carrera(**campos):
+            # Otra petición inserta la misma hora justo después del UPDATE vacío
+            ConteoHorario.objects.create(conteo=1, **campos)
+            return get_or_create(**campos)
+
+        with mock.patch.object(ConteoHorario.objects, 'get_or_create', side_effect=con_carrera):
+            self.crear(self.firulais, ['08:00'])
+        self.assertEqual(self.conteos(self.cocina), {'08:00': 2})
+
+
+class ProgramadorComidasTests(TestCase):
+    """Heap de disparos, generaciones, zona horaria y reconciliación con la BD."""
+
+    def setUp(self):
+        from .scheduler import ProgramadorComidas
+
+        self.disparos = []
+        self.programador = ProgramadorComidas(lambda *args: self.disparos.append(args))
+        self.zona = ZoneInfo(settings.PROGRAMADOR_ZONA_HORARIA)
+
+    def en(self, texto):
+        """Fija el reloj en `texto` ("AAAA-MM-DD HH:MM", hora local de los horarios)."""
+        from datetime import datetime
+
+        momento = datetime.fromisoformat(texto).replace(tzinfo=self.zona)
+        parche = mock.patch('django.utils.timezone.now', return_value=momento)
+        parche.start()
+        self.addCleanup(parche.stop)
+        return momento
+
+    def vigentes(self):
+        """(dispensador, hora local) de las entradas del heap que siguen valiendo, en orden."""
+        from datetime import datetime
+
+        return [
+            (dispensador_id, datetime.fromtimestamp(momento, self.zona).strftime('%d %H:%M'))
+            for momento, _, dispensador_id, hora, generacion in sorted(self.programador._heap)
+            if self.programador._generaciones.get(dispensador_id) == generacion
+        ]
+
+    def test_proximo_disparo(self):
+        from .scheduler import proximo_disparo
+
+        ahora = self.en('2026-03-10 07:00')
+        self.assertEqual(proximo_disparo('08:00', ahora).strftime('%d %H:%M'), '10 08:00')
+        self.assertEqual(proximo_disparo('07:00', ahora).strftime('%d %H:%M'), '11 07:00')
+        self.assertIsNone(proximo_disparo('8h', ahora))
+
+    def test_zona_horaria_de_la_casa(self):
+        from .scheduler import ahora_local, proximo_disparo
+
+        self.en('2026-03-10 07:00')
+        disparo = proximo_disparo('08:00', ahora_local())
+        # 08:00 en Ciudad de México (UTC-6) son las 14:00 UTC, no las 08:00 UTC
+        self.assertEqual(disparo.astimezone(ZoneInfo('UTC')).hour, 14)
+
+    def test_orden_del_heap(self):
+        self.en('2026-03-10 07:00')
+        self.programador.actualizar_dispensador(1, ['18:00', '08:00'], True)
+        self.programador.actualizar_dispensador(2, ['12:00', '06:00', 'basura'], True)
+        self.assertEqual(self.vigentes(), [(1, '10 08:00'), (2, '10 12:00'), (1, '10 18:00'), (2, '11 06:00')])
+
+    def test_reprogramar_invalida_las_entradas_viejas(self):
+        self.en('2026-03-10 07:00')
+        self.programador.actualizar_dispensador(1, ['08:00', '09:00'], True)
+        self.programador.actualizar_dispensador(1, ['08:30'], True)
+        self.assertEqual(self.vigentes(), [(1, '10 08:30')])
+
+        self.programador.actualizar_dispensador(1, ['08:30'], False)
+        self.assertEqual(self.vigentes(), [])
+        self.programador.actualizar_dispensador(2, ['10:00'], True)
+        self.programador.eliminar_dispensador(2)
+        self.assertEqual(self.vigentes(), [])
+
+    def test_disparo_vencido_se_repite_al_dia_siguiente(self):
+        self.en('2026-03-10 07:00')
+        self.programador.actualizar_dispensador(1, ['08:00', '09:00'], True)
+        self.programador.actualizar_dispensador(1, ['08:00'], True)
+        self.en('2026-03-10 08:00')
+
+        momento, dispensador_id, hora = self.programador._siguiente_vencido()
+        self.assertEqual((dispensador_id, hora), (1, '08:00'))
+        # La entrada vieja de las 09:00 se descarta y la de las 08:00 pasa a mañana
+        self.assertEqual(self.vigentes(), [(1, '11 08:00')])
+
+    def test_reconciliar_con_cambios_de_otro_proceso(self):
+        self.en('2026-03-10 07:00')
+        user = User.objects.create_user(email='dueno@example.com', password='x')
+        cocina = Dispenser.objects.create(ubication='Cocina', FC=2, WC=100, user=user, horarios=['08:00'])
+        patio = Dispenser.objects.create(ubication='Patio', FC=2, WC=100, user=user, horarios=['09:00'], status=False)
+        self.programador.reconciliar()
+        self.assertEqual(self.vigentes(), [(cocina.id, '10 08:00')])
+
+        # update() no manda señales, como un guardado atendido por otro worker
+        generacion = self.programador._generaciones[cocina.id]
+        Dispenser.objects.filter(id=patio.id).update(status=True)
+        self.programador.reconciliar()
+        self.assertEqual(self.vigentes(), [(cocina.id, '10 08:00'), (patio.id, '10 09:00')])
+        # Lo que no cambió no se reprograma
+        self.assertEqual(self.programador._generaciones[cocina.id], generacion)
+
+        Dispenser.objects.filter(id=cocina.id).delete()
+        Dispenser.objects.filter(id=patio.id).update(horarios=['10:00'])
+        self.programador.reconciliar()
+        self.assertEqual(self.vigentes(), [(patio.id, '10 10:00')])
+
+
+class ColaESP32Tests(TestCase):
+    """Cola acotada de comandos de la ESP32: llena -> ColaESP32Llena -> 503."""
+
+    def tearDown(self):
+        from . import hardware
+
+        hardware._cerrar_dispositivos()
+
+    def test_cola_llena(self):
+        import threading
+        from core.serial_manager import ESP32SerialManager, ColaESP32Llena
+        from core.transports import SimuladoTransport
+
+        esp32 = ESP32SerialManager(transporte=SimuladoTransport(latencia=0), max_cola=1)
+        self.addCleanup(esp32.cerrar)
+        ejecutando, soltar = threading.Event(), threading.Event()
+
+        def bloquear(ser):
+            ejecutando.set()
+            soltar.wait(5)
+            return {}, True
+
+        # Uno ocupa el hilo de E/S y otro llena la única plaza de la cola
+        hilos = [threading.Thread(target=esp32._ejecutar, args=(bloquear,)) for _ in range(2)]
+        hilos[0].start()
+        self.assertTrue(ejecutando.wait(5))
+        hilos[1].start()
+        limite = time.monotonic() + 5
+        while not esp32._cola.full() and time.monotonic() < limite:
+            time.sleep(0.01)
+
+        with self.assertRaises(ColaESP32Llena):
+            esp32._ejecutar(bloquear)
+        soltar.set()
+        for hilo in hilos:
+            hilo.join(5)
+        # Con la cola libre se vuelve a aceptar
+        self.assertEqual(esp32._ejecutar(bloquear), ({}, None))
+
+    @override_settings(ESP32_TRANSPORT='simulado', ESP32_POLL_INTERVAL=0)
+    def test_503_con_retry_after(self):
+        from core.serial_manager import ESP32SerialManager, ColaESP32Llena
+
+        llena = ColaESP32Llena("La ESP32 está ocupada, intenta de nuevo en unos segundos.")
+        with mock.patch.object(ESP32SerialManager, 'activar_motor', side_effect=llena):
+            response = APIClient().post('/api/v1/esp32/activate_motor/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIn('ocupada', response.data['error'])
+
+
+@override_settings(ESP32_TRANSPORT='simulado', ESP32_POLL_INTERVAL=0)
+class CacheSensoresTests(TestCase):
+    """Cache del poller y ?max_age= de read_sensor / read_sensors."""
+
+    def setUp(self):
+        from . import hardware
+
+        self.addCleanup(hardware._cerrar_dispositivos)
+        self.dispositivo = hardware.obtener_dispositivo()
+        self.client = APIClient()
+
+    def test_cache(self):
+        from core.sensor_poller import CacheSensores
+
+        cache = CacheSensores()
+        cache.actualizar({'PESO_A': '120', 'PESO_B': 'No se recibió respuesta', 'DISTANCIA_A': ''})
+        cache.actualizar({'DISTANCIA_B': '30'}, timestamp=time.time() - 60)
+        self.assertEqual(cache.obtener('PESO_A', 5)['valor'], '120')
+        self.assertIsNone(cache.obtener('PESO_B'))
+        self.assertIsNone(cache.obtener('DISTANCIA_A'))
+        # Más viejo que max_age: como si no hubiera dato
+        self.assertIsNone(cache.obtener('DISTANCIA_B', 10))
+        self.assertGreaterEqual(cache.obtener('DISTANCIA_B')['age'], 60)
+
+    def test_poller_llena_la_cache(self):
+        from core.sensor_poller import CacheSensores, SensorPoller
+
+        esp32 = mock.Mock()
+        esp32.leer_sensores.return_value = ({'PESO_A': '250'}, None)
+        muestras = []
+        poller = SensorPoller(esp32, CacheSensores(), intervalo=0.01, al_leer=muestras.append)
+        poller.iniciar()
+        self.addCleanup(poller.detener)
+        limite = time.monotonic() + 5
+        while not muestras and time.monotonic() < limite:
+            time.sleep(0.01)
+        self.assertEqual(poller.cache.obtener('PESO_A', 5)['valor'], '250')
+        self.assertEqual(muestras[0], {'PESO_A': '250'})
+
+    def test_read_sensor_desde_la_cache(self):
+        self.dispositivo.cache.actualizar({'PESO_A': '120'})
+        with mock.patch.object(self.dispositivo.esp32, 'leer_sensor') as leer_sensor:
+            response = self.client.get('/api/v1/esp32/read_sensor/?sensor=PESO_A&max_age=60')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['PESO_A'], response.data['cached']), ('120', True))
+        leer_sensor.assert_not_called()
+
+    def test_read_sensor_dato_viejo_consulta_la_esp32(self):
+        self.dispositivo.cache.actualizar({'PESO_A': '120'}, timestamp=time.time() - 60)
+        with mock.patch.object(self.dispositivo.esp32, 'leer_sensor', return_value=({'PESO_A': '130'}, None)):
+            response = self.client.get('/api/v1/esp32/read_sensor/?sensor=PESO_A&max_age=10')
+        self.assertEqual(response.data, {'PESO_A': '130'})
+        # La lectura directa también refresca la cache
+        self.assertEqual(self.dispositivo.cache.obtener('PESO_A', 10)['valor'], '130')
+
+    def test_read_sensors_solo_si_todos_son_recientes(self):
+        self.dispositivo.cache.actualizar({'PESO_A': '120', 'PESO_B': '80'})
+        with mock.patch.object(self.dispositivo.esp32, 'leer_sensores') as leer_sensores:
+            response = self.client.get('/api/v1/esp32/read_sensors/?sensors=PESO_A,PESO_B&max_age=60')
+        self.assertEqual((response.data['PESO_A'], response.data['PESO_B']), ('120', '80'))
+        leer_sensores.assert_not_called()
+
+        salida = {'PESO_A': '121', 'DISTANCIA_A': '15'}
+        with mock.patch.object(self.dispositivo.esp32, 'leer_sensores', return_value=(salida, None)) as leer_sensores:
+            response = self.client.get('/api/v1/esp32/read_sensors/?sensors=PESO_A,DISTANCIA_A&max_age=60')
+        leer_sensores.assert_called_once_with(['PESO_A', 'DISTANCIA_A'])
+        self.assertEqual(response.data['DISTANCIA_A'], '15')
+
+    def test_max_age_invalido(self):
+        for valor in ('abc', '-1'):
+            response = self.client.get(f'/api/v1/esp32/read_sensor/?sensor=PESO_A&max_age={valor}')
+            self.assertEqual(response.status_code, 400, valor)
+
+
+class PaginacionCursorTests(TestCase):
+    """Paginación por cursor combinada con ?fields= y los filtros de los listados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='dueno@example.com', password='x')
+        Pet.objects.bulk_create([
+            Pet(name=f'Mascota {i}', race='Mestizo' if i % 2 else 'Siamés', weight=5, age=2, user=cls.user)
+            for i in range(7)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recorrer(self, url):
+        """Sigue los enlaces `next` y devuelve todas las filas."""
+        filas = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            filas.extend(response.data['results'])
+            url = response.data['next']
+        return filas
+
+    def test_paginas_con_fields(self):
+        filas = self.recorrer('/api/v1/pets/?page_size=3&fields=id,name')
+        self.assertEqual(len(filas), 7)
+        self.assertEqual({tuple(fila) for fila in filas}, {('id', 'name')})
+        # Orden por -id sin repetidos ni saltos entre páginas
+        ids = [fila['id'] for fila in filas]
+        self.assertEqual(ids, sorted(Pet.objects.values_list('id', flat=True), reverse=True))
+
+    def test_cursor_conserva_fields_y_filtros(self):
+        response = self.client.get('/api/v1/pets/?page_size=2&fields=id,race&race=mestizo')
+        self.assertIn('fields=id%2Crace', response.data['next'])
+        filas = self.recorrer(response.data['next'])
+        self.assertEqual(len(response.data['results']) + len(filas), 3)
+        self.assertEqual({fila['race'] for fila in filas}, {'Mestizo'})
+        self.assertNotIn('name', filas[0])
+
+    def test_sin_conteo_ni_offset(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/pets/?page_size=3&fields=id')
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get('/api/v1/pets/?cursor=basura').status_code, 404)
@@ -0,0 +1,242 @@
+"""
+Almacenamiento de series de tiempo de los sensores por dispensador.
+
+Las lecturas se acumulan en memoria y se escriben por lotes: los valores crudos
+se agregan al final de bloques binarios de una hora (BloqueLecturas) y, en la
+misma transacción, se actualizan los resúmenes de 1 minuto, 1 hora y 1 día
+(ResumenLecturas). Las consultas de rangos largos leen solo los resúmenes.
+Las consultas no fuerzan la escritura: combinan lo guardado con lo que sigue
+en el buffer.
+"""
+import atexit
+import re
+import sys
+import threading
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+from .models import BloqueLecturas, Dispenser, ResumenLecturas
+
+DURACION_BLOQUE = 3600
+SEGUNDOS_RESOLUCION = {'1m': 60, '1h': 3600, '1d': 86400}
+
+
+def parsear_valor(valor):
+    """Convierte '123 g' o '5.2 cm' en float; devuelve None si no es numérico."""
+    match = re.match(r'^\s*(-?\d+(?:\.\d+)?)', str(valor))
+    return float(match.group(1)) if match else None
+
+
+def _a_datetime(ts):
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+
+def _inicio_intervalo(ts, segundos):
+    return ts - ts % segundos
+
+
+def elegir_resolucion(desde, hasta):
+    """Resolución más fina que mantiene la respuesta en unos cientos de puntos."""
+    duracion = hasta - desde
+    if duracion <= timedelta(hours=3):
+        return 'raw'
+    if duracion <= timedelta(days=1):
+        return '1m'
+    if duracion <= timedelta(days=31):
+        return '1h'
+    return '1d'
+
+
+def _acumular(resumenes, clave, valor):
+    actual = resumenes.get(clave)
+    if actual is None:
+        resumenes[clave] = [valor, valor, valor, 1]
+    else:
+        actual[0] = min(actual[0], valor)
+        actual[1] = max(actual[1], valor)
+        actual[2] += valor
+        actual[3] += 1
+
+
+class AlmacenLecturas:
+    """
+    Buffer de lecturas pendientes con escritura por lotes.
+
+    Se vacía cuando acumula `max_buffer` lecturas o cada `intervalo_flush`
+    segundos desde un hilo de fondo. Si la escritura falla, el lote vuelve al
+    buffer para el siguiente intento (hasta `max_pendientes` lecturas; de ahí
+    en adelante se descartan las más viejas).
+    """
+
+    def __init__(self, max_buffer=500, intervalo_flush=30, max_pendientes=50000):
+        self.max_buffer = max_buffer
+        self.max_pendientes = max_pendientes
+        self.intervalo_flush = intervalo_flush
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="lecturas-flush", daemon=True)
+            self._hilo.start()
+        atexit.register(self.flush)
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo_flush):
+            try:
+                self.flush()
+            finally:
+                connection.close()
+
+    def registrar(self, dispensador_id, lecturas, timestamp=None):
+        """Agrega un diccionario {sensor: '123 g'} al buffer del dispensador."""
+        timestamp = timestamp or datetime.now(dt_timezone.utc).timestamp()
+        nuevas = []
+        for sensor, valor in lecturas.items():
+            numero = parsear_valor(valor)
+            if numero is not None:
+                nuevas.append((dispensador_id, sensor, timestamp, numero))
+        if not nuevas:
+            return
+
+        self.iniciar()
+        with self._lock:
+            self._buffer.extend(nuevas)
+            lleno = len(self._buffer) >= self.max_buffer
+        if lleno:
+            self.flush()
+
+    def flush(self):
+        """Escribe todas las lecturas pendientes en una sola transacción."""
+        with self._flush_lock:
+            with self._lock:
+                pendientes, self._buffer = self._buffer, []
+            if not pendientes:
+                return
+            try:
+                self._guardar(pendientes)
+            except Exception as e:
+                print(f"❌ Error guardando {len(pendientes)} lecturas: {e}", file=sys.stderr)
+                with self._lock:
+                    self._buffer = pendientes + self._buffer
+                    sobrantes = len(self._buffer) - self.max_pendientes
+                    if sobrantes > 0:
+                        del self._buffer[:sobrantes]
+                        print(f"⚠️ Se descartaron {sobrantes} lecturas sin guardar", file=sys.stderr)
+
+    def _guardar(self, pendientes):
+        existentes = set(Dispenser.objects.filter(
+            id__in={p[0] for p in pendientes}
+        ).values_list('id', flat=True))
+
+        bloques = defaultdict(lambda: (array('d'), array('f')))
+        resumenes = {}
+        for dispensador_id, sensor, ts, valor in sorted(pendientes, key=lambda p: p[2]):
+            if dispensador_id not in existentes:
+                continue
+            tiempos, valores = bloques[(dispensador_id, sensor, _inicio_intervalo(ts, DURACION_BLOQUE))]
+            tiempos.append(ts)
+            valores.append(valor)
+
+            for resolucion, segundos in SEGUNDOS_RESOLUCION.items():
+                _acumular(resumenes, (dispensador_id, sensor, resolucion, _inicio_intervalo(ts, segundos)), valor)
+
+        with transaction.atomic():
+            for (dispensador_id, sensor, inicio), (tiempos, valores) in bloques.items():
+                bloque, _ = BloqueLecturas.objects.select_for_update().get_or_create(
+                    dispensador_id=dispensador_id, sensor=sensor, inicio=_a_datetime(inicio)
+                )
+                bloque.tiempos = bytes(bloque.tiempos) + tiempos.tobytes()
+                bloque.valores = bytes(bloque.valores) + valores.tobytes()
+                bloque.cantidad += len(valores)
+                bloque.save(update_fields=['tiempos', 'valores', 'cantidad'])
+
+            for (dispensador_id, sensor, resolucion, inicio), (minimo, maximo, suma, cantidad) in resumenes.items():
+                resumen, creado = ResumenLecturas.objects.select_for_update().get_or_create(
+                    dispensador_id=dispensador_id, sensor=sensor, resolucion=resolucion,
+                    inicio=_a_datetime(inicio),
+                    defaults={'minimo': minimo, 'maximo': maximo, 'suma': suma, 'cantidad': cantidad},
+                )
+                if not creado:
+                    resumen.minimo = min(resumen.minimo, minimo)
+                    resumen.maximo = max(resumen.maximo, maximo)
+                    resumen.suma += suma
+                    resumen.cantidad += cantidad
+                    resumen.save(update_fields=['minimo', 'maximo', 'suma', 'cantidad'])
+
+    # --- Consultas ---
+
+    def _en_memoria(self, dispensador_id, sensores, desde_ts, hasta_ts):
+        """Lecturas del buffer (aún sin guardar) que caen en la consulta."""
+        with self._lock:
+            return [
+                (sensor, ts, valor) for disp, sensor, ts, valor in self._buffer
+                if disp == dispensador_id and sensor in sensores and desde_ts <= ts < hasta_ts
+            ]
+
+    def consultar(self, dispensador_id, sensores, desde, hasta, resolucion=None):
+        """
+        Devuelve {sensor: [puntos]} entre `desde` y `hasta`.
+        Con resolución 'raw' cada punto es {"t", "valor"}; con '1m'/'1h'/'1d'
+        es {"t", "min", "max", "avg", "count"}.
+        """
+        resolucion = resolucion or elegir_resolucion(desde, hasta)
+        if resolucion == 'raw':
+            return resolucion, self._consultar_crudo(dispensador_id, sensores, desde, hasta)
+
+        segundos = SEGUNDOS_RESOLUCION[resolucion]
+        resumenes = {}
+        for sensor, inicio, minimo, maximo, suma, cantidad in ResumenLecturas.objects.filter(
+            dispensador_id=dispensador_id, sensor__in=sensores, resolucion=resolucion,
+            inicio__gte=desde, inicio__lt=hasta,
+        ).values_list('sensor', 'inicio', 'minimo', 'maximo', 'suma', 'cantidad'):
+            resumenes[(sensor, inicio.timestamp())] = [minimo, maximo, suma, cantidad]
+
+        # Lo que sigue en memoria se suma a los resúmenes leídos
+        for sensor, ts, valor in self._en_memoria(dispensador_id, sensores, desde.timestamp(), hasta.timestamp()):
+            inicio = _inicio_intervalo(ts, segundos)
+            if inicio >= desde.timestamp():
+                _acumular(resumenes, (sensor, inicio), valor)
+
+        series = {sensor: [] for sensor in sensores}
+        for (sensor, inicio), (minimo, maximo, suma, cantidad) in sorted(resumenes.items(), key=lambda r: r[0][1]):
+            series[sensor].append({
+                "t": _a_datetime(inicio).isoformat(),
+                "min": minimo,
+                "max": maximo,
+                "avg": suma / cantidad,
+                "count": cantidad,
+            })
+        return resolucion, series
+
+    def _consultar_crudo(self, dispensador_id, sensores, desde, hasta):
+        puntos = {sensor: [] for sensor in sensores}
+        desde_ts, hasta_ts = desde.timestamp(), hasta.timestamp()
+        bloques = BloqueLecturas.objects.filter(
+            dispensador_id=dispensador_id, sensor__in=sensores,
+            inicio__gte=_a_datetime(_inicio_intervalo(desde_ts, DURACION_BLOQUE)), inicio__lt=hasta,
+        ).order_by('inicio').values_list('sensor', 'tiempos', 'valores')
+        for sensor, tiempos_bytes, valores_bytes in bloques:
+            tiempos, valores = array('d'), array('f')
+            tiempos.frombytes(bytes(tiempos_bytes))
+            valores.frombytes(bytes(valores_bytes))
+            puntos[sensor].extend(
+                (ts, valor) for ts, valor in zip(tiempos, valores) if desde_ts <= ts < hasta_ts
+            )
+        for sensor, ts, valor in self._en_memoria(dispensador_id, sensores, desde_ts, hasta_ts):
+            puntos[sensor].append((ts, valor))
+        return {
+            sensor: [{"t": _a_datetime(ts).isoformat(), "valor": round(valor, 3)} for ts, valor in sorted(lista)]
+            for sensor, lista in puntos.items()
+        }
+
+
+almacen_lecturas = AlmacenLecturas()
@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, PetViewSet, DispenserViewSet, HorarioViewSet,
-    ESP32ControlViewSet, RaspiControlViewSet, 
+    ESP32ControlViewSet, RaspiControlViewSet, GrabacionViewSet, AudioClipViewSet,
     RegisterView, LoginView
 )
 
@@ -13,6 +13,8 @@ router.register(r'dispensers', DispenserViewSet, basename='dispenser')
 router.register(r'horarios', HorarioViewSet, basename='horario')
 router.register(r'esp32', ESP32ControlViewSet, basename='esp32')
 router.register(r'raspi', RaspiControlViewSet, basename='raspi')
+router.register(r'grabaciones', GrabacionViewSet, basename='grabacion')
+router.register(r'audios', AudioClipViewSet, basename='audio')
 
 urlpatterns = [
     path('auth/register/', RegisterView.as_view(), name='register'),
@@ -1,16 +1,39 @@
 import os
-import sys
-import json
+import mimetypes
 import re
-import subprocess
+import time
+import asyncio
 from django.shortcuts import render
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, mixins, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from drf_spectacular.utils import extend_schema
-from .models import User, Pet, Dispenser, Horario
-from .serializers import UserSerializer, PetSerializer, DispenserSerializer, HorarioSerializer
-from django.http import StreamingHttpResponse
+from .models import User, Pet, Dispenser, Horario, Grabacion, AudioClip
+from .serializers import (
+    UserSerializer, PetSerializer, DispenserSerializer, HorarioSerializer, GrabacionSerializer, AudioClipSerializer
+)
+from .hardware import obtener_dispositivo, obtener_camara, obtener_reproductor
+from .timeseries import almacen_lecturas, SEGUNDOS_RESOLUCION
+from .recordings import iniciar_grabacion, grabar_evento
+from .audio import guardar_temporal, crear_audio_clip, reproducir_clip
+from .images import recibir_imagen, guardar_imagen, borrar_imagen
+from .media import es_inmutable
+from core.serial_manager import ColaESP32Llena
+from core.audio_player import ColaAudioLlena
+from core.esp32_controller import sensores
+from core.camera_hub import PerfilStream
+from django.http import StreamingHttpResponse, HttpResponse, HttpResponseNotModified, FileResponse, Http404
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_safe
+from django.conf import settings
+from django.utils.http import http_date, parse_etags
+from django.core.handlers.asgi import ASGIRequest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 
 # --- LIBRERÍAS DE AUTENTICACIÓN ---
 from django.contrib.auth.hashers import make_password, check_password
@@ -21,47 +44,68 @@ from rest_framework_simplejwt.tokens import RefreshToken
 import cv2
 import threading
 
-# IMPORTANT: Adjust this path to point to your modified script files.
-SCRIPT_PATH_ESP32 = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'core', 'esp32_controller.py')
-SCRIPT_PATH_RASPI = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'core', 'raspi_controller.py')
+def etag_coincide(request, etag):
+    """If-None-Match: lista de etiquetas separadas por comas, '*' o débiles (W/)."""
+    pedidas = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in pedidas:
+        return True
+    return etag.removeprefix('W/') in {pedida.removeprefix('W/') for pedida in pedidas}
 
-# --- Función Auxiliar para Ejecutar Scripts ---
-def run_script(script_path, action_name, *args):
+
+# --- Función Auxiliar para responder con el resultado de la ESP32 ---
+def responder_esp32(operacion, *args):
     """
-    Ejecuta un script de Python con los argumentos especificados y
-    captura la salida estándar y de error. Se espera una salida en formato JSON.
+    Ejecuta una acción del gestor serial y la convierte en Response.
+    Si la cola del UART está llena responde 503 para que el cliente reintente.
     """
     try:
-        command = [sys.executable, script_path, action_name] + list(args)
-        timeout = 10
-        if action_name == 'grabar_video':
-            try:
-                video_duration = int(args[0])
-                timeout = video_duration + 15
-            except (ValueError, IndexError):
-                pass
-        
-        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
-        
-        if result.stderr:
-            try:
-                error_output = json.loads(result.stderr.strip())
-                return None, error_output
-            except json.JSONDecodeError:
-                return None, {"error": "El script falló al ejecutarse.", "detalles": result.stderr.strip()}
+        output, error = operacion(*args)
+    except ColaESP32Llena as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
 
-        try:
-            output = json.loads(result.stdout.strip())
-            return output, None
-        except json.JSONDecodeError:
-            return {"message": result.stdout.strip()}, None
+    if error:
+        return Response(error, status=500)
+    return Response(output)
+
+
+# --- Filtros de los listados (?campo=valor) ---
+def filtro_booleano(request, nombre):
+    """Lee ?nombre=true|false. Devuelve None si no viene; 400 si no es booleano."""
+    valor = request.query_params.get(nombre)
+    if valor is None:
+        return None
+    if valor.lower() in ('true', '1'):
+        return True
+    if valor.lower() in ('false', '0'):
+        return False
+    raise ValidationError({nombre: "Debe ser true o false."})
+
+
+def filtro_id(request, nombre):
+    """Lee ?nombre=<id>. Devuelve None si no viene; 400 si no es un entero."""
+    valor = request.query_params.get(nombre)
+    if valor is None:
+        return None
+    if not valor.isdigit():
+        raise ValidationError({nombre: "Debe ser un id numérico."})
+    return int(valor)
 
-    except FileNotFoundError:
-        return None, {"error": f"No se encontró el archivo del script en la ruta: {script_path}"}
-    except subprocess.TimeoutExpired:
-        return None, {"error": "El script excedió el tiempo de espera."}
-    except Exception as e:
-        return None, {"error": f"Ocurrió un error inesperado: {str(e)}"}
+
+class ImagenMixin:
+    """
+    Acción /<id>/image/ para subir la foto sin base64: PUT con el cuerpo crudo
+    (Content-Type image/*) o POST multipart con el archivo en `image`.
+    DELETE la quita. Responde con el objeto actualizado.
+    """
+
+    @action(detail=True, methods=['put', 'post', 'delete'])
+    def image(self, request, pk=None):
+        instancia = self.get_object()
+        if request.method == 'DELETE':
+            borrar_imagen(instancia)
+        else:
+            guardar_imagen(instancia, recibir_imagen(request))
+        return Response(self.get_serializer(instancia).data)
 
 
 # --- VISTAS DE AUTENTICACIÓN ---
@@ -123,127 +167,433 @@ class LoginView(APIView):
 @extend_schema(tags=['ESP32 Control'])
 class ESP32ControlViewSet(viewsets.ViewSet):
     """
-    Un ViewSet para controlar el ESP32 usando un script externo.
+    Un ViewSet para controlar el ESP32 a través del gestor serial persistente.
+    Con `dispenser` (query string o cuerpo) se usa la ESP32 de ese dispensador;
+    sin él, la ESP32 por defecto.
     """
+    def _dispositivo(self, request):
+        """Devuelve (Dispositivo, dispensador o None, Response de error o None)."""
+        if not isinstance(request.data, dict):
+            # p. ej. un JSON que es una lista
+            return None, None, Response({"error": "El cuerpo debe ser un objeto JSON."}, status=400)
+        dispenser_id = request.query_params.get('dispenser') or request.data.get('dispenser')
+        if not dispenser_id:
+            return obtener_dispositivo(), None, None
+        if not request.user.is_authenticated:
+            return None, None, Response({"error": "Autenticación requerida para usar 'dispenser'."}, status=401)
+        dispenser = Dispenser.objects.filter(id=dispenser_id, user=request.user).only(
+            'id', 'transporte', 'puerto', 'baudrate'
+        ).first() if str(dispenser_id).isdigit() else None
+        if dispenser is None:
+            return None, None, Response({"error": "Dispensador no encontrado."}, status=404)
+        return obtener_dispositivo(dispenser), dispenser, None
+
+    def _parse_max_age(self, request):
+        """Lee el parámetro ?max_age= (segundos). Devuelve (valor, error)."""
+        max_age = request.query_params.get('max_age')
+        if max_age is None:
+            return None, None
+        try:
+            max_age = float(max_age)
+        except ValueError:
+            return None, Response({"error": "El parámetro 'max_age' debe ser un número de segundos."}, status=400)
+        if max_age < 0:
+            return None, Response({"error": "El parámetro 'max_age' no puede ser negativo."}, status=400)
+        return max_age, None
+
+    def _guardar_lecturas(self, dispositivo, dispenser, lecturas):
+        """Actualiza la cache del dispositivo y, si se indicó dispensador, su serie de tiempo."""
+        dispositivo.cache.actualizar(lecturas)
+        if dispenser is not None:
+            almacen_lecturas.registrar(dispenser.id, lecturas)
+
     @action(detail=False, methods=['get'])
     def read_sensor(self, request):
+        """
+        Lee un sensor. Con ?max_age=N responde desde la cache del poller si el
+        último valor tiene menos de N segundos; si no, consulta la ESP32.
+        """
         sensor_label = request.query_params.get('sensor', None)
         if not sensor_label:
             return Response({"error": "No se proporcionó la etiqueta del sensor."}, status=400)
-        
-        output, error = run_script(SCRIPT_PATH_ESP32, 'leer_datos_serial', sensor_label)
-        if error:
-            return Response(error, status=500)
-        
-        return Response(output)
+
+        max_age, error_response = self._parse_max_age(request)
+        if error_response:
+            return error_response
+
+        dispositivo, dispenser, error_response = self._dispositivo(request)
+        if error_response:
+            return error_response
+
+        if max_age is not None:
+            dato = dispositivo.cache.obtener(sensor_label, max_age)
+            if dato:
+                return Response({
+                    sensor_label: dato['valor'],
+                    "timestamp": dato['timestamp'],
+                    "age": dato['age'],
+                    "cached": True,
+                })
+
+        response = responder_esp32(dispositivo.esp32.leer_sensor, sensor_label)
+        if response.status_code == 200:
+            self._guardar_lecturas(dispositivo, dispenser, response.data)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def read_sensors(self, request):
+        """
+        Lee varios sensores en una sola sesión serial.
+        ?sensors=PESO_A,DISTANCIA_A para un subconjunto; sin parámetro se leen todos.
+        ?max_age=N responde desde la cache si todos los valores son recientes.
+        """
+        sensors_param = request.query_params.get('sensors', '')
+        sensor_labels = [s.strip() for s in sensors_param.split(',') if s.strip()] or None
+
+        max_age, error_response = self._parse_max_age(request)
+        if error_response:
+            return error_response
+
+        dispositivo, dispenser, error_response = self._dispositivo(request)
+        if error_response:
+            return error_response
+
+        if max_age is not None:
+            datos = {label: dispositivo.cache.obtener(label, max_age) for label in (sensor_labels or sensores.values())}
+            if all(datos.values()):
+                output = {label: dato['valor'] for label, dato in datos.items()}
+                output['age'] = max(dato['age'] for dato in datos.values())
+                output['cached'] = True
+                return Response(output)
+
+        response = responder_esp32(dispositivo.esp32.leer_sensores, sensor_labels)
+        if response.status_code == 200:
+            self._guardar_lecturas(dispositivo, dispenser, response.data)
+        return response
 
     @action(detail=False, methods=['post'])
     def activate_motor(self, request):
-        output, error = run_script(SCRIPT_PATH_ESP32, 'activar_motor')
-        if error:
-            return Response(error, status=500)
-        return Response(output)
+        """
+        Activa el motor. Si el historial de la cámara está encendido, se guarda
+        además un clip de la comida (ligado a `dispenser` si se indicó).
+        """
+        dispositivo, dispenser, error_response = self._dispositivo(request)
+        if error_response:
+            return error_response
+
+        response = responder_esp32(dispositivo.esp32.activar_motor)
+        if response.status_code == 200 and request.user.is_authenticated:
+            grabacion = grabar_evento(request.user.id, dispenser.id if dispenser else None)
+            if grabacion is not None:
+                response.data = {**response.data, 'grabacion': grabacion.id}
+        return response
 
     @action(detail=False, methods=['post'])
     def activate_pump(self, request):
-        output, error = run_script(SCRIPT_PATH_ESP32, 'activar_bomba')
-        if error:
-            return Response(error, status=500)
-        return Response(output)
+        dispositivo, _, error_response = self._dispositivo(request)
+        if error_response:
+            return error_response
+        return responder_esp32(dispositivo.esp32.activar_bomba)
 
     @action(detail=False, methods=['post'])
     def calibrate_tare(self, request):
+        dispositivo, _, error_response = self._dispositivo(request)
+        if error_response:
+            return error_response
+
         scale = request.data.get('scale')
-        if not scale or scale.upper() not in ['A', 'B']:
+        if not isinstance(scale, str) or scale.upper() not in ['A', 'B']:
             return Response({"error": "El campo 'scale' es obligatorio y debe ser 'A' o 'B'."}, status=400)
-        
-        output, error = run_script(SCRIPT_PATH_ESP32, 'calibrar_balanza_tara', scale.upper())
-        if error:
-            return Response(error, status=500)
-        return Response(output)
+        return responder_esp32(dispositivo.esp32.calibrar_balanza_tara, scale.upper())
 
     @action(detail=False, methods=['post'])
     def calibrate_set_weight(self, request):
+        dispositivo, _, error_response = self._dispositivo(request)
+        if error_response:
+            return error_response
+
         scale = request.data.get('scale')
         known_weight = request.data.get('known_weight')
-
-        if not scale or scale.upper() not in ['A', 'B'] or known_weight is None:
+        if not isinstance(scale, str) or scale.upper() not in ['A', 'B'] or known_weight is None:
             return Response({"error": "Los campos 'scale' y 'known_weight' son obligatorios."}, status=400)
-        
-        output, error = run_script(SCRIPT_PATH_ESP32, 'calibrar_balanza_peso', scale.upper(), str(known_weight))
-        if error:
-            return Response(error, status=500)
-        
-        return Response(output)
+        return responder_esp32(dispositivo.esp32.calibrar_balanza_peso, scale.upper(), str(known_weight))
 
 @extend_schema(tags=['Raspberry Pi Control'])
 class RaspiControlViewSet(viewsets.ViewSet):
     """
     Un ViewSet para controlar las funciones de la Raspberry Pi.
     """
+    def _parse_perfil_stream(self, request):
+        """
+        Lee ?fps=, ?width=, ?quality= y ?adaptive= del stream.
+        Devuelve (PerfilStream, None) o (None, Response de error).
+        """
+        limites = {'fps': (1, 30), 'width': (160, 1920), 'quality': (10, 95)}
+        valores = {}
+        for nombre, (minimo, maximo) in limites.items():
+            valor = request.query_params.get(nombre)
+            if valor is None:
+                continue
+            try:
+                valor = int(valor)
+            except ValueError:
+                valor = None
+            if valor is None or not minimo <= valor <= maximo:
+                return None, Response(
+                    {"error": f"El parámetro '{nombre}' debe ser un entero entre {minimo} y {maximo}."},
+                    status=400
+                )
+            valores[nombre] = valor
+
+        adaptativo = request.query_params.get('adaptive', '').lower() in ('1', 'true', 'yes')
+        return PerfilStream(
+            fps=valores.get('fps', 15),
+            ancho=valores.get('width'),
+            calidad=valores.get('quality'),
+            adaptativo=adaptativo,
+        ), None
+
     @action(detail=False, methods=['get'])
     def stream_video(self, request):
+        """
+        Stream MJPEG de la cámara. Todos los clientes comparten una sola captura
+        y un solo JPEG por cuadro (ver core/camera_hub.py).
+        Parámetros opcionales: ?fps=, ?width=, ?quality= y ?adaptive=1 para que
+        la calidad se ajuste al ancho de banda del cliente. Si el cliente es lento
+        se saltan cuadros en lugar de acumularlos.
+        """
+        perfil, error_response = self._parse_perfil_stream(request)
+        if error_response:
+            return error_response
+        hub = obtener_camara()
+
         def generate_frames():
-            camera = cv2.VideoCapture(0)  
-            if not camera.isOpened():
-                print("Error: No se pudo abrir la cámara.", file=sys.stderr)
-                return
-            
-            camera.set(cv2.CAP_PROP_FRAME_WIDTH, 720)
-            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-            
-            while True:
-                success, frame = camera.read()
-                if not success:
-                    break
-                
-                ret, buffer = cv2.imencode('.jpg', frame)
-                if not ret:
-                    continue
-                
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-            
-            camera.release()
-        
-        return StreamingHttpResponse(generate_frames(), content_type='multipart/x-mixed-replace; boundary=frame')
+            with hub.suscribir() as suscripcion:
+                while True:
+                    inicio = time.monotonic()
+                    cuadro = suscripcion.siguiente()
+                    if cuadro is None:
+                        break
+                    jpeg = hub.codificar(cuadro, perfil.ancho, perfil.calidad)
+
+                    envio = time.monotonic()
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                    perfil.ajustar(time.monotonic() - envio, cuadro.imagen.shape[1])
+
+                    # Respetar los fps pedidos; los cuadros intermedios se descartan
+                    espera = perfil.intervalo - (time.monotonic() - inicio)
+                    if espera > 0:
+                        time.sleep(espera)
+
+        async def generate_frames_async():
+            # Versión para ASGI: no ocupa un hilo por cliente mientras dura el stream
+            suscripcion = hub.suscribir()
+            try:
+                while True:
+                    inicio = time.monotonic()
+                    cuadro = await suscripcion.siguiente_async()
+                    if cuadro is None:
+                        break
+                    if perfil.ancho is None and perfil.calidad is None:
+                        jpeg = cuadro.jpeg
+                    else:
+                        jpeg = await asyncio.to_thread(hub.codificar, cuadro, perfil.ancho, perfil.calidad)
+
+                    envio = time.monotonic()
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                    perfil.ajustar(time.monotonic() - envio, cuadro.imagen.shape[1])
+
+                    espera = perfil.intervalo - (time.monotonic() - inicio)
+                    if espera > 0:
+                        await asyncio.sleep(espera)
+            finally:
+                suscripcion.cerrar()
+
+        # Bajo WSGI un iterador asíncrono se consumiría completo antes de enviarse,
+        # así que solo se usa cuando la petición llega por ASGI (backend/asgi.py).
+        if isinstance(request._request, ASGIRequest):
+            frames = generate_frames_async()
+        else:
+            frames = generate_frames()
+        return StreamingHttpResponse(frames, content_type='multipart/x-mixed-replace; boundary=frame')
     
+    @action(detail=False, methods=['get'])
+    def snapshot(self, request):
+        """
+        Imagen fija (JPEG) de la cámara.
+        Si hay un stream activo se devuelve su último cuadro; si no, se reutiliza la
+        última captura mientras tenga menos de ?max_age= segundos o se toma una nueva.
+        Acepta ?width= y ?quality= igual que stream_video. Responde con ETag, así
+        que un cliente que consulta periódicamente recibe 304 si no hay cuadro nuevo.
+        """
+        perfil, error_response = self._parse_perfil_stream(request)
+        if error_response:
+            return error_response
+        try:
+            max_age = float(request.query_params.get('max_age', settings.CAMARA_SNAPSHOT_MAX_AGE))
+        except ValueError:
+            return Response({"error": "El parámetro 'max_age' debe ser un número de segundos."}, status=400)
+
+        hub = obtener_camara()
+        cuadro = hub.ultimo_cuadro() if hub.activa else None
+        if cuadro is None:
+            cuadro = hub.ultima_captura()
+            if cuadro is None or time.time() - cuadro.timestamp > max_age:
+                cuadro = hub.capturar()
+        if cuadro is None:
+            return Response({"error": hub.error or "No se pudo capturar una imagen."}, status=503)
+
+        etag = f'"{cuadro.id}-{int(cuadro.timestamp * 1000)}-{perfil.ancho or 0}-{perfil.calidad or 0}"'
+        if etag_coincide(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(hub.codificar(cuadro, perfil.ancho, perfil.calidad), content_type='image/jpeg')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(cuadro.timestamp)
+        # Siempre revalidar: el ETag cambia con cada cuadro nuevo
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _respuesta_reproduccion(self, reproduccion, posicion, **extra):
+        datos = {
+            "id": reproduccion.id,
+            "estado": reproduccion.estado,
+            # 0 = sonando ahora; None = ya terminó
+            "posicion": posicion,
+            "error": reproduccion.error,
+        }
+        return Response(datos, **extra)
+
     @action(detail=False, methods=['post'])
     def reproducir_audio(self, request):
-        if 'audio_file' not in request.FILES:
+        """
+        Encola un audio y responde 202 de inmediato con su id y posición en la
+        cola. El estado se consulta (o se cancela) en /raspi/audio/<id>/.
+        Acepta un archivo (`audio_file`) o el id de un audio guardado (`clip`).
+        Requiere autenticación: la reproducción queda a nombre del usuario.
+        """
+        if not request.user.is_authenticated:
+            return Response({"error": "Autenticación requerida para reproducir audios."}, status=401)
+        clip_id = request.data.get('clip') if isinstance(request.data, dict) else None
+        if clip_id:
+            try:
+                if isinstance(clip_id, bool):
+                    raise ValueError
+                clip_id = int(clip_id)
+            except (TypeError, ValueError):
+                return Response({"error": "El parámetro 'clip' debe ser el id entero de un audio."}, status=400)
+            clip = AudioClip.objects.filter(id=clip_id, usuario=request.user).first()
+            if clip is None:
+                return Response({"error": "Audio no encontrado."}, status=404)
+            encolar = lambda: reproducir_clip(clip)
+        elif 'audio_file' in request.FILES:
+            try:
+                temp_file_path = guardar_temporal(request.FILES['audio_file'])
+            except Exception as e:
+                return Response({"error": f"Error al guardar el archivo temporal: {str(e)}"}, status=500)
+            encolar = lambda: obtener_reproductor().encolar(temp_file_path, usuario_id=request.user.id)
+        else:
             return Response({"error": "No se proporcionó un archivo de audio."}, status=400)
         
-        audio_file = request.FILES['audio_file']
-        
-        temp_dir = '/tmp/audio_uploads'
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-            
-        temp_file_path = os.path.join(temp_dir, audio_file.name)
-        
-        try:
-            with open(temp_file_path, 'wb+') as destination:
-                for chunk in audio_file.chunks():
-                    destination.write(chunk)
-        except Exception as e:
-            return Response({"error": f"Error al guardar el archivo temporal: {str(e)}"}, status=500)
-        
-        output, error = run_script(SCRIPT_PATH_RASPI, 'reproducir_audio', temp_file_path)
-        
         try:
-            os.remove(temp_file_path)
-        except OSError as e:
-            print(f"Error: {e.strerror} - {e.filename}")
+            reproduccion = encolar()
+        except ColaAudioLlena as e:
+            if not clip_id:
+                os.remove(temp_file_path)
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '5'})
         
+        _, posicion = obtener_reproductor().obtener(reproduccion.id)
+        return self._respuesta_reproduccion(reproduccion, posicion, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get', 'delete'], url_path=r'audio/(?P<reproduccion_id>[0-9a-f]+)')
+    def audio(self, request, reproduccion_id=None):
+        """GET: estado y posición de un audio encolado. DELETE: cancelarlo. Solo los propios."""
+        if not request.user.is_authenticated:
+            return Response({"error": "Autenticación requerida."}, status=401)
+        reproductor = obtener_reproductor()
+        reproduccion, posicion = reproductor.obtener(reproduccion_id)
+        if reproduccion is None or reproduccion.usuario_id != request.user.id:
+            return Response({"error": "Reproducción no encontrada."}, status=404)
+
+        if request.method == 'DELETE':
+            if not reproductor.cancelar(reproduccion_id):
+                return Response({"error": f"La reproducción ya terminó ({reproduccion.estado})."}, status=409)
+            reproduccion, posicion = reproductor.obtener(reproduccion_id)
+        return self._respuesta_reproduccion(reproduccion, posicion)
+
+
+@extend_schema(tags=['Grabaciones'])
+class GrabacionViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Grabaciones de video como trabajos asíncronos.
+    POST inicia la grabación en segundo plano y responde 202 con el id;
+    GET /grabaciones/{id}/ devuelve estado, progreso y la URL del video al terminar.
+    """
+    serializer_class = GrabacionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Grabacion.objects.filter(usuario=self.request.user).order_by('-creado_en')
+        # ?estado= y ?origen= (manual / evento)
+        for campo in ('estado', 'origen'):
+            valor = self.request.query_params.get(campo)
+            if valor:
+                queryset = queryset.filter(**{campo: valor})
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            grabacion = serializer.save(usuario=request.user)
+            iniciar_grabacion(grabacion)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'])
+    def archivo(self, request, pk=None):
+        """Descarga el video de una grabación propia (con ETag y Range)."""
+        grabacion = self.get_object()
+        if not grabacion.archivo:
+            raise Http404("La grabación no tiene video.")
+        return servir_archivo(request, grabacion.archivo.name)
+
+
+@extend_schema(tags=['Audios'])
+class AudioClipViewSet(viewsets.ModelViewSet):
+    """
+    Biblioteca de audios del usuario. Al subirlos (`audio_file` + `nombre`) se
+    transcodifican una sola vez a WAV PCM; después se reproducen por id con
+    /raspi/reproducir_audio/ (campo `clip`) o se asignan a un Horario.
+    """
+    serializer_class = AudioClipSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        return AudioClip.objects.filter(usuario=self.request.user).order_by('-creado_en')
+
+    def create(self, request, *args, **kwargs):
+        if 'audio_file' not in request.FILES:
+            return Response({"error": "No se proporcionó un archivo de audio."}, status=400)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        clip, error = crear_audio_clip(request.user, serializer.validated_data['nombre'], request.FILES['audio_file'])
         if error:
-            return Response(error, status=500)
-        
-        return Response(output)
+            return Response(error, status=400)
+        return Response(self.get_serializer(clip).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def archivo(self, request, pk=None):
+        """Descarga el WAV de un audio propio (con ETag y Range)."""
+        return servir_archivo(request, self.get_object().archivo.name)
 
 
 # --- VISTAS DE MODELOS ---
 @extend_schema(tags=['Usuarios'])
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ImagenMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestionar usuarios.
     Por seguridad, los usuarios solo pueden ver/editar su propio perfil.
@@ -257,9 +607,18 @@ class UserViewSet(viewsets.ModelViewSet):
         Staff/Superusers pueden ver todos los usuarios.
         """
         user = self.request.user
-        if user.is_staff or user.is_superuser:
-            return User.objects.all()
-        return User.objects.filter(id=user.id)  # Solo su propio usuario
+        if not (user.is_staff or user.is_superuser):
+            return User.objects.filter(id=user.id)  # Solo su propio usuario
+
+        # Filtros para staff: ?email= (contiene) y ?is_active=
+        queryset = User.objects.all()
+        email = self.request.query_params.get('email')
+        if email:
+            queryset = queryset.filter(email__icontains=email)
+        is_active = filtro_booleano(self.request, 'is_active')
+        if is_active is not None:
+            queryset = queryset.filter(is_active=is_active)
+        return queryset
     
     def get_serializer_context(self):
         """Agregar request al contexto del serializer para manejar imágenes"""
@@ -346,13 +705,18 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 @extend_schema(tags=['Mascotas'])
-class PetViewSet(viewsets.ModelViewSet):
+class PetViewSet(ImagenMixin, viewsets.ModelViewSet):
     serializer_class = PetSerializer
     
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return Pet.objects.none()
-        return Pet.objects.filter(user=self.request.user)
+        queryset = Pet.objects.filter(user=self.request.user)
+        # ?race= filtra por raza exacta
+        race = self.request.query_params.get('race')
+        if race:
+            queryset = queryset.filter(race__iexact=race)
+        return queryset
     
     def get_serializer_context(self):
         """Agregar request al contexto del serializer"""
@@ -392,11 +756,63 @@ class DispenserViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return Dispenser.objects.none()
-        return Dispenser.objects.filter(user=self.request.user)
+        queryset = Dispenser.objects.filter(user=self.request.user)
+        # ?status=true|false filtra activos / inactivos
+        activo = filtro_booleano(self.request, 'status')
+        if activo is not None:
+            queryset = queryset.filter(status=activo)
+        return queryset
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def lecturas(self, request, pk=None):
+        """
+        Histórico de sensores del dispensador para gráficas.
+        Parámetros: ?sensor=PESO_A,PESO_B (todos por defecto), ?desde= y ?hasta= (ISO 8601,
+        por defecto las últimas 24 h) y ?resolucion=raw|1m|1h|1d (automática por defecto).
+        """
+        dispenser = self.get_object()
+
+        sensor_param = request.query_params.get('sensor', '')
+        sensor_labels = [s.strip() for s in sensor_param.split(',') if s.strip()] or list(sensores.values())
+        desconocidos = [s for s in sensor_labels if s not in sensores.values()]
+        if desconocidos:
+            return Response({"error": f"Sensores no reconocidos: {', '.join(desconocidos)}."}, status=400)
+
+        hasta = timezone.now()
+        desde = hasta - timedelta(days=1)
+        for nombre in ('desde', 'hasta'):
+            valor = request.query_params.get(nombre)
+            if valor:
+                try:
+                    fecha = parse_datetime(valor)
+                except ValueError:
+                    # Bien formada pero inexistente (p. ej. mes 13)
+                    fecha = None
+                if fecha is None:
+                    return Response({"error": f"El parámetro '{nombre}' debe ser una fecha ISO 8601."}, status=400)
+                if timezone.is_naive(fecha):
+                    fecha = timezone.make_aware(fecha)
+                if nombre == 'desde':
+                    desde = fecha
+                else:
+                    hasta = fecha
+
+        resolucion = request.query_params.get('resolucion')
+        if resolucion and resolucion != 'raw' and resolucion not in SEGUNDOS_RESOLUCION:
+            return Response({"error": "La resolución debe ser raw, 1m, 1h o 1d."}, status=400)
+
+        resolucion, series = almacen_lecturas.consultar(dispenser.id, sensor_labels, desde, hasta, resolucion)
+        return Response({
+            "dispenser": dispenser.id,
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+            "resolucion": resolucion,
+            "series": series,
+        })
+
 @extend_schema(tags=['Horarios'])
 class HorarioViewSet(viewsets.ModelViewSet):
     """
@@ -411,8 +827,22 @@ class HorarioViewSet(viewsets.ModelViewSet):
         if not self.request.user.is_authenticated:
             return Horario.objects.none()
         
-        # Filtrar directamente por usuario
-        return Horario.objects.filter(usuario=self.request.user)
+        # Filtrar directamente por usuario. El serializer muestra datos de la
+        # mascota, el dispensador y el usuario: se traen en la misma consulta
+        # (solo las columnas que usa) en lugar de una consulta por fila.
+        queryset = Horario.objects.filter(usuario=self.request.user).select_related(
+            'mascota', 'dispensador', 'usuario'
+        ).only(
+            'id', 'mascota', 'dispensador', 'usuario', 'audio', 'horarios', 'creado_en', 'actualizado_en',
+            'mascota__name', 'dispensador__ubication', 'dispensador__status', 'usuario__email',
+        )
+        
+        # ?dispensador=<id> y ?mascota=<id>
+        for campo in ('dispensador', 'mascota'):
+            valor = filtro_id(self.request, campo)
+            if valor is not None:
+                queryset = queryset.filter(**{f'{campo}_id': valor})
+        return queryset
     
     def perform_create(self, serializer):
         """
@@ -422,17 +852,24 @@ class HorarioViewSet(viewsets.ModelViewSet):
         dispensador = serializer.validated_data.get('dispensador')
         
         # Verificar que la mascota pertenezca al usuario
-        if mascota.user != self.request.user:
-            raise serializers.ValidationError({
+        if mascota and mascota.user != self.request.user:
+            raise ValidationError({
                 'mascota': 'No puedes asignar horarios a mascotas que no te pertenecen'
             })
         
         # Verificar que el dispensador pertenezca al usuario
         if dispensador and dispensador.user != self.request.user:
-            raise serializers.ValidationError({
+            raise ValidationError({
                 'dispensador': 'No puedes usar dispensadores que no te pertenecen'
             })
         
+        # Verificar que el audio pertenezca al usuario
+        audio = serializer.validated_data.get('audio')
+        if audio and audio.usuario != self.request.user:
+            raise ValidationError({
+                'audio': 'No puedes usar audios que no te pertenecen'
+            })
+        
         # Asignar automáticamente el usuario autenticado
         serializer.save(usuario=self.request.user)
     
@@ -440,4 +877,137 @@ class HorarioViewSet(viewsets.ModelViewSet):
         """
         Mismas validaciones para actualizar
         """
-        self.perform_create(serializer)
\ No newline at end of file
+        self.perform_create(serializer)
+
+
+# --- ARCHIVOS MEDIA ---
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDAR = 'public, no-cache'
+
+
+def _rango_pedido(request, etag, tamano):
+    """
+    Lee un Range de un solo intervalo ("bytes=a-b", "bytes=a-", "bytes=-n").
+    Devuelve (inicio, fin) inclusivo, None para responder completo o False si
+    el rango no se puede satisfacer (416).
+    """
+    encabezado = request.headers.get('Range', '')
+    if not encabezado.startswith('bytes=') or ',' in encabezado:
+        # Sin rango o con varios: se entrega el archivo completo
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag:
+        # El archivo cambió desde que el cliente pidió la primera parte
+        return None
+
+    inicio, _, fin = encabezado[len('bytes='):].strip().partition('-')
+    if not (inicio or fin) or not all(parte.isascii() and parte.isdigit() for parte in (inicio, fin) if parte):
+        return None
+    if inicio:
+        if fin and int(fin) < int(inicio):
+            # "bytes=5-3" no es un rango válido: se ignora, no es un 416
+            return None
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    else:
+        if int(fin) == 0:
+            return False
+        inicio, fin = max(0, tamano - int(fin)), tamano - 1
+    if inicio >= tamano:
+        return False
+    return inicio, fin
+
+
+def _leer_rango(ruta, inicio, longitud, tamano_bloque=64 * 1024):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        while longitud > 0:
+            datos = archivo.read(min(tamano_bloque, longitud))
+            if not datos:
+                break
+            longitud -= len(datos)
+            yield datos
+
+
+@require_safe
+def servir_media(request, ruta):
+    """
+    Sirve en MEDIA_URL (también en producción) las carpetas públicas de
+    MEDIA_ROOT: las de MEDIA_PUBLICO (fotos). Los videos y audios solo se
+    descargan con su dueño autenticado, en /grabaciones/<id>/archivo/ y
+    /audios/<id>/archivo/.
+    """
+    if not ruta.startswith(tuple(settings.MEDIA_PUBLICO)):
+        raise Http404("El archivo no existe.")
+    return servir_archivo(request, ruta)
+
+
+def servir_archivo(request, ruta):
+    """
+    Entrega el archivo `ruta` de MEDIA_ROOT.
+
+    - ETag fuerte y Last-Modified; If-None-Match / If-Modified-Since -> 304.
+    - Los blobs (nombre = hash del contenido) se marcan como inmutables por un
+      año; el resto, incluidas sus variantes, se revalida en cada uso, que con
+      el ETag cuesta un 304.
+    - Range de un intervalo -> 206 (para adelantar los videos grabados).
+    - Completo con FileResponse: el servidor WSGI lo envía con su
+      wsgi.file_wrapper (sendfile en gunicorn/uwsgi). Con MEDIA_SENDFILE el
+      envío se delega a nginx (X-Accel-Redirect) o Apache (X-Sendfile).
+    """
+    try:
+        ruta_completa = safe_join(settings.MEDIA_ROOT, ruta)
+        info = os.stat(ruta_completa)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("El archivo no existe.")
+    if not os.path.isfile(ruta_completa):
+        raise Http404("El archivo no existe.")
+
+    inmutable = es_inmutable(ruta)
+    if inmutable:
+        # El nombre ya es el hash del contenido
+        etag = f'"{os.path.splitext(os.path.basename(ruta))[0]}"'
+    else:
+        etag = f'"{info.st_mtime_ns:x}-{info.st_size:x}"'
+    encabezados = {
+        'ETag': etag,
+        'Last-Modified': http_date(info.st_mtime),
+        'Cache-Control': CACHE_INMUTABLE if inmutable else CACHE_REVALIDAR,
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(info.st_mtime))
+    if response is None:
+        if settings.MEDIA_SENDFILE:
+            response = HttpResponse(content_type=mimetypes.guess_type(ruta)[0] or 'application/octet-stream')
+            if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+                response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_PREFIJO + ruta
+            else:
+                response['X-Sendfile'] = ruta_completa
+        else:
+            response = _respuesta_archivo(request, ruta_completa, etag, info.st_size)
+    for nombre, valor in encabezados.items():
+        response.setdefault(nombre, valor)
+    return response
+
+
+def _respuesta_archivo(request, ruta_completa, etag, tamano):
+    content_type = mimetypes.guess_type(ruta_completa)[0] or 'application/octet-stream'
+    rango = _rango_pedido(request, etag, tamano)
+    if rango is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{tamano}"
+        return response
+    if rango is None:
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+            response['Content-Length'] = tamano
+            return response
+        return FileResponse(open(ruta_completa, 'rb'), content_type=content_type)
+
+    inicio, fin = rango
+    longitud = fin - inicio + 1
+    contenido = [] if request.method == 'HEAD' else _leer_rango(ruta_completa, inicio, longitud)
+    response = StreamingHttpResponse(contenido, status=206, content_type=content_type)
+    response['Content-Range'] = f"bytes {inicio}-{fin}/{tamano}"
+    response['Content-Length'] = longitud
+    return response
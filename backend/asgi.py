@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Bajo ASGI (p. ej. ``uvicorn backend.asgi:application``) el stream de video usa
+un generador asíncrono, así que un solo worker atiende muchos espectadores.
 """
 
 import os
@@ -14,3 +17,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# Servicios de fondo (programador, cámara, ESP32, tareas): uno solo de los
+# workers los corre, ver api/servicios.py
+from api.servicios import iniciar_servicios  # noqa: E402
+
+iniciar_servicios()
@@ -1,4 +1,5 @@
 from pathlib import Path
+import os
 from datetime import timedelta # Necesario para la configuración de SIMPLE_JWT
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -63,6 +64,8 @@ REST_FRAMEWORK = {
         # Aseguramos que todas las vistas requieran JWT por defecto
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # Listados paginados por cursor (?cursor=..., ?page_size= hasta 200)
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PaginacionCursor',
     # Corrección: Quité el segundo diccionario duplicado de REST_FRAMEWORK
 }
 
@@ -95,6 +98,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
@@ -139,9 +143,106 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 # Directorios de Archivos Media (Imágenes subidas por el usuario)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Cómo entrega los archivos la vista de MEDIA_URL (api.views.servir_media):
+# None = Django mismo (FileResponse / Range); 'x-accel-redirect' (nginx, con un
+# location interno en MEDIA_SENDFILE_PREFIJO que apunte a MEDIA_ROOT) o
+# 'x-sendfile' (Apache mod_xsendfile).
+MEDIA_SENDFILE = None
+MEDIA_SENDFILE_PREFIJO = '/media-interno/'
+# Carpetas de MEDIA_ROOT que MEDIA_URL sirve sin autenticación (las fotos). Los
+# videos y audios se descargan con su dueño en /grabaciones/<id>/archivo/ y
+# /audios/<id>/archivo/.
+MEDIA_PUBLICO = ['blobs/', 'usersImages/', 'petsImages/']
 # -----------------------------------------------
 
 
+# === Configuración del hardware (ESP32 por UART) ===
+ESP32_PUERTO = '/dev/ttyAMA10'
+ESP32_BAUDRATE = 115200
+# Segundos que una petición espera su turno + respuesta antes de darse por vencida
+ESP32_TIMEOUT_COMANDO = 10
+# Comandos máximos en cola; por encima se responde 503 para que el cliente reintente
+ESP32_MAX_COLA = 32
+# Cada cuántos segundos se leen todos los sensores en segundo plano (0 = desactivado)
+ESP32_POLL_INTERVAL = 5
+# Dispensador (id) al que pertenecen las lecturas del poller; None = no se guardan
+ESP32_DISPENSER_ID = None
+# 'serial' = UART real en ESP32_PUERTO; 'simulado' = ESP32 simulada en el proceso
+# (pruebas de carga sin la placa, ver core/transports.py)
+ESP32_TRANSPORT = 'serial'
+# Opciones de la ESP32 simulada: latencia (s), tasa_error, tasa_corrupcion,
+# tasa_desconexion, duracion_motor, duracion_bomba, semilla
+ESP32_SIMULADOR = {}
+
+# === Cámara (una sola captura compartida por todos los streams) ===
+CAMARA_DISPOSITIVO = 0
+CAMARA_ANCHO = 720
+CAMARA_ALTO = 720
+# Antigüedad máxima (s) de la última captura para reutilizarla en /raspi/snapshot/
+CAMARA_SNAPSHOT_MAX_AGE = 5
+
+# Cuadros por segundo que guardan las grabaciones manuales (/grabaciones/)
+GRABACION_FPS = 15
+# Cada cuántos segundos se marcan 'fallida' las grabaciones que un reinicio dejó a medias
+GRABACIONES_REVISION_INTERVALO = 60
+
+# Clips automáticos al activar el motor: segundos antes/después del evento.
+# Con CAMARA_PREEVENTO_SEGUNDOS > 0 la cámara queda abierta todo el tiempo
+# guardando JPEG a CAMARA_HISTORIAL_FPS.
+CAMARA_PREEVENTO_SEGUNDOS = 0
+CAMARA_POSTEVENTO_SEGUNDOS = 10
+CAMARA_HISTORIAL_FPS = 5
+
+# === Imágenes ===
+# Tamaño máximo (bytes) de las fotos subidas a /users/<id>/image/ y /pets/<id>/image/
+IMAGEN_MAX_BYTES = 5 * 1024 * 1024
+# Variantes que se generan en segundo plano al subir una foto (lado mayor en px)
+# y su formato ('WEBP' o 'JPEG'). Con ?image_size=N se entrega la más chica que alcance.
+IMAGEN_VARIANTES = [64, 256, 1024]
+IMAGEN_VARIANTES_FORMATO = 'WEBP'
+IMAGEN_VARIANTES_CALIDAD = 80
+# Las fotos se guardan por contenido en media/blobs/. Cada MEDIA_GC_INTERVALO s
+# se borran las que llevan más de MEDIA_GC_GRACIA s sin usarse (0 = no recolectar).
+MEDIA_GC_INTERVALO = 3600
+MEDIA_GC_GRACIA = 3600
+# Fotos recibidas en base64 mientras esperan su tarea 'procesar_imagen'. Tiene
+# que sobrevivir a un reinicio (no /tmp) y no quedar dentro de MEDIA_ROOT, que
+# se sirve públicamente.
+IMAGEN_TEMP_DIR = BASE_DIR / 'imagenes_pendientes'
+
+# === Cola de tareas de fondo (api/tareas.py) ===
+# Hilos del pool (0 = no procesar tareas en este proceso)
+TAREAS_HILOS = min(4, os.cpu_count() or 1)
+# Segundos entre sondeos de la tabla; también base de la espera entre reintentos
+TAREAS_ESPERA = 5
+# Una tarea 'ejecutando' sin cambios por más de esto se da por abandonada (el
+# proceso que la tomó se cayó) y el pool la vuelve a tomar
+TAREAS_TIMEOUT = 600
+# Las completadas se borran tras TAREAS_RETENCION s (revisión cada TAREAS_LIMPIEZA_INTERVALO s)
+TAREAS_RETENCION = 7 * 24 * 3600
+TAREAS_LIMPIEZA_INTERVALO = 24 * 3600
+
+# === Audio ===
+# Carpeta de los audios subidos mientras esperan su turno en la cola de reproducción
+AUDIO_UPLOAD_DIR = '/tmp/audio_uploads'
+# Máximo de audios esperando; si se llena /raspi/reproducir_audio/ responde 503
+AUDIO_MAX_COLA = 20
+
+# Programador de comidas: activa el motor a las horas de Dispenser.horarios
+PROGRAMADOR_COMIDAS_ACTIVO = True
+# Zona de las horas "HH:MM" de los horarios (la de la casa). TIME_ZONE sigue en
+# UTC para lo que se guarda en la BD.
+PROGRAMADOR_ZONA_HORARIA = 'America/Mexico_City'
+# Cada cuántos segundos se comparan los horarios programados con la tabla, para
+# recoger los cambios hechos en otros workers (0 = solo las señales del proceso)
+PROGRAMADOR_RECONCILIAR = 60
+
+# Candado que elige el único proceso que corre los servicios de fondo
+# (programador, historial de cámara, ESP32, tareas) cuando hay varios workers.
+# None = cada proceso los arranca (solo con un worker).
+SERVICIOS_LOCK = BASE_DIR / 'servicios.lock'
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
-# --- [CORRECCIÓN CRÍTICA] Importaciones para servir archivos media en desarrollo
 from django.conf import settings
-from django.conf.urls.static import static
+
+from api.views import servir_media
 
 # Importaciones para la documentación de la API (drf-spectacular)
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
@@ -26,7 +26,8 @@ urlpatterns = [
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 ]
 
-# 4. --- [CORRECCIÓN CRÍTICA] Configuración para servir archivos MEDIA (imágenes) ---
-# Esto es fundamental para que las imágenes de usuarios y mascotas se carguen en DEBUG.
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# 4. --- Archivos MEDIA (fotos; los videos y audios van por la API con su dueño) ---
+# También en producción: con ETag, cache inmutable para los blobs y Range (ver servir_media).
+urlpatterns += [
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:ruta>", servir_media, name='media'),
+]
\ No newline at end of file
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Servicios de fondo (programador, cámara, ESP32, tareas): uno solo de los
+# workers los corre, ver api/servicios.py
+from api.servicios import iniciar_servicios  # noqa: E402
+
+iniciar_servicios()
@@ -0,0 +1,147 @@
+import os
+import sys
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from .raspi_controller import comando_reproducir_audio
+
+
+class ColaAudioLlena(Exception):
+    """Hay demasiados audios esperando; el cliente debe reintentar más tarde."""
+
+
+class Reproduccion:
+    """Un audio en la cola del reproductor."""
+    ESTADOS_FINALES = ('completada', 'fallida', 'cancelada')
+
+    def __init__(self, ruta, borrar_al_terminar, usuario_id=None):
+        self.id = uuid.uuid4().hex
+        self.ruta = ruta
+        self.borrar_al_terminar = borrar_al_terminar
+        # Quien la pidió: solo esa persona puede consultarla o cancelarla
+        self.usuario_id = usuario_id
+        self.estado = 'en_cola'
+        self.error = None
+        self.creado = time.time()
+
+    @property
+    def terminada(self):
+        return self.estado in self.ESTADOS_FINALES
+
+
+class ReproductorAudio:
+    """
+    Cola de reproducción con un solo hilo reproductor: los audios suenan de uno
+    en uno y en orden de llegada, y las peticiones regresan en cuanto el audio
+    queda encolado. Una reproducción en cola o en curso se puede cancelar
+    (a la que está sonando se le termina el proceso de ffplay).
+    """
+
+    def __init__(self, max_cola=20, timeout=30, max_historial=100):
+        self.max_cola = max_cola
+        self.timeout = timeout
+        self.max_historial = max_historial
+        self._cola = deque()
+        self._actual = None
+        self._proceso = None
+        self._terminadas = OrderedDict()
+        self._condicion = threading.Condition()
+        self._hilo = None
+
+    def encolar(self, ruta, borrar_al_terminar=True, usuario_id=None):
+        """Agrega un audio al final de la cola y devuelve su Reproduccion."""
+        with self._condicion:
+            if len(self._cola) >= self.max_cola:
+                raise ColaAudioLlena(f"Hay {len(self._cola)} audios esperando; intenta más tarde.")
+            reproduccion = Reproduccion(ruta, borrar_al_terminar, usuario_id)
+            self._cola.append(reproduccion)
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="reproductor-audio", daemon=True)
+                self._hilo.start()
+            self._condicion.notify()
+            return reproduccion
+
+    def obtener(self, reproduccion_id):
+        """Devuelve (Reproduccion, posicion) o (None, None). Posición 0 = sonando ahora."""
+        with self._condicion:
+            if self._actual is not None and self._actual.id == reproduccion_id:
+                return self._actual, 0
+            for posicion, reproduccion in enumerate(self._cola, start=1):
+                if reproduccion.id == reproduccion_id:
+                    return reproduccion, posicion
+            reproduccion = self._terminadas.get(reproduccion_id)
+            return reproduccion, None
+
+    def cancelar(self, reproduccion_id):
+        """Cancela un audio en cola o en curso. Devuelve False si ya había terminado o no existe."""
+        with self._condicion:
+            if self._actual is not None and self._actual.id == reproduccion_id:
+                self._actual.estado = 'cancelada'
+                if self._proceso is not None:
+                    self._proceso.terminate()
+                return True
+            for reproduccion in self._cola:
+                if reproduccion.id == reproduccion_id:
+                    self._cola.remove(reproduccion)
+                    reproduccion.estado = 'cancelada'
+                    self._finalizar(reproduccion)
+                    return True
+        return False
+
+    def _finalizar(self, reproduccion):
+        """Guarda el resultado y borra el archivo temporal. Requiere el lock."""
+        self._terminadas[reproduccion.id] = reproduccion
+        while len(self._terminadas) > self.max_historial:
+            self._terminadas.popitem(last=False)
+        if reproduccion.borrar_al_terminar:
+            try:
+                os.remove(reproduccion.ruta)
+            except OSError as e:
+                print(f"Error: {e.strerror} - {e.filename}", file=sys.stderr)
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                if not self._cola:
+                    # Sin trabajo: el hilo termina y se vuelve a crear con el siguiente audio
+                    self._hilo = None
+                    return
+                reproduccion = self._cola.popleft()
+                self._actual = reproduccion
+                reproduccion.estado = 'reproduciendo'
+                try:
+                    self._proceso = subprocess.Popen(
+                        comando_reproducir_audio(reproduccion.ruta),
+                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                    )
+                except FileNotFoundError:
+                    self._proceso = None
+                    reproduccion.estado = 'fallida'
+                    reproduccion.error = "ffplay no está instalado o no se encuentra en el PATH. Asegúrate de tener ffmpeg instalado."
+                except OSError as e:
+                    # Sin permisos de ejecución, etc.: se descarta este audio y la cola sigue
+                    self._proceso = None
+                    reproduccion.estado = 'fallida'
+                    reproduccion.error = f"No se pudo iniciar la reproducción: {e}"
+
+            if self._proceso is not None:
+                try:
+                    _, stderr = self._proceso.communicate(timeout=self.timeout)
+                    if self._proceso.returncode != 0 and reproduccion.estado != 'cancelada':
+                        reproduccion.estado = 'fallida'
+                        reproduccion.error = stderr or "El comando de ffplay falló."
+                except subprocess.TimeoutExpired:
+                    self._proceso.kill()
+                    self._proceso.communicate()
+                    reproduccion.estado = 'fallida'
+                    reproduccion.error = "El comando de reproducción de audio excedió el tiempo de espera."
+
+            with self._condicion:
+                if reproduccion.estado == 'reproduciendo':
+                    reproduccion.estado = 'completada'
+                self._actual = None
+                self._proceso = None
+                self._finalizar(reproduccion)
@@ -0,0 +1,319 @@
+import sys
+import asyncio
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+
+# Un cuadro capturado: `jpeg` es la codificación por defecto (compartida por todos
+# los clientes) e `imagen` el cuadro original para generar otras calidades/tamaños.
+Cuadro = namedtuple('Cuadro', ['id', 'timestamp', 'jpeg', 'imagen'])
+
+
+class PerfilStream:
+    """
+    Parámetros de un stream (fps, ancho y calidad JPEG).
+
+    En modo adaptativo se ajustan según cuánto tarda el cliente en recibir cada
+    cuadro: si el envío tarda más que el intervalo entre cuadros se baja primero
+    la calidad, luego la resolución y por último los fps; si sobra tiempo se
+    recuperan en orden inverso hasta los valores pedidos.
+    """
+    CALIDAD_MINIMA = 30
+    ANCHO_MINIMO = 240
+    FPS_MINIMO = 2
+
+    def __init__(self, fps=15, ancho=None, calidad=None, adaptativo=False):
+        self.fps_max = self.fps = fps
+        self.ancho_max = self.ancho = ancho
+        self.calidad_max = self.calidad = calidad
+        self.adaptativo = adaptativo
+
+    @property
+    def intervalo(self):
+        return 1.0 / self.fps
+
+    def ajustar(self, tiempo_envio, ancho_captura):
+        if not self.adaptativo:
+            return
+        calidad = self.calidad or 95
+        ancho = self.ancho or ancho_captura
+        if tiempo_envio > self.intervalo:
+            # El cliente no alcanza: degradar un paso
+            if calidad > self.CALIDAD_MINIMA:
+                self.calidad = max(self.CALIDAD_MINIMA, calidad - 10)
+            elif ancho > self.ANCHO_MINIMO:
+                self.ancho = max(self.ANCHO_MINIMO, int(ancho * 0.75))
+            elif self.fps > self.FPS_MINIMO:
+                self.fps = max(self.FPS_MINIMO, self.fps - 2)
+        elif tiempo_envio < self.intervalo / 2:
+            # Hay margen: recuperar un paso
+            if self.fps < self.fps_max:
+                self.fps = min(self.fps_max, self.fps + 1)
+            elif self.ancho and ancho < (self.ancho_max or ancho_captura):
+                self.ancho = min(self.ancho_max or ancho_captura, int(ancho / 0.75))
+            elif self.calidad and calidad < (self.calidad_max or 95):
+                self.calidad = min(self.calidad_max or 95, calidad + 5)
+
+
+class Suscripcion:
+    """Un cliente de la cámara. Siempre recibe el cuadro más reciente (sin cola)."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.ultimo_id = 0
+        self._evento = None
+
+    def siguiente(self, timeout=5):
+        """Espera un cuadro más nuevo que el último entregado; None si la cámara se detuvo."""
+        cuadro = self.hub.esperar_cuadro(self.ultimo_id, timeout)
+        if cuadro is not None:
+            self.ultimo_id = cuadro.id
+        return cuadro
+
+    async def siguiente_async(self, timeout=5):
+        """
+        Igual que `siguiente` pero sin bloquear un hilo: el hilo de captura
+        despierta al event loop con call_soon_threadsafe en cada cuadro nuevo.
+        """
+        loop = asyncio.get_running_loop()
+        if self._evento is None:
+            self._evento = asyncio.Event()
+            self.hub.registrar_evento(self, loop, self._evento)
+
+        limite = loop.time() + timeout
+        while True:
+            self._evento.clear()
+            cuadro = self.hub.ultimo_cuadro()
+            if cuadro is not None and cuadro.id > self.ultimo_id:
+                self.ultimo_id = cuadro.id
+                return cuadro
+            restante = limite - loop.time()
+            if restante <= 0 or not self.hub.activa:
+                return None
+            try:
+                await asyncio.wait_for(self._evento.wait(), restante)
+            except asyncio.TimeoutError:
+                return None
+
+    def cerrar(self):
+        self.hub.desuscribir(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+class CameraHub:
+    """
+    Una sola captura de la cámara compartida por todos los clientes.
+
+    Un hilo lee y codifica cada cuadro una sola vez y lo deja en un buffer
+    circular con los últimos cuadros; los suscriptores toman el más reciente.
+    La cámara se abre con el primer suscriptor y se libera cuando se va el último.
+
+    Opcionalmente (`iniciar_historial`) guarda los JPEG de los últimos segundos
+    a pocos fps para poder recuperar lo que pasó antes de un evento. Mientras
+    nadie más mire, los cuadros que no van al historial solo se descartan con
+    grab(), sin decodificarlos ni codificarlos.
+    """
+
+    def __init__(self, dispositivo=0, ancho=720, alto=720, tamano_buffer=4):
+        self.dispositivo = dispositivo
+        self.ancho = ancho
+        self.alto = alto
+        self._cuadros = deque(maxlen=tamano_buffer)
+        self._suscriptores = set()
+        self._eventos_async = {}
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._siguiente_id = 1
+        self._ultimo = None
+        self._codificados = {}
+        self._lock_codificacion = threading.Lock()
+        self._historial = deque()
+        self._suscripcion_historial = None
+        self._segundos_historial = 0
+        self._intervalo_historial = 0
+        self.error = None
+
+    # --- Suscriptores ---
+
+    def suscribir(self):
+        suscripcion = Suscripcion(self)
+        with self._condicion:
+            self._suscriptores.add(suscripcion)
+            if self._hilo is None or not self._hilo.is_alive():
+                self.error = None
+                self._hilo = threading.Thread(target=self._capturar, name="camara", daemon=True)
+                self._hilo.start()
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._condicion:
+            self._suscriptores.discard(suscripcion)
+            self._eventos_async.pop(suscripcion, None)
+            self._condicion.notify_all()
+
+    def registrar_evento(self, suscripcion, loop, evento):
+        """Asocia un asyncio.Event (de `loop`) que se activa con cada cuadro nuevo."""
+        with self._condicion:
+            self._eventos_async[suscripcion] = (loop, evento)
+
+    def _notificar(self):
+        """Despierta a los suscriptores síncronos y asíncronos. Requiere el lock."""
+        self._condicion.notify_all()
+        for loop, evento in list(self._eventos_async.values()):
+            try:
+                loop.call_soon_threadsafe(evento.set)
+            except RuntimeError:
+                # El event loop ya se cerró
+                pass
+
+    @property
+    def activa(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def ultimo_cuadro(self):
+        with self._condicion:
+            return self._cuadros[-1] if self._cuadros else None
+
+    def ultima_captura(self):
+        """Último cuadro capturado, aunque la cámara ya esté cerrada."""
+        with self._condicion:
+            return self._ultimo
+
+    def capturar(self, timeout=5, descartar=2):
+        """
+        Toma un cuadro nuevo. Si la cámara estaba cerrada la abre solo para esto
+        y descarta los primeros cuadros (suelen salir oscuros mientras se ajusta).
+        """
+        en_vivo = self.activa and self.ultimo_cuadro() is not None
+        with self.suscribir() as suscripcion:
+            if not en_vivo:
+                for _ in range(descartar):
+                    if suscripcion.siguiente(timeout) is None:
+                        return None
+            return suscripcion.siguiente(timeout)
+
+    def esperar_cuadro(self, despues_de_id, timeout):
+        limite = time.monotonic() + timeout
+        with self._condicion:
+            while True:
+                if self._cuadros and self._cuadros[-1].id > despues_de_id:
+                    return self._cuadros[-1]
+                restante = limite - time.monotonic()
+                if restante <= 0 or not self.activa:
+                    return None
+                self._condicion.wait(restante)
+
+    def codificar(self, cuadro, ancho=None, calidad=None):
+        """
+        JPEG del cuadro con otro ancho y/o calidad. Cada combinación se codifica
+        una sola vez por cuadro aunque la pidan varios clientes.
+        """
+        alto_original, ancho_original = cuadro.imagen.shape[:2]
+        if ancho is not None and ancho >= ancho_original:
+            ancho = None
+        if ancho is None and calidad is None:
+            return cuadro.jpeg
+
+        clave = (ancho, calidad)
+        with self._lock_codificacion:
+            if self._codificados.get('id') != cuadro.id:
+                self._codificados = {'id': cuadro.id}
+            if clave not in self._codificados:
+                imagen = cuadro.imagen
+                if ancho is not None:
+                    alto = max(1, round(alto_original * ancho / ancho_original))
+                    imagen = cv2.resize(imagen, (ancho, alto), interpolation=cv2.INTER_AREA)
+                parametros = [cv2.IMWRITE_JPEG_QUALITY, calidad] if calidad is not None else []
+                ret, buffer = cv2.imencode('.jpg', imagen, parametros)
+                self._codificados[clave] = buffer.tobytes() if ret else cuadro.jpeg
+            return self._codificados[clave]
+
+    # --- Historial para clips de eventos ---
+
+    def iniciar_historial(self, segundos, fps=5):
+        """Mantiene la cámara encendida guardando los últimos `segundos` a `fps`."""
+        with self._condicion:
+            self._segundos_historial = segundos
+            self._intervalo_historial = 1.0 / fps
+        if self._suscripcion_historial is None:
+            self._suscripcion_historial = self.suscribir()
+
+    @property
+    def fps_historial(self):
+        return 1.0 / self._intervalo_historial if self._intervalo_historial else 0
+
+    def historial(self, desde, hasta):
+        """Lista de (timestamp, jpeg) del historial entre dos timestamps."""
+        with self._condicion:
+            return [(ts, jpeg) for ts, jpeg in self._historial if desde <= ts <= hasta]
+
+    def _guardar_en_historial(self, timestamp, jpeg):
+        """Requiere el lock."""
+        self._historial.append((timestamp, jpeg))
+        while self._historial and self._historial[0][0] < timestamp - self._segundos_historial:
+            self._historial.popleft()
+
+    # --- Hilo de captura ---
+
+    def _capturar(self):
+        camera = cv2.VideoCapture(self.dispositivo)
+        try:
+            if not camera.isOpened():
+                self.error = "No se pudo abrir la cámara."
+                print(f"Error: {self.error}", file=sys.stderr)
+                return
+
+            camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.ancho)
+            camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.alto)
+
+            ultimo_historial = 0
+            while True:
+                with self._condicion:
+                    if not self._suscriptores:
+                        break
+                    hay_clientes = len(self._suscriptores) > (1 if self._suscripcion_historial else 0)
+                    toca_historial = (
+                        self._suscripcion_historial is not None
+                        and time.monotonic() - ultimo_historial >= self._intervalo_historial
+                    )
+
+                if not hay_clientes and not toca_historial:
+                    # Solo el historial está activo y aún no le toca cuadro
+                    if not camera.grab():
+                        self.error = "La cámara dejó de enviar cuadros."
+                        break
+                    continue
+
+                success, frame = camera.read()
+                if not success:
+                    self.error = "La cámara dejó de enviar cuadros."
+                    break
+
+                ret, buffer = cv2.imencode('.jpg', frame)
+                if not ret:
+                    continue
+
+                with self._condicion:
+                    self._ultimo = Cuadro(self._siguiente_id, time.time(), buffer.tobytes(), frame)
+                    self._cuadros.append(self._ultimo)
+                    self._siguiente_id += 1
+                    if toca_historial:
+                        ultimo_historial = time.monotonic()
+                        self._guardar_en_historial(self._ultimo.timestamp, self._ultimo.jpeg)
+                    self._notificar()
+        finally:
+            camera.release()
+            with self._condicion:
+                self._cuadros.clear()
+                if self._suscriptores and self.error is None:
+                    # Alguien se suscribió justo mientras se cerraba: volver a abrir
+                    self._hilo = threading.Thread(target=self._capturar, name="camara", daemon=True)
+                    self._hilo.start()
+                self._notificar()
@@ -13,11 +13,14 @@ TEST_MODE = False
 PUERTO = '/dev/ttyAMA10'
 BAUDRATE = 115200
 
+# Tiempo que necesita la ESP32 después de abrir el puerto (se reinicia al conectar)
+TIEMPO_ESTABILIZACION = 2
+
 def get_serial_connection():
     """Establece y devuelve una conexión serial real."""
     try:
         ser = serial.Serial(PUERTO, BAUDRATE, timeout=5)
-        time.sleep(2)
+        time.sleep(TIEMPO_ESTABILIZACION)
         return ser
     except Exception as e:
         # Imprime el error al stderr para que la vista de Django lo capture.
@@ -32,167 +35,250 @@ sensores = {
     '4': 'DISTANCIA_B'
 }
 
-def leer_datos_serial(filtro_etiqueta):
-    """Lee datos del puerto serial (real o simulado) y los imprime como JSON."""
-    valor_final = "No se recibió respuesta"
-    if TEST_MODE:
-        if filtro_etiqueta == 'PESO_A':
-            valor_final = f"{random.randint(50, 200)} g"
-        elif filtro_etiqueta == 'PESO_B':
-            valor_final = f"{random.randint(10, 50)} g"
-        elif filtro_etiqueta == 'DISTANCIA_A':
-            # Solo valores entre 2 y 7 cm para modo de prueba
-            valor_final = f"{random.randint(2, 7)} cm"
-        elif filtro_etiqueta == 'DISTANCIA_B':
-            # Solo valores entre 2 y 7 cm para modo de prueba
-            valor_final = f"{random.randint(2, 7)} cm"
+
+# --- Operaciones sobre una conexión ya abierta ---
+# Devuelven (salida, exito) igual que raspi_controller, para poder usarse tanto
+# desde este script como desde el gestor serial persistente (serial_manager.py).
+# Los errores del propio puerto se propagan para que quien lo abrió pueda reconectar.
+ERRORES_PUERTO = (serial.SerialException, OSError)
+
+def _esperar_linea(ser, coincide, timeout):
+    """
+    Lee líneas del puerto hasta que `coincide(linea)` sea verdadero o se agote el tiempo.
+    Devuelve (linea_que_coincide, ultima_linea_leida).
+    """
+    ultima_linea = None
+    inicio = time.time()
+    while time.time() - inicio < timeout:
+        if ser.in_waiting > 0:
+            linea = ser.readline().decode('utf-8', errors='ignore').strip()
+            ultima_linea = linea
+            if coincide(linea):
+                return linea, ultima_linea
         else:
-            print(json.dumps({"error": f"Sensor '{filtro_etiqueta}' no reconocido."}), file=sys.stderr)
+            time.sleep(0.005)
+    return None, ultima_linea
+
+
+def _simular_sensor(filtro_etiqueta):
+    if filtro_etiqueta == 'PESO_A':
+        return f"{random.randint(50, 200)} g"
+    elif filtro_etiqueta == 'PESO_B':
+        return f"{random.randint(10, 50)} g"
+    elif filtro_etiqueta == 'DISTANCIA_A':
+        # Solo valores entre 2 y 7 cm para modo de prueba
+        return f"{random.randint(2, 7)} cm"
+    elif filtro_etiqueta == 'DISTANCIA_B':
+        # Solo valores entre 2 y 7 cm para modo de prueba
+        return f"{random.randint(2, 7)} cm"
+    return None
+
+
+def consultar_sensor(ser, filtro_etiqueta, timeout=2):
+    """Solicita el valor de un sensor sobre una conexión abierta."""
+    if TEST_MODE:
+        valor = _simular_sensor(filtro_etiqueta)
+        if valor is None:
+            return {"error": f"Sensor '{filtro_etiqueta}' no reconocido."}, False
+        return {filtro_etiqueta: valor}, True
+
+    key_to_send = None
+    for key, value in sensores.items():
+        if value == filtro_etiqueta:
+            key_to_send = key
+            break
+    if not key_to_send:
+        return {"error": f"Sensor '{filtro_etiqueta}' no encontrado."}, False
+
+    try:
+        ser.write(f"{key_to_send}\n".encode())
+        linea, _ = _esperar_linea(ser, lambda l: filtro_etiqueta in l, timeout)
+    except ERRORES_PUERTO:
+        raise
+    except Exception as e:
+        return {"error": f"Error leyendo datos: {e}"}, False
+
+    valor_final = linea.split(':')[-1].strip() if linea else "No se recibió respuesta"
+    return {filtro_etiqueta: valor_final}, True
+
+
+def consultar_sensores(ser, etiquetas=None, timeout=2):
+    """
+    Solicita varios sensores en una sola sesión.
+
+    Los comandos se envían todos seguidos (en tubería) y luego se recogen las
+    respuestas en el orden en que lleguen, así que el costo total es el de una
+    sola espera y no el de una por sensor.
+    """
+    etiquetas = list(etiquetas or sensores.values())
+    claves = {value: key for key, value in sensores.items()}
+    desconocidas = [e for e in etiquetas if e not in claves]
+    if desconocidas:
+        return {"error": f"Sensores no reconocidos: {', '.join(desconocidas)}."}, False
+
+    if TEST_MODE:
+        return {etiqueta: _simular_sensor(etiqueta) for etiqueta in etiquetas}, True
+
+    resultado = {etiqueta: "No se recibió respuesta" for etiqueta in etiquetas}
+    pendientes = set(etiquetas)
+
+    def registrar(linea):
+        for etiqueta in list(pendientes):
+            if etiqueta in linea:
+                resultado[etiqueta] = linea.split(':')[-1].strip()
+                pendientes.discard(etiqueta)
+        return not pendientes
+
+    try:
+        ser.write("".join(f"{claves[e]}\n" for e in etiquetas).encode())
+        _esperar_linea(ser, registrar, timeout)
+    except ERRORES_PUERTO:
+        raise
+    except Exception as e:
+        return {"error": f"Error leyendo datos: {e}"}, False
+
+    return resultado, True
+
+
+def enviar_motor(ser):
+    """Envía el comando de activación del motor."""
+    if TEST_MODE:
+        return {"message": "Comando de activación de motor ejecutado."}, True
+    try:
+        ser.write(b'r\n')
+        return {"message": "Comando de activación de motor enviado."}, True
+    except ERRORES_PUERTO:
+        raise
+    except Exception as e:
+        return {"error": f"Error al activar el motor: {e}"}, False
+
+
+def enviar_bomba(ser):
+    """Envía el comando de activación de la bomba de agua."""
+    if TEST_MODE:
+        return {"message": "Comando de activación de bomba ejecutado."}, True
+    try:
+        ser.write(b'b\n')
+        return {"message": "Comando de activación de bomba enviado."}, True
+    except ERRORES_PUERTO:
+        raise
+    except Exception as e:
+        return {"error": f"Error al activar la bomba: {e}"}, False
+
+
+def _comando_balanza(nombre_balanza):
+    if nombre_balanza.upper() == 'A':
+        return b'c\n'
+    elif nombre_balanza.upper() == 'B':
+        return b'd\n'
+    return None
+
+
+def tarar_balanza(ser, nombre_balanza, timeout=5):
+    """Paso 1 de la calibración sobre una conexión abierta."""
+    if TEST_MODE:
+        return {"status": "success", "message": "Modo de prueba: Balanza tarada. Ahora coloca el peso."}, True
+
+    comando = _comando_balanza(nombre_balanza)
+    if not comando:
+        return {"status": "error", "message": "Nombre de balanza no válido. Use 'A' o 'B'."}, False
+
+    try:
+        ser.write(comando)
+        # Leer la respuesta de la ESP32 que indica que está lista
+        linea, ultima = _esperar_linea(
+            ser, lambda l: "gramos" in l or "lista para calibrar" in l, timeout
+        )
+    except ERRORES_PUERTO:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"Error durante la calibración: {e}"}, False
+
+    if linea:
+        return {"status": "success", "message": "Balanza tarada. Por favor, coloca el peso conocido."}, True
+    return {"status": "error", "message": ultima or "No se recibió respuesta."}, False
+
+
+def fijar_peso_balanza(ser, nombre_balanza, peso_conocido, timeout=5):
+    """Paso 2 de la calibración sobre una conexión abierta."""
+    if TEST_MODE:
+        factor = "-613.43000"
+        message = f"Balanza {nombre_balanza.upper()} calibrada. Nuevo factor: {factor} guardado en EEPROM."
+        return {"status": "success", "message": message, "factor": factor}, True
+
+    comando = _comando_balanza(nombre_balanza)
+    if not comando:
+        return {"status": "error", "message": "Nombre de balanza no válido. Use 'A' o 'B'."}, False
+
+    try:
+        ser.write(comando)
+        ser.write(f"{peso_conocido}\n".encode())
+        linea, ultima = _esperar_linea(ser, lambda l: "calibrada" in l, timeout)
+    except ERRORES_PUERTO:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"Error durante la calibración: {e}"}, False
+
+    if linea:
+        match = re.search(r"Nuevo factor: (.*?) guardado", linea)
+        factor = match.group(1).strip() if match else "Desconocido"
+        return {"status": "success", "message": linea, "factor": factor}, True
+    return {"status": "error", "message": ultima or "No se recibió respuesta final."}, False
+
+
+# --- Acciones de línea de comandos (abren y cierran el puerto en cada llamada) ---
+
+def _ejecutar_con_conexion(operacion, *args):
+    """Abre el puerto (salvo en TEST_MODE), ejecuta la operación e imprime el JSON."""
+    ser = None
+    if not TEST_MODE:
+        ser = get_serial_connection()
+        if not ser:
             return
+    try:
+        output, success = operacion(ser, *args)
+    except ERRORES_PUERTO as e:
+        output, success = {"error": f"Error de comunicación con la ESP32: {e}"}, False
+    finally:
+        if ser and ser.is_open: ser.close()
+
+    if success:
+        print(json.dumps(output))
     else:
-        ser = get_serial_connection()
-        if not ser: return
-        try:
-            key_to_send = None
-            for key, value in sensores.items():
-                if value == filtro_etiqueta:
-                    key_to_send = key
-                    break
-            if not key_to_send:
-                print(json.dumps({"error": f"Sensor '{filtro_etiqueta}' no encontrado."}), file=sys.stderr)
-                return
-            
-            ser.write(f"{key_to_send}\n".encode())
-            inicio = time.time()
-            while time.time() - inicio < 2:
-                if ser.in_waiting > 0:
-                    linea = ser.readline().decode('utf-8', errors='ignore').strip()
-                    if filtro_etiqueta in linea:
-                        valor_final = linea.split(':')[-1].strip()
-                        break
-        except Exception as e:
-            print(json.dumps({"error": f"Error leyendo datos: {e}"}), file=sys.stderr)
-        finally:
-            if ser and ser.is_open: ser.close()
-    
-    # Imprime la respuesta como un objeto JSON
-    print(json.dumps({filtro_etiqueta: valor_final}))
+        print(json.dumps(output), file=sys.stderr)
+
+
+def leer_datos_serial(filtro_etiqueta):
+    """Lee datos del puerto serial (real o simulado) y los imprime como JSON."""
+    _ejecutar_con_conexion(consultar_sensor, filtro_etiqueta)
+
+
+def leer_varios_sensores(etiquetas):
+    """Lee varios sensores (separados por comas) en una sola conexión."""
+    _ejecutar_con_conexion(consultar_sensores, [e for e in etiquetas.split(',') if e])
 
 
 def activar_motor():
     """Envía el comando para activar el motor y devuelve un mensaje JSON."""
-    if TEST_MODE:
-        print(json.dumps({"message": "Comando de activación de motor ejecutado."}))
-    else:
-        ser = get_serial_connection()
-        if not ser: return
-        try:
-            ser.write(b'r\n')
-            print(json.dumps({"message": "Comando de activación de motor enviado."}))
-        except Exception as e:
-            print(json.dumps({"error": f"Error al activar el motor: {e}"}), file=sys.stderr)
-        finally:
-            if ser and ser.is_open: ser.close()
+    _ejecutar_con_conexion(enviar_motor)
 
 def activar_bomba():
     """Envía el comando para activar la bomba de agua y devuelve un mensaje JSON."""
-    if TEST_MODE:
-        print(json.dumps({"message": "Comando de activación de bomba ejecutado."}))
-    else:
-        ser = get_serial_connection()
-        if not ser: return
-        try:
-            ser.write(b'b\n')
-            print(json.dumps({"message": "Comando de activación de bomba enviado."}))
-        except Exception as e:
-            print(json.dumps({"error": f"Error al activar la bomba: {e}"}), file=sys.stderr)
-        finally:
-            if ser and ser.is_open: ser.close()
+    _ejecutar_con_conexion(enviar_bomba)
 
 
 def calibrar_balanza_tara(nombre_balanza):
     """
     Paso 1: Inicia la rutina de calibración tarando la balanza.
     """
-    if TEST_MODE:
-        print(json.dumps({"status": "success", "message": "Modo de prueba: Balanza tarada. Ahora coloca el peso."}))
-        return
-    else:
-        ser = get_serial_connection()
-        if not ser:
-            print(json.dumps({"status": "error", "message": "Error al conectar con la ESP32."}), file=sys.stderr)
-            return
-        
-        try:
-            if nombre_balanza.upper() == 'A':
-                ser.write(b'c\n')
-            elif nombre_balanza.upper() == 'B':
-                ser.write(b'd\n')
-            else:
-                print(json.dumps({"status": "error", "message": "Nombre de balanza no válido. Use 'A' o 'B'."}), file=sys.stderr)
-                return
-            
-            # Leer la respuesta de la ESP32 que indica que está lista
-            inicio = time.time()
-            response_line = "No se recibió respuesta."
-            while time.time() - inicio < 5:
-                if ser.in_waiting > 0:
-                    response_line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    if "gramos" in response_line or "lista para calibrar" in response_line:
-                         print(json.dumps({"status": "success", "message": "Balanza tarada. Por favor, coloca el peso conocido."}))
-                         return
-
-            print(json.dumps({"status": "error", "message": response_line}), file=sys.stderr)
-
-        except Exception as e:
-            print(json.dumps({"status": "error", "message": f"Error durante la calibración: {e}"}), file=sys.stderr)
-        finally:
-            if ser and ser.is_open: ser.close()
+    _ejecutar_con_conexion(tarar_balanza, nombre_balanza)
 
 
 def calibrar_balanza_peso(nombre_balanza, peso_conocido):
     """
     Paso 2: Envía el peso conocido para finalizar la calibración.
     """
-    if TEST_MODE:
-        factor = "-613.43000"
-        message = f"Balanza {nombre_balanza.upper()} calibrada. Nuevo factor: {factor} guardado en EEPROM."
-        print(json.dumps({"status": "success", "message": message, "factor": factor}))
-        return
-    else:
-        ser = get_serial_connection()
-        if not ser:
-            print(json.dumps({"status": "error", "message": "Error al conectar con la ESP32."}), file=sys.stderr)
-            return
-
-        try:
-            if nombre_balanza.upper() == 'A':
-                ser.write(b'c\n')
-            elif nombre_balanza.upper() == 'B':
-                ser.write(b'd\n')
-            else:
-                print(json.dumps({"status": "error", "message": "Nombre de balanza no válido. Use 'A' o 'B'."}), file=sys.stderr)
-                return
-
-            ser.write(f"{peso_conocido}\n".encode())
-            
-            inicio = time.time()
-            response_line = "No se recibió respuesta final."
-            while time.time() - inicio < 5:
-                if ser.in_waiting > 0:
-                    response_line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    if "calibrada" in response_line:
-                        match = re.search(r"Nuevo factor: (.*?) guardado", response_line)
-                        factor = match.group(1).strip() if match else "Desconocido"
-                        print(json.dumps({"status": "success", "message": response_line, "factor": factor}))
-                        return
-
-            print(json.dumps({"status": "error", "message": response_line}), file=sys.stderr)
-
-        except Exception as e:
-            print(json.dumps({"status": "error", "message": f"Error durante la calibración: {e}"}), file=sys.stderr)
-        finally:
-            if ser and ser.is_open: ser.close()
+    _ejecutar_con_conexion(fijar_peso_balanza, nombre_balanza, peso_conocido)
 
 
 # Esta sección permite que el script se ejecute desde la línea de comandos
@@ -202,9 +288,11 @@ if __name__ == '__main__':
         sys.exit(1)
 
     accion = sys.argv[1]
-    
+
     if accion == 'leer_datos_serial' and len(sys.argv) == 3:
         leer_datos_serial(sys.argv[2])
+    elif accion == 'leer_varios_sensores' and len(sys.argv) == 3:
+        leer_varios_sensores(sys.argv[2])
     elif accion == 'activar_motor':
         activar_motor()
     elif accion == 'activar_bomba':
@@ -215,4 +303,4 @@ if __name__ == '__main__':
         calibrar_balanza_peso(sys.argv[2], sys.argv[3])
     else:
         print(json.dumps({"error": "Acción o argumentos inválidos."}), file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
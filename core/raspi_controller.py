@@ -2,6 +2,7 @@ import sys
 import subprocess
 import json
 import os
+import wave
 
 def grabar_video(duracion_segundos, ruta_salida):
     """
@@ -46,6 +47,58 @@ def grabar_video(duracion_segundos, ruta_salida):
     except Exception as e:
         return {"error": f"Ocurrió un error inesperado: {e}"}, False
 
+def transcodificar_audio(ruta_entrada, ruta_salida):
+    """
+    Convierte un audio a WAV PCM 16 bits mono 22050 Hz: ffplay lo abre sin
+    decodificar nada, así que la reproducción empieza al instante.
+    """
+    if not os.path.exists(ruta_entrada):
+        return {"error": f"El archivo de audio no se encontró en la ruta: {ruta_entrada}"}, False
+
+    directorio_salida = os.path.dirname(ruta_salida)
+    if not os.path.exists(directorio_salida):
+        os.makedirs(directorio_salida)
+
+    command = [
+        'ffmpeg',
+        '-nostdin',
+        '-y',
+        '-loglevel', 'error',
+        '-i', ruta_entrada,
+        '-vn',
+        '-ac', '1',
+        '-ar', '22050',
+        '-c:a', 'pcm_s16le',
+        ruta_salida
+    ]
+
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True, timeout=60)
+        with wave.open(ruta_salida, 'rb') as wav:
+            duracion = wav.getnframes() / wav.getframerate()
+        return {"message": "Audio transcodificado.", "ruta": ruta_salida, "duracion": duracion}, True
+    except FileNotFoundError:
+        return {"error": "ffmpeg no está instalado o no se encuentra en el PATH."}, False
+    except subprocess.CalledProcessError as e:
+        return {"error": "El archivo no es un audio válido.", "detalles": e.stderr}, False
+    except subprocess.TimeoutExpired:
+        return {"error": "La conversión del audio excedió el tiempo de espera."}, False
+    except Exception as e:
+        return {"error": f"Ocurrió un error inesperado: {e}"}, False
+
+
+def comando_reproducir_audio(ruta_archivo):
+    """Comando de ffplay para reproducir un archivo sin ventana."""
+    return [
+        'ffplay',
+        '-nodisp',      # Evita que se abra una ventana.
+        '-autoexit',    # Sale automáticamente cuando la reproducción termina.
+        '-loglevel',    # Establece el nivel de registro.
+        'quiet',
+        ruta_archivo
+    ]
+
+
 def reproducir_audio(ruta_archivo):
     """
     Reproduce un archivo de audio usando ffplay.
@@ -54,14 +107,7 @@ def reproducir_audio(ruta_archivo):
         return {"error": f"El archivo de audio no se encontró en la ruta: {ruta_archivo}"}, False
     
     try:
-        command = [
-            'ffplay',
-            '-nodisp',      # Evita que se abra una ventana.
-            '-autoexit',    # Sale automáticamente cuando la reproducción termina.
-            '-loglevel',    # Establece el nivel de registro.
-            'quiet',
-            ruta_archivo
-        ]
+        command = comando_reproducir_audio(ruta_archivo)
         
         # Ejecuta el comando
         result = subprocess.run(command, check=True, capture_output=True, text=True, timeout=30)
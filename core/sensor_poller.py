@@ -0,0 +1,88 @@
+import sys
+import threading
+import time
+
+from .serial_manager import ColaESP32Llena
+
+
+class CacheSensores:
+    """Último valor conocido de cada sensor, con la hora en que se leyó."""
+
+    def __init__(self):
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def actualizar(self, lecturas, timestamp=None):
+        """Guarda un diccionario {etiqueta: valor}; ignora los sensores que no respondieron."""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            for etiqueta, valor in lecturas.items():
+                if valor and valor != "No se recibió respuesta":
+                    self._valores[etiqueta] = (valor, timestamp)
+
+    def obtener(self, etiqueta, max_age=None):
+        """
+        Devuelve {"valor", "timestamp", "age"} o None si no hay dato
+        o si es más viejo que `max_age` segundos.
+        """
+        with self._lock:
+            dato = self._valores.get(etiqueta)
+        if dato is None:
+            return None
+        valor, timestamp = dato
+        edad = time.time() - timestamp
+        if max_age is not None and edad > max_age:
+            return None
+        return {"valor": valor, "timestamp": timestamp, "age": round(edad, 3)}
+
+
+class SensorPoller:
+    """
+    Hilo de fondo que lee todos los sensores cada `intervalo` segundos
+    (en un solo comando por lote) y guarda el resultado en la cache.
+    `al_leer(lecturas)` se llama con cada muestra correcta (p. ej. para persistirla).
+    """
+
+    def __init__(self, esp32, cache, intervalo=5, al_leer=None):
+        self.esp32 = esp32
+        self.cache = cache
+        self.intervalo = intervalo
+        self.al_leer = al_leer
+        self._hilo = None
+        self._detener = threading.Event()
+        self._ultimo_error = None
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="esp32-poller", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=2)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                output, error = self.esp32.leer_sensores()
+            except ColaESP32Llena:
+                # Las peticiones de los usuarios tienen prioridad: saltamos esta muestra
+                output, error = None, None
+
+            if output:
+                self.cache.actualizar(output)
+                self._ultimo_error = None
+                if self.al_leer:
+                    try:
+                        self.al_leer(output)
+                    except Exception as e:
+                        print(f"❌ Poller de sensores: {e}", file=sys.stderr)
+            elif error and error != self._ultimo_error:
+                # Solo se registra cuando cambia, para no llenar el log si no hay ESP32
+                print(f"❌ Poller de sensores: {error}", file=sys.stderr)
+                self._ultimo_error = error
+
+            self._detener.wait(self.intervalo)
@@ -0,0 +1,181 @@
+import sys
+import queue
+import itertools
+import threading
+import time
+
+from . import esp32_controller
+from .esp32_controller import (
+    PUERTO, BAUDRATE, ERRORES_PUERTO,
+    consultar_sensor, consultar_sensores, enviar_motor, enviar_bomba, tarar_balanza, fijar_peso_balanza,
+)
+from .transports import SerialTransport
+
+
+class ColaESP32Llena(Exception):
+    """La cola de comandos de la ESP32 está llena; el cliente debe reintentar."""
+
+
+class ComandoESP32:
+    """
+    Un comando pendiente en la cola del UART.
+
+    El `id` identifica la petición en los logs y errores; como el hilo de E/S
+    ejecuta un solo comando a la vez y vacía el buffer de entrada antes de
+    escribir, todas las líneas leídas mientras corre pertenecen a este comando.
+    """
+    _contador = itertools.count(1)
+
+    def __init__(self, operacion, args, timeout):
+        self.id = next(self._contador)
+        self.operacion = operacion
+        self.args = args
+        self.timeout = timeout
+        self.limite = time.monotonic() + timeout
+        self.listo = threading.Event()
+        self.salida = None
+
+    def resolver(self, output, success):
+        self.salida = (output, success)
+        self.listo.set()
+
+
+class ESP32SerialManager:
+    """
+    Mantiene una única conexión serial con la ESP32 durante toda la vida del servidor.
+
+    Todo el acceso al puerto lo hace un solo hilo de E/S que ejecuta los comandos
+    en orden, así que las vistas ya no lanzan un proceso nuevo ni esperan los 2 s
+    de estabilización en cada petición (solo se esperan al abrir el puerto).
+    Los métodos públicos devuelven (salida, error): la salida JSON o el error.
+
+    La cola es acotada: si hay `max_cola` comandos esperando se lanza
+    `ColaESP32Llena` en lugar de acumular peticiones sin límite.
+
+    La conexión la abre `transporte` (ver transports.py); por defecto el UART
+    real en `puerto`/`baudrate`.
+    """
+
+    def __init__(self, puerto=PUERTO, baudrate=BAUDRATE, timeout_respuesta=10, max_cola=32, transporte=None):
+        self.transporte = transporte or SerialTransport(puerto, baudrate)
+        self.puerto = str(self.transporte)
+        self.timeout_respuesta = timeout_respuesta
+        self._ser = None
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._hilo = None
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        """Arranca el hilo de E/S (idempotente)."""
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name=f"esp32-io-{self.puerto}", daemon=True)
+            self._hilo.start()
+
+    def cerrar(self):
+        """Detiene el hilo de E/S y cierra el puerto."""
+        self._detener.set()
+        try:
+            self._cola.put_nowait(None)
+        except queue.Full:
+            pass
+        if self._hilo:
+            self._hilo.join(timeout=2)
+        self._cerrar_puerto()
+
+    def _abrir_puerto(self):
+        if esp32_controller.TEST_MODE:
+            return None
+        if self._ser and self._ser.is_open:
+            return self._ser
+        self._ser = self.transporte.abrir()
+        # La ESP32 se reinicia al abrir el puerto: solo esperamos esta vez.
+        time.sleep(self.transporte.tiempo_estabilizacion)
+        print(f"✅ Puerto serial {self.puerto} abierto")
+        return self._ser
+
+    def _cerrar_puerto(self):
+        try:
+            if self._ser and self._ser.is_open:
+                self._ser.close()
+        except Exception:
+            pass
+        self._ser = None
+
+    # --- Hilo de E/S ---
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            comando = self._cola.get()
+            if comando is None:
+                break
+            if time.monotonic() > comando.limite:
+                # Quien lo pidió ya dejó de esperar: no gastar tiempo de UART
+                comando.resolver({"error": f"Comando #{comando.id} expiró en la cola."}, False)
+                continue
+            try:
+                ser = self._abrir_puerto()
+            except Exception as e:
+                comando.resolver({"error": f"Error al conectar con el puerto serial: {e}"}, False)
+                continue
+
+            try:
+                if ser is not None:
+                    # Descartar líneas viejas para no mezclar respuestas entre comandos
+                    ser.reset_input_buffer()
+                comando.resolver(*comando.operacion(ser, *comando.args))
+            except ERRORES_PUERTO as e:
+                # El puerto se cayó: se reabre en el siguiente comando
+                self._cerrar_puerto()
+                comando.resolver({"error": f"Error de comunicación con la ESP32: {e}"}, False)
+            except Exception as e:
+                comando.resolver({"error": f"Ocurrió un error inesperado: {e}"}, False)
+
+    def _ejecutar(self, operacion, *args, timeout=None):
+        """
+        Encola un comando y espera su resultado.
+
+        `timeout` es el límite total del comando (espera en cola + ejecución).
+        Lanza `ColaESP32Llena` si la cola no admite más comandos.
+        """
+        self.iniciar()
+        comando = ComandoESP32(operacion, args, timeout or self.timeout_respuesta)
+        try:
+            self._cola.put_nowait(comando)
+        except queue.Full:
+            raise ColaESP32Llena("La ESP32 está ocupada, intenta de nuevo en unos segundos.")
+
+        if not comando.listo.wait(comando.timeout):
+            return None, {"error": f"La ESP32 excedió el tiempo de espera (comando #{comando.id})."}
+
+        output, success = comando.salida
+        if not success:
+            print(f"❌ ESP32 comando #{comando.id}: {output}", file=sys.stderr)
+            return None, output
+        return output, None
+
+    # --- Acciones ---
+
+    def leer_sensor(self, etiqueta):
+        return self._ejecutar(consultar_sensor, etiqueta, timeout=5)
+
+    def leer_sensores(self, etiquetas=None):
+        """Lee varios sensores (todos si `etiquetas` es None) en un solo comando encolado."""
+        return self._ejecutar(consultar_sensores, etiquetas, timeout=5)
+
+    def activar_motor(self):
+        return self._ejecutar(enviar_motor)
+
+    def activar_bomba(self):
+        return self._ejecutar(enviar_bomba)
+
+    def calibrar_balanza_tara(self, nombre_balanza):
+        return self._ejecutar(tarar_balanza, nombre_balanza)
+
+    def calibrar_balanza_peso(self, nombre_balanza, peso_conocido):
+        return self._ejecutar(fijar_peso_balanza, nombre_balanza, peso_conocido)
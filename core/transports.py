@@ -0,0 +1,229 @@
+"""
+Transportes para hablar con la ESP32.
+
+El gestor serial (serial_manager.py) no abre el puerto directamente: le pide
+una conexión a su transporte. `SerialTransport` abre el UART real,
+`TcpTransport` un puente TCP-serial (ser2net, ESP-Link, etc.) y
+`SimuladoTransport` devuelve una ESP32 simulada en el mismo proceso, con la
+misma interfaz que serial.Serial (write, readline, in_waiting,
+reset_input_buffer, close), para probar y medir el camino del hardware sin
+la placa.
+"""
+import random
+import threading
+import time
+
+import serial
+
+from .esp32_controller import PUERTO, BAUDRATE, TIEMPO_ESTABILIZACION, sensores
+
+
+class SerialTransport:
+    """Puerto UART real."""
+
+    def __init__(self, puerto=PUERTO, baudrate=BAUDRATE):
+        self.puerto = puerto
+        self.baudrate = baudrate
+        # La ESP32 se reinicia al abrir el puerto
+        self.tiempo_estabilizacion = TIEMPO_ESTABILIZACION
+
+    def abrir(self):
+        return serial.Serial(self.puerto, self.baudrate, timeout=1)
+
+    def __str__(self):
+        return self.puerto
+
+
+class TcpTransport:
+    """Puente TCP-serial en `direccion` ("host:puerto"), vía serial_for_url de pyserial."""
+
+    def __init__(self, direccion):
+        self.direccion = direccion
+        # Abrir el socket no reinicia la ESP32 del otro lado
+        self.tiempo_estabilizacion = 0
+
+    def abrir(self):
+        return serial.serial_for_url(f"socket://{self.direccion}", timeout=1)
+
+    def __str__(self):
+        return f"tcp://{self.direccion}"
+
+
+class SimuladoTransport:
+    """
+    ESP32 simulada. Opciones:
+
+    - `latencia`: segundos que tarda el firmware en procesar cada comando.
+    - `tasa_error`: probabilidad de que un comando no reciba respuesta.
+    - `tasa_corrupcion`: probabilidad de que la respuesta llegue con basura.
+    - `tasa_desconexion`: probabilidad por escritura de que el puerto se caiga.
+    - `duracion_motor` / `duracion_bomba`: tiempo que el firmware queda ocupado.
+    - `semilla`: para repetir exactamente la misma secuencia de errores.
+    """
+
+    def __init__(self, baudrate=BAUDRATE, latencia=0.01, tasa_error=0.0, tasa_corrupcion=0.0,
+                 tasa_desconexion=0.0, duracion_motor=0.5, duracion_bomba=0.5, semilla=None):
+        self.baudrate = baudrate
+        self.opciones = dict(
+            latencia=latencia, tasa_error=tasa_error, tasa_corrupcion=tasa_corrupcion,
+            tasa_desconexion=tasa_desconexion, duracion_motor=duracion_motor, duracion_bomba=duracion_bomba,
+        )
+        self._random = random.Random(semilla)
+        self.tiempo_estabilizacion = 0
+
+    def abrir(self):
+        return ESP32Simulada(self.baudrate, self._random, **self.opciones)
+
+    def __str__(self):
+        return "simulado"
+
+
+TRANSPORTES = {
+    'serial': SerialTransport,
+    'tcp': TcpTransport,
+    'simulado': SimuladoTransport,
+}
+
+
+def crear_transporte(tipo, **opciones):
+    """Crea el transporte `tipo` ('serial', 'tcp' o 'simulado') con sus opciones."""
+    try:
+        clase = TRANSPORTES[tipo]
+    except KeyError:
+        raise ValueError(f"Transporte '{tipo}' no válido. Opciones: {', '.join(TRANSPORTES)}.")
+    return clase(**opciones)
+
+
+class ESP32Simulada:
+    """
+    Imita el firmware: un hilo lee líneas de comando y escribe las respuestas
+    con el tiempo que tardarían en el cable (10 bits por byte al baudrate).
+
+    Protocolo: '1'-'4' leen un sensor ("PESO_A: 123.45 g"), 'r' activa el
+    motor, 'b' la bomba, 'c'/'d' taran la balanza A/B y luego esperan el peso
+    conocido en gramos para calcular el factor de calibración.
+    """
+    BALANZAS = {'c': 'A', 'd': 'B'}
+
+    def __init__(self, baudrate, aleatorio, latencia, tasa_error, tasa_corrupcion,
+                 tasa_desconexion, duracion_motor, duracion_bomba):
+        self.baudrate = baudrate
+        self.timeout = 1
+        self.latencia = latencia
+        self.tasa_error = tasa_error
+        self.tasa_corrupcion = tasa_corrupcion
+        self.tasa_desconexion = tasa_desconexion
+        self.duracion_motor = duracion_motor
+        self.duracion_bomba = duracion_bomba
+        self._random = aleatorio
+        self._entrada = bytearray()
+        self._salida = bytearray()
+        self._condicion = threading.Condition()
+        self._esperando_peso = None
+        self.is_open = True
+        self._hilo = threading.Thread(target=self._firmware, name="esp32-simulada", daemon=True)
+        self._hilo.start()
+
+    def _tiempo_en_cable(self, cantidad_bytes):
+        return cantidad_bytes * 10 / self.baudrate
+
+    # --- Interfaz de serial.Serial ---
+
+    def write(self, datos):
+        if not self.is_open:
+            raise serial.SerialException("Puerto simulado cerrado.")
+        if self._random.random() < self.tasa_desconexion:
+            self.close()
+            raise serial.SerialException("La ESP32 simulada se desconectó.")
+        time.sleep(self._tiempo_en_cable(len(datos)))
+        with self._condicion:
+            self._entrada.extend(datos)
+            self._condicion.notify_all()
+        return len(datos)
+
+    @property
+    def in_waiting(self):
+        with self._condicion:
+            return len(self._salida)
+
+    def readline(self):
+        limite = time.monotonic() + self.timeout
+        with self._condicion:
+            while b'\n' not in self._salida:
+                restante = limite - time.monotonic()
+                if restante <= 0 or not self.is_open:
+                    # Como pyserial: al vencer el timeout devuelve lo que haya
+                    linea = bytes(self._salida)
+                    self._salida.clear()
+                    return linea
+                self._condicion.wait(restante)
+            fin = self._salida.index(b'\n') + 1
+            linea = bytes(self._salida[:fin])
+            del self._salida[:fin]
+            return linea
+
+    def reset_input_buffer(self):
+        with self._condicion:
+            self._salida.clear()
+
+    def close(self):
+        with self._condicion:
+            self.is_open = False
+            self._condicion.notify_all()
+
+    # --- Firmware ---
+
+    def _siguiente_comando(self):
+        with self._condicion:
+            while self.is_open and b'\n' not in self._entrada:
+                self._condicion.wait()
+            if not self.is_open:
+                return None
+            fin = self._entrada.index(b'\n') + 1
+            linea = self._entrada[:fin].decode('utf-8', errors='ignore').strip()
+            del self._entrada[:fin]
+            return linea
+
+    def _responder(self, texto):
+        if self._random.random() < self.tasa_error:
+            return
+        if self._random.random() < self.tasa_corrupcion:
+            posicion = self._random.randrange(len(texto))
+            texto = texto[:posicion] + '�' + texto[posicion + 1:]
+        datos = f"{texto}\r\n".encode()
+        time.sleep(self._tiempo_en_cable(len(datos)))
+        with self._condicion:
+            self._salida.extend(datos)
+            self._condicion.notify_all()
+
+    def _lectura_sensor(self, etiqueta):
+        if etiqueta.startswith('PESO'):
+            return f"{self._random.uniform(10, 200):.2f} g"
+        return f"{self._random.uniform(2, 7):.1f} cm"
+
+    def _firmware(self):
+        while True:
+            comando = self._siguiente_comando()
+            if comando is None:
+                return
+            time.sleep(self.latencia)
+
+            if self._esperando_peso and comando.replace('.', '', 1).isdigit():
+                balanza = self._esperando_peso
+                self._esperando_peso = None
+                factor = -613.43 * (1 + self._random.uniform(-0.01, 0.01))
+                self._responder(f"Balanza {balanza} calibrada. Nuevo factor: {factor:.5f} guardado en EEPROM.")
+            elif comando in sensores:
+                etiqueta = sensores[comando]
+                self._responder(f"{etiqueta}: {self._lectura_sensor(etiqueta)}")
+            elif comando == 'r':
+                time.sleep(self.duracion_motor)
+                self._responder("Motor activado")
+            elif comando == 'b':
+                time.sleep(self.duracion_bomba)
+                self._responder("Bomba activada")
+            elif comando in self.BALANZAS:
+                self._esperando_peso = self.BALANZAS[comando]
+                self._responder(f"Balanza {self._esperando_peso} tarada y lista para calibrar. Envía el peso conocido en gramos.")
+            else:
+                self._responder(f"Comando desconocido: {comando}")